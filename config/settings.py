@@ -31,11 +31,12 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # core раньше staticfiles: его collectstatic сначала собирает static/build/
+    'core',
     'django.contrib.staticfiles',
     'django.contrib.sites',
     'django.contrib.sitemaps',
     'django_ckeditor_5',
-    'core',
 ]
 
 SITE_ID = 1
@@ -57,8 +58,15 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Скомпилированные шаблоны держатся в памяти процесса и при DEBUG;
+            # в разработке правки шаблонов сбрасывают их через автоперезагрузку
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -74,11 +82,69 @@ WSGI_APPLICATION = 'config.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # sqlite3 + режим BEGIN IMMEDIATE для транзакций (см. core/db)
+        'ENGINE': 'core.db',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+        },
     }
 }
 
+# PRAGMA для каждого соединения SQLite: WAL позволяет читать во время записи,
+# busy_timeout — ждать блокировку вместо «database is locked»
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),  # мс
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))),  # байт
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-16000')),  # минус — в КиБ
+    'temp_store': os.getenv('SQLITE_TEMP_STORE', 'MEMORY'),
+}
+
+# Общий для всех воркеров кеш: версии контента, снимки настроек, страницы.
+# core.filecache — FileBasedCache с атомарными add()/incr() между процессами;
+# при MAX_ENTRIES записей кеш удаляет треть файлов, поэтому запас с избытком
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'core.filecache.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '3000'))},
+    },
+    # Счётчики лимита заявок — отдельно: поток заявок с множества IP
+    # не вытесняет из общего кеша страницы и состояние предохранителя
+    'ratelimit': {
+        'BACKEND': os.getenv('RATELIMIT_CACHE_BACKEND', 'core.filecache.FileBasedCache'),
+        'LOCATION': os.getenv('RATELIMIT_CACHE_LOCATION', str(BASE_DIR / '.cache' / 'ratelimit')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RATELIMIT_CACHE_MAX_ENTRIES', '10000'))},
+    },
+    # Фрагменты шаблонов ({% cache %}): ключ включает версии настроек и меню,
+    # которые считаются по содержимому, поэтому хватает памяти процесса
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+# Как часто (в секундах) процесс сверяет версии закешированных данных
+CONTENT_VERSION_CHECK_INTERVAL = float(os.getenv('CONTENT_VERSION_CHECK_INTERVAL', '5'))
+
+# Время жизни полностраничного кеша (секунды); сбрасывается при изменении контента
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', '86400'))
+
+# Архив старых заявок (manage.py archive_leads): каталог и срок хранения в базе, дней
+LEADS_ARCHIVE_DIR = Path(os.getenv('LEADS_ARCHIVE_DIR', str(BASE_DIR / 'archive')))
+LEADS_RETENTION_DAYS = int(os.getenv('LEADS_RETENTION_DAYS', '365'))
+
+# Уменьшенные копии загруженных картинок (core/images.py): ширины в пикселях,
+# качество WebP/JPEG и число потоков сборки (0 — собирать сразу, в том же потоке)
+IMAGE_VARIANT_WIDTHS = tuple(int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '480,800,1200,1600').split(','))
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', '80'))
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', '2'))
+# Атрибут sizes для картинок в тексте страниц (колонка .content-block — 800px)
+IMAGE_CONTENT_SIZES = '(max-width: 800px) 100vw, 800px'
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -94,12 +160,18 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+# Результат manage.py build_assets (запускается и из collectstatic); внутри STATICFILES_DIRS[0]
+ASSETS_BUILD_DIR = BASE_DIR / 'static' / 'build'
+# Тесты не видят локальную сборку статики (ASSETS_BUILD_DIR подменяется пустым каталогом)
+TEST_RUNNER = 'core.test_runner.TestRunner'
+# Процессы для сжатия статики (.gz/.br) в collectstatic; 0 — по числу ядер
+STATICFILES_COMPRESS_WORKERS = int(os.getenv('STATICFILES_COMPRESS_WORKERS', '0'))
 STORAGES = {
     'default': {
         'BACKEND': 'django.core.files.storage.FileSystemStorage',
     },
     'staticfiles': {
-        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+        'BACKEND': 'core.storage.IncrementalStaticFilesStorage',
     },
 }
 
@@ -155,4 +227,5 @@ CKEDITOR_5_CONFIGS = {
     },
 }
 
-CKEDITOR_5_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+# После загрузки картинки ставит в очередь сборку её уменьшенных копий
+CKEDITOR_5_FILE_STORAGE = 'core.storage.VariantFileSystemStorage'
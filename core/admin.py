@@ -1,6 +1,126 @@
+import hashlib
+
 from django.contrib import admin
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from .models import SiteSettings, Page, ContactRequest
+
+from .cache import get_version
+from .exports import FORMATS, stream_export
+from .models import SiteSettings, Page, ContactRequest, NotificationOutbox
+from .search import CONTACT_FTS_TABLE, PAGE_FTS_TABLE, filter_pages, fts_available, search_contact_requests
+
+# Даты списка заявок кешируются до следующего изменения заявок
+# (версия 'contacts'); таймаут — страховка от разросшегося кеша
+ADMIN_CACHE_TIMEOUT = 3600
+# Число заявок по фильтрам — оценка: пересчитывается раз в ADMIN_COUNT_TIMEOUT,
+# а не после каждой новой заявки или отметки «обработана»
+ADMIN_COUNT_TIMEOUT = 300
+# Параметр ссылки на следующую страницу: pk последней заявки текущей
+SEEK_VAR = 'after'
+
+
+def contacts_cache_key(kind, raw):
+    raw = f'{get_version("contacts")}:{raw}'
+    return f'core:admin:{kind}:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+class ContactRequestPaginator(Paginator):
+    """Пагинатор списка заявок без COUNT(*) и OFFSET на каждый показ.
+
+    Число записей оценивается: без фильтров — по диапазону pk (MIN и MAX
+    берутся из индекса), с фильтрами — точный COUNT(*) раз в ADMIN_COUNT_TIMEOUT.
+    При сортировке по умолчанию (-created_at, -pk) страница выбирается по
+    ключу: строки после (created_at, pk) последней заявки предыдущей
+    страницы. Её pk приходит в ссылке «следующая страница» (SEEK_VAR);
+    только переход на произвольный номер ищет границу по индексу
+    core_contact_created_idx с пропуском строк.
+    """
+
+    SEEK_ORDERING = ('-created_at', '-pk')
+
+    def __init__(self, *args, after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            self.after = int(after) if after is not None else None
+        except ValueError:
+            self.after = None
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            bounds = queryset.order_by().aggregate(low=Min('pk'), high=Max('pk'))
+            return 0 if bounds['high'] is None else bounds['high'] - bounds['low'] + 1
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        key = 'core:admin:count:' + hashlib.md5(f'{sql}:{params}'.encode('utf-8')).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, ADMIN_COUNT_TIMEOUT)
+        return count
+
+    def boundary(self, number):
+        """(created_at, pk) последней строки страницы number - 1 или None"""
+        queryset = self.object_list.values_list('created_at', 'pk')
+        if self.after is not None:
+            # Курсор проверяется тем же запросом: заявка из чужого фильтра не подойдёт
+            row = list(queryset.filter(pk=self.after)[:1])
+            if row:
+                return row[0]
+        offset = (number - 1) * self.per_page - 1
+        row = list(queryset[offset:offset + 1])
+        return row[0] if row else None
+
+    def page(self, number):
+        number = self.validate_number(number)
+        queryset = self.object_list
+        # ChangeList дописывает сортировку модели и pk повторно — сравниваем без дублей
+        ordering = tuple(dict.fromkeys(queryset.query.order_by))
+        if number == 1 or ordering != self.SEEK_ORDERING:
+            return super().page(number)
+        boundary = self.boundary(number)
+        if boundary is None:
+            return self._get_page([], number, self)
+        created_at, pk = boundary
+        rows = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, pk__gte=pk)
+        return self._get_page(rows[:self.per_page], number, self)
+
+
+class ContactRequestChangeList(ChangeList):
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(SEEK_VAR, None)
+        return params
+
+    def get_query_string(self, new_params=None, remove=None):
+        """Курсор действует на одну страницу: его получает только ссылка на следующую"""
+        new_params = {SEEK_VAR: None, **(new_params or {})}
+        if new_params.get(PAGE_VAR) == self.page_num + 1 and not self.show_all:
+            rows = list(self.result_list)
+            if rows:
+                new_params[SEEK_VAR] = rows[-1].pk
+        return super().get_query_string(new_params, remove)
+
+    @cached_property
+    def date_hierarchy_facets(self):
+        """Ссылки date_hierarchy: DISTINCT по датам считается раз на версию заявок"""
+        key = contacts_cache_key('dates', self.get_query_string())
+        facets = cache.get(key)
+        if facets is None:
+            facets = date_hierarchy(self)
+            cache.set(key, facets, ADMIN_CACHE_TIMEOUT)
+        return facets
 
 
 @admin.register(SiteSettings)
@@ -24,9 +144,14 @@ class SiteSettingsAdmin(admin.ModelAdmin):
             'description': 'Настройки для отправки заявок в Telegram группу'
         }),
         ('Антиспам (reCAPTCHA v3)', {
-            'fields': ('recaptcha_site_key', 'recaptcha_secret_key', 'recaptcha_min_score'),
+            'fields': ('recaptcha_site_key', 'recaptcha_secret_key', 'recaptcha_min_score',
+                       'recaptcha_timeout', 'recaptcha_fail_open'),
             'description': 'Защита от спама. Получите ключи на google.com/recaptcha (выберите reCAPTCHA v3)'
         }),
+        ('Защита от флуда', {
+            'fields': ('rate_limit_window', 'rate_limit_per_ip', 'rate_limit_per_phone'),
+            'description': 'Лишние заявки отклоняются сразу, до проверки reCAPTCHA и записи в базу'
+        }),
         ('Яндекс', {
             'fields': ('yandex_metrika', 'yandex_verification'),
             'description': 'Яндекс.Метрика: вставьте код счётчика целиком. Вебмастер: укажите только значение content из мета-тега верификации.'
@@ -91,6 +216,12 @@ class PageAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу (основы слов, текст без HTML) вместо LIKE по content
+        if not search_term or not fts_available(PAGE_FTS_TABLE):
+            return super().get_search_results(request, queryset, search_term)
+        return filter_pages(queryset, search_term), False
+    
     class Media:
         css = {
             'all': ('css/admin_custom.css',)
@@ -104,9 +235,14 @@ class ContactRequestAdmin(admin.ModelAdmin):
     list_display = ('name', 'phone', 'page', 'is_processed', 'created_at')
     list_filter = ('is_processed', 'created_at', 'page')
     list_editable = ('is_processed',)
+    list_select_related = ('page',)
+    ordering = ('-created_at', '-pk')
+    paginator = ContactRequestPaginator
+    show_full_result_count = False
     search_fields = ('name', 'phone', 'email', 'message', 'device_info')
     readonly_fields = ('name', 'phone', 'email', 'message', 'device_info', 'page', 'page_url', 'created_at')
     date_hierarchy = 'created_at'
+    actions = ('export_csv', 'export_xlsx')
     
     fieldsets = (
         ('Контактные данные', {
@@ -120,6 +256,59 @@ class ContactRequestAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_changelist(self, request, **kwargs):
+        return ContactRequestChangeList
+    
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page,
+                              after=request.GET.get(SEEK_VAR))
+    
+    def export_response(self, queryset, fmt):
+        # Выбранные заявки (или все по фильтрам при «выбрать все») уходят потоком
+        content_type, extension = FORMATS[fmt]
+        response = StreamingHttpResponse(stream_export(queryset, fmt), content_type=content_type)
+        filename = f'leads-{timezone.localdate():%Y%m%d}.{extension}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        return self.export_response(queryset, 'csv')
+    
+    @admin.action(description='Выгрузить в Excel (XLSX)')
+    def export_xlsx(self, request, queryset):
+        return self.export_response(queryset, 'xlsx')
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу FTS5 вместо LIKE по пяти столбцам
+        if not search_term or not fts_available(CONTACT_FTS_TABLE):
+            return super().get_search_results(request, queryset, search_term)
+        return search_contact_requests(queryset, search_term), False
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    """Админка для очереди уведомлений"""
+    
+    list_display = ('id', 'channel', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'channel')
+    list_select_related = ('contact_request',)
+    readonly_fields = ('contact_request', 'channel', 'message', 'status', 'attempts',
+                       'next_attempt_at', 'last_error', 'created_at', 'sent_at')
+    actions = ('retry_notifications',)
+    
+    @admin.action(description='Повторить отправку')
+    def retry_notifications(self, request, queryset):
+        updated = queryset.exclude(status=NotificationOutbox.STATUS_SENT).update(
+            status=NotificationOutbox.STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, f'Поставлено в очередь повторно: {updated}')
+    
     def has_add_permission(self, request):
         return False
 
@@ -0,0 +1,183 @@
+"""Архив старых заявок: сжатые JSONL-файлы по месяцам.
+
+Заявки старше срока хранения дописываются в archive/leads/<год>/leads-<год>-<месяц>.jsonl.gz
+(или .jsonl.zst, если установлен zstandard; начатый месяц дописывается в свой
+файл, каким бы ни было сжатие по умолчанию) и удаляются из базы короткими
+пачками. Каждая пачка дописывается в файл отдельным gzip-членом (zstd-кадром),
+поэтому файл можно дополнять, а читается он целиком обычным способом.
+"""
+import gzip
+import io
+import json
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .models import ContactRequest, NotificationOutbox
+from .search import PHONE_RE, TOKEN_RE, fold
+from .services import normalize_phone
+
+try:
+    import zstandard
+except ImportError:  # zstandard необязателен: без него архив пишется в gzip
+    zstandard = None
+
+ARCHIVE_FIELDS = (
+    'id', 'created_at', 'name', 'phone', 'phone_normalized', 'email', 'message', 'device_info',
+    'page_id', 'page__slug', 'page_url', 'is_processed', 'admin_notes',
+)
+SEARCH_FIELDS = ('name', 'phone', 'email', 'message', 'device_info', 'admin_notes')
+ARCHIVE_GLOB = 'leads/*/leads-*.jsonl.*'
+PARTITION_EXTENSIONS = {'gzip': 'gz', 'zstd': 'zst'}
+
+
+def default_compression():
+    return 'zstd' if zstandard else 'gzip'
+
+
+def archive_root():
+    return Path(getattr(settings, 'LEADS_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def partition_path(root, month, compression):
+    """Файл месяца `month` ('ГГГГ-ММ'): уже начатый — с его расширением, иначе по `compression`.
+
+    Так месяц не делится на .gz и .zst, если zstandard поставили или убрали
+    между запусками.
+    """
+    directory = Path(root) / 'leads' / month[:4]
+    for extension in PARTITION_EXTENSIONS.values():
+        path = directory / f'leads-{month}.jsonl.{extension}'
+        if path.exists():
+            return path
+    return directory / f'leads-{month}.jsonl.{PARTITION_EXTENSIONS[compression]}'
+
+
+def append_lines(path, lines):
+    """Дописывает строки новым сжатым членом и сбрасывает файл на диск"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = ''.join(lines).encode('utf-8')
+    if path.suffix == '.zst' and zstandard is None:
+        raise RuntimeError(f'{path}: месяц начат в zstd, для дописывания нужен пакет zstandard')
+    with open(path, 'ab') as f:
+        if path.suffix == '.zst':
+            f.write(zstandard.ZstdCompressor(level=10).compress(data))
+        else:
+            f.write(gzip.compress(data, compresslevel=6))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def open_partition(path):
+    """Текстовый поток по всем членам/кадрам файла архива"""
+    if path.suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError(f'{path}: для чтения .zst нужен пакет zstandard')
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True)
+        return io.TextIOWrapper(raw, encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+
+def archive_batch(rows, root, compression):
+    """Записывает пачку заявок в файлы месяцев; возвращает затронутые файлы"""
+    # Месяц — по местному времени, как и дата в записи
+    months = {}
+    for row in rows:
+        local = timezone.localtime(row['created_at'])
+        record = dict(row)
+        record['created_at'] = local.isoformat()
+        record['page_slug'] = record.pop('page__slug')
+        months.setdefault(f'{local:%Y-%m}', []).append(json.dumps(record, ensure_ascii=False) + '\n')
+    partitions = {partition_path(root, month, compression): lines for month, lines in months.items()}
+    for path, lines in partitions.items():
+        append_lines(path, lines)
+    return list(partitions)
+
+
+def delete_batch(pks):
+    """Удаляет пачку заявок одним DELETE (вызывать внутри transaction.atomic).
+
+    QuerySet.delete() не подходит: из-за обработчика post_delete Django
+    загрузил бы заявки и на каждую писал бы в файловый кеш, удерживая
+    блокировку записи. Версия 'contacts' поднимается один раз, индекс FTS
+    чистят триггеры. on_delete ссылок на заявку повторяется здесь вручную:
+    единственная такая ссылка — NotificationOutbox.contact_request (SET_NULL),
+    новую тест test_delete_batch_covers_all_references не пропустит.
+    """
+    NotificationOutbox.objects.filter(contact_request_id__in=pks).update(contact_request=None)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {ContactRequest._meta.db_table} WHERE id IN ({placeholders})', pks)
+
+
+def archive_leads(days, root=None, compression=None, batch_size=500, pause=0.0, sleep=time.sleep):
+    """Переносит в архив заявки старше `days` дней; возвращает (число заявок, файлы).
+
+    Пачка сначала дописывается в архив (с fsync) и только потом удаляется,
+    поэтому сбой между шагами даёт дубль в архиве, но не потерю заявки;
+    при чтении дубли отбрасываются по id. Запись файлов идёт вне транзакции,
+    под блокировкой записи выполняется только DELETE пачки.
+    """
+    root = Path(root or archive_root())
+    compression = compression or default_compression()
+    cutoff = timezone.now() - timedelta(days=days)
+    queryset = ContactRequest.objects.filter(created_at__lt=cutoff).order_by('created_at', 'pk')
+
+    total, files = 0, set()
+    while True:
+        rows = list(queryset.values(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            break
+        files.update(archive_batch(rows, root, compression))
+        with transaction.atomic():
+            delete_batch([row['id'] for row in rows])
+        bump_version('contacts')
+        total += len(rows)
+        if pause:
+            sleep(pause)
+    return total, sorted(files)
+
+
+def iter_archive(root=None, since=None, until=None):
+    """Записи архива по порядку файлов; `since`/`until` (date) отсекают лишние месяцы"""
+    root = Path(root or archive_root())
+    for path in sorted(root.glob(ARCHIVE_GLOB)):
+        month = path.name.split('.')[0][len('leads-'):]
+        if since and month < f'{since:%Y-%m}' or until and month > f'{until:%Y-%m}':
+            continue
+        # Дубль после сбоя может быть только в том же месяце
+        seen = set()
+        with open_partition(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['id'] in seen:
+                    continue
+                seen.add(record['id'])
+                day = record['created_at'][:10]
+                if since and day < since.isoformat() or until and day > until.isoformat():
+                    continue
+                yield record
+
+
+def search_archive(term, root=None, since=None, until=None):
+    """Заявки из архива, подходящие под строку поиска.
+
+    Правила как в поиске админки: все слова должны встретиться (без учёта
+    регистра и ё), номер телефона сравнивается в виде 7XXXXXXXXXX.
+    """
+    digits = normalize_phone(term)
+    if PHONE_RE.fullmatch(term.strip()) and len(digits) == 11:
+        return (r for r in iter_archive(root, since, until) if r.get('phone_normalized') == digits)
+    words = TOKEN_RE.findall(fold(term))
+
+    def matches(record):
+        text = fold(' '.join(str(record.get(field) or '') for field in SEARCH_FIELDS))
+        return all(word in text for word in words)
+
+    return (r for r in iter_archive(root, since, until) if matches(r))
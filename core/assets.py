@@ -0,0 +1,535 @@
+"""Сборка статики перед collectstatic: минификация, критический CSS, шрифты.
+
+Результат кладётся в static/build/ (ASSETS_BUILD_DIR) вместе с assets.json,
+откуда его берут теги {% asset %}, {% stylesheet %} и {% font_links %}:
+  - css/*.css и js/*.js минифицируются в build/css/*.min.css, build/js/*.min.js;
+  - для каждого шаблона страницы из CSS выбираются правила, нужные шапке,
+    хлебным крошкам и первой секции (hero), — они встраиваются в <head>,
+    а полный файл грузится без блокировки отрисовки;
+  - шрифты из static/fonts/src/ (в репозитории — Inter, лицензия OFL)
+    урезаются до латиницы и кириллицы в WOFF2 пакетами fonttools и brotli
+    и отдаются со своего домена.
+Всё, кроме шрифтов, собирается без внешних зависимостей.
+"""
+import hashlib
+import io
+import json
+import re
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    from fontTools import subset as font_subset
+    from fontTools.ttLib import TTFont
+except ImportError:  # fonttools необязателен: без него шрифт грузится с Google Fonts
+    font_subset = TTFont = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'assets.json'
+MINIFY = {
+    'css': ('css/style.css',),
+    'js': ('js/main.js', 'js/cookie-banner.js'),
+}
+PAGE_TEMPLATES = ('pages/home.html', 'pages/page.html', 'pages/privacy.html', 'pages/search.html')
+FONT_SOURCE_DIR = 'fonts/src'
+FONT_SOURCE_SUFFIXES = ('.ttf', '.otf', '.woff2')
+FONT_FAMILY = 'Inter'
+# Диапазоны как у Google Fonts для подмножеств latin и cyrillic
+FONT_UNICODE_RANGE = (
+    'U+0000-00FF, U+0131, U+0152-0153, U+02BB-02BC, U+02C6, U+02DA, U+02DC, U+0304, U+0308, '
+    'U+0329, U+0400-045F, U+0490-0491, U+04B0-04B1, U+2000-206F, U+2074, U+20AC, U+2116, '
+    'U+2122, U+2191, U+2193, U+2212, U+2215, U+FEFF, U+FFFD'
+)
+# Preload — только начертания текста, от которого зависит LCP: основной текст
+# и заголовок hero. Шапка первого экрана использует все начертания сразу, и
+# предзагрузка всех пяти файлов отняла бы канал у самого LCP; остальные
+# подгружаются по font-display: swap
+FONT_PRELOAD_SELECTORS = ('body', '.hero__title')
+CSS_WEIGHT_KEYWORDS = {'normal': 400, 'bold': 700}
+FONT_WEIGHT_RE = re.compile(r'font-weight:\s*(\d+|normal|bold)\b')
+
+
+def build_dir():
+    return Path(getattr(settings, 'ASSETS_BUILD_DIR', settings.BASE_DIR / 'static' / 'build'))
+
+
+def source_dir():
+    return Path(settings.STATICFILES_DIRS[0])
+
+
+# --- Минификация -------------------------------------------------------------
+
+CSS_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?\*/|\s+|[^"\'/\s]+|/', re.S)
+
+
+def minify_css(css):
+    """Убирает комментарии и лишние пробелы; строки и calc() не трогает"""
+    out = []
+    for token in CSS_TOKEN_RE.findall(css):
+        if token.startswith('/*'):
+            if token.startswith('/*!'):
+                out.append(token)
+            continue
+        if token.isspace():
+            out.append(' ')
+            continue
+        out.append(token)
+    text = ''.join(out)
+    # Пробелы вокруг { } ; , > ~ и после «:» не значимы; «+» и «-» не трогаем (calc)
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', text)
+    for i in range(0, len(parts), 2):
+        chunk = re.sub(r'\s*([{};,>~])\s*', r'\1', parts[i])
+        chunk = re.sub(r':\s+', ':', chunk)
+        chunk = chunk.replace(';}', '}')
+        parts[i] = re.sub(r' {2,}', ' ', chunk)
+    return ''.join(parts).strip()
+
+
+# После этих символов и слов «/» начинает регулярное выражение, а не деление
+JS_REGEX_PREFIX = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case'}
+JS_WORD_RE = re.compile(r'[\w$]')
+# Перевод строки после этих символов (или перед закрывающими) безопасно убрать
+JS_JOIN_AFTER = set('{;,([')
+JS_JOIN_BEFORE = set('})];,.')
+
+
+class JSMinifier:
+    """Консервативный минификатор: комментарии и отступы удаляются, переводы
+    строк там, где от них может зависеть вставка «;», сохраняются"""
+
+    def __init__(self, source):
+        self.src = source
+        self.i = 0
+        self.out = []
+
+    def regex_allowed(self):
+        # Идентификаторы лежат в out по символу: смотрим хвост целиком
+        tail = ''.join(self.out[-16:]).rstrip()
+        if tail.endswith(('++', '--')):
+            # Постфиксный инкремент завершает выражение: дальше деление
+            return False
+        if not tail or tail[-1] in JS_REGEX_PREFIX:
+            return True
+        word = re.search(r'[\w$]+$', tail)
+        return bool(word) and word.group() in JS_REGEX_KEYWORDS
+
+    def space(self, newline):
+        """Пробел или перевод строки; подряд идущие сливаются, перевод строки важнее"""
+        token = '\n' if newline else ' '
+        if self.out and self.out[-1].isspace():
+            if token == '\n':
+                self.out[-1] = token
+            return
+        self.out.append(token)
+
+    def read_string(self, quote):
+        start, src, i = self.i, self.src, self.i + 1
+        while i < len(src) and src[i] != quote:
+            i += 2 if src[i] == '\\' else 1
+        self.i = i + 1
+        return src[start:self.i]
+
+    def read_regex(self):
+        """Литерал регулярного выражения или None, если это не он (перевод строки до конца)"""
+        start, src, i, in_class = self.i, self.src, self.i + 1, False
+        while i < len(src):
+            ch = src[i]
+            if ch == '\n':
+                return None
+            if ch == '\\':
+                i += 2
+                continue
+            if ch == '[':
+                in_class = True
+            elif ch == ']':
+                in_class = False
+            elif ch == '/' and not in_class:
+                break
+            i += 1
+        i += 1
+        while i < len(src) and JS_WORD_RE.match(src[i]):
+            i += 1
+        self.i = i
+        return src[start:i]
+
+    def read_template(self):
+        """Шаблонная строка `...${выражение}...`: выражения минифицируются рекурсивно"""
+        src, parts, i, start = self.src, [], self.i + 1, self.i
+        while i < len(src):
+            ch = src[i]
+            if ch == '\\':
+                i += 2
+                continue
+            if ch == '`':
+                break
+            if src.startswith('${', i):
+                parts.append(src[start:i + 2])
+                inner = JSMinifier(src)
+                inner.i = i + 2
+                inner.run(stop_at_brace=True)
+                parts.append(inner.compact())
+                i = inner.i
+                start = i
+                continue
+            i += 1
+        self.i = i + 1
+        parts.append(src[start:self.i])
+        return ''.join(parts)
+
+    def run(self, stop_at_brace=False):
+        src, depth = self.src, 0
+        while self.i < len(src):
+            ch = src[self.i]
+            if stop_at_brace and ch == '}' and depth == 0:
+                self.i += 1
+                self.out.append('}')
+                return
+            if ch in '\'"':
+                self.out.append(self.read_string(ch))
+            elif ch == '`':
+                self.out.append(self.read_template())
+            elif src.startswith('//', self.i):
+                end = src.find('\n', self.i)
+                self.i = len(src) if end == -1 else end
+            elif src.startswith('/*', self.i):
+                end = src.find('*/', self.i + 2)
+                comment = src[self.i:len(src) if end == -1 else end + 2]
+                self.i += len(comment)
+                self.space('\n' in comment)
+            elif ch == '/' and self.regex_allowed() and (regex := self.read_regex()) is not None:
+                self.out.append(regex)
+            elif ch.isspace():
+                start = self.i
+                while self.i < len(src) and src[self.i].isspace():
+                    self.i += 1
+                self.space('\n' in src[start:self.i])
+            else:
+                if ch == '{':
+                    depth += 1
+                elif ch == '}':
+                    depth -= 1
+                self.out.append(ch)
+                self.i += 1
+
+    def compact(self):
+        """Склеивает токены, оставляя только значимые пробелы и переводы строк"""
+        tokens = self.out
+        # Первый символ следующего значимого токена для каждой позиции
+        following, nxt = [''] * len(tokens), ''
+        for index in range(len(tokens) - 1, -1, -1):
+            following[index] = nxt
+            if not tokens[index].isspace():
+                nxt = tokens[index][:1]
+        out = []
+        for index, token in enumerate(tokens):
+            if not token.isspace():
+                out.append(token)
+                continue
+            prev, nxt = (out[-1][-1] if out else ''), following[index]
+            if not prev or not nxt or prev.isspace():
+                continue
+            if token == '\n':
+                if prev in JS_JOIN_AFTER or nxt in JS_JOIN_BEFORE:
+                    continue
+                out.append('\n')
+            elif JS_WORD_RE.match(prev) and JS_WORD_RE.match(nxt) or prev + nxt in ('++', '--', '+-', '-+'):
+                out.append(' ')
+        return ''.join(out)
+
+    def result(self):
+        self.run()
+        return self.compact().strip() + '\n'
+
+
+def minify_js(source):
+    return JSMinifier(source).result()
+
+
+# --- Критический CSS --------------------------------------------------------
+
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+SELECTOR_PSEUDO_RE = re.compile(r'::?[a-zA-Z-]+(\((?:[^()]|\([^()]*\))*\))?')
+SELECTOR_ATTR_RE = re.compile(r'\[[^\]]*\]')
+SELECTOR_PART_RE = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+INTERACTIVE_PSEUDO_RE = re.compile(r':(hover|active|focus|focus-visible|focus-within)\b')
+# @-правила, которые целиком не нужны для первой отрисовки
+SKIPPED_AT_RULES = ('@keyframes', '@-webkit-keyframes', '@page')
+NESTED_AT_RULES = ('@media', '@supports')
+
+
+def read_block(css, start):
+    """Индекс за закрывающей скобкой блока, открытого на позиции `start`"""
+    depth, i, quote = 0, start, None
+    while i < len(css):
+        ch = css[i]
+        if quote:
+            if ch == '\\':
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in '"\'':
+            quote = ch
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(css)
+
+
+def parse_css(css):
+    """[(прелюдия, тело)] верхнего уровня; у @media тело — вложенный список"""
+    css = CSS_COMMENT_RE.sub('', css)
+    rules, i = [], 0
+    while i < len(css):
+        brace = css.find('{', i)
+        semicolon = css.find(';', i)
+        if brace == -1:
+            break
+        if semicolon != -1 and semicolon < brace:
+            # @charset / @import
+            rules.append((css[i:semicolon].strip(), None))
+            i = semicolon + 1
+            continue
+        prelude = css[i:brace].strip()
+        end = read_block(css, brace)
+        body = css[brace + 1:end - 1]
+        if prelude.startswith(NESTED_AT_RULES):
+            body = parse_css(body)
+        rules.append((prelude, body))
+        i = end
+    return rules
+
+
+def selector_matches(selector, tokens):
+    """Может ли селектор сработать на разметке из `tokens` ({('', тег), ('.', класс), ('#', id)})"""
+    if INTERACTIVE_PSEUDO_RE.search(selector):
+        # Наведение и фокус до загрузки полного CSS не нужны
+        return False
+    simple = SELECTOR_PSEUDO_RE.sub('', SELECTOR_ATTR_RE.sub('', selector))
+    for compound in re.split(r'[\s>+~]+', simple.strip()):
+        for kind, name in SELECTOR_PART_RE.findall(compound):
+            if (kind, name.lower() if not kind else name) not in tokens:
+                return False
+    return True
+
+
+def select_rules(rules, tokens):
+    out = []
+    for prelude, body in rules:
+        if body is None:
+            continue
+        if prelude.startswith(SKIPPED_AT_RULES):
+            continue
+        if prelude.startswith('@font-face'):
+            out.append(f'{prelude}{{{body}}}')
+        elif prelude.startswith(NESTED_AT_RULES):
+            inner = select_rules(body, tokens)
+            if inner:
+                out.append(f'{prelude}{{{"".join(inner)}}}')
+        elif prelude.startswith('@'):
+            continue
+        elif any(selector_matches(s, tokens) for s in prelude.split(',')):
+            out.append(f'{prelude}{{{body}}}')
+    return out
+
+
+def critical_css(css, tokens):
+    """Правила из `css`, которые могут понадобиться разметке с `tokens`"""
+    return minify_css(''.join(select_rules(parse_css(css), tokens)))
+
+
+TEMPLATE_TAG_RE = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+INCLUDE_RE = re.compile(r"""{%\s*include\s+['"]([^'"]+)['"].*?%}""")
+CLASS_ATTR_RE = re.compile(r'\bclass="([^"]*)"')
+ID_ATTR_RE = re.compile(r'\bid="([^"]*)"')
+TAG_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)')
+
+
+def template_source(name):
+    return (Path(settings.TEMPLATES[0]['DIRS'][0]) / name).read_text(encoding='utf-8')
+
+
+def above_the_fold(name):
+    """Разметка первого экрана шаблона страницы: <body> базы до контента,
+    включённая шапка и первая секция блока content"""
+    base = template_source('base.html')
+    base = base[base.index('<body'):base.index('{% block content %}')]
+    base = INCLUDE_RE.sub(lambda m: template_source(m[1]), base)
+    page = template_source(name)
+    content = page[page.index('{% block content %}'):]
+    end = content.find('</section>')
+    return base + (content if end == -1 else content[:end])
+
+
+def markup_tokens(markup):
+    """Теги, классы и id из разметки шаблона; значения из {% if %} тоже попадают"""
+    tokens = {('', 'html'), ('', 'body')}
+    tokens.update(('', tag.lower()) for tag in TAG_RE.findall(markup))
+    for attr_re, kind in ((CLASS_ATTR_RE, '.'), (ID_ATTR_RE, '#')):
+        for value in attr_re.findall(markup):
+            for name in TEMPLATE_TAG_RE.sub(' ', value).split():
+                tokens.add((kind, name))
+    return tokens
+
+
+# --- Шрифты -----------------------------------------------------------------
+
+def subset_font(path, out_dir):
+    """Урезанный до латиницы и кириллицы шрифт; описание для @font-face"""
+    flavor = 'woff2' if brotli else 'woff'
+    options = font_subset.Options()
+    options.flavor = flavor
+    options.layout_features = ['*']
+    options.drop_tables += ['DSIG']
+    # Без пересчёта head.modified: тот же исходник даёт тот же файл и то же имя с хешем
+    font = TTFont(path, recalcTimestamp=False)
+    subsetter = font_subset.Subsetter(options)
+    subsetter.populate(unicodes=font_subset.parse_unicodes(FONT_UNICODE_RANGE))
+    subsetter.subset(font)
+    if 'fvar' in font:
+        axis = next((a for a in font['fvar'].axes if a.axisTag == 'wght'), None)
+        weight = f'{axis.minValue:g} {axis.maxValue:g}' if axis else '400'
+    else:
+        weight = str(font['OS/2'].usWeightClass)
+    italic = bool(font['OS/2'].fsSelection & 1)
+    out = out_dir / f'{path.stem.lower().replace(" ", "-")}.{flavor}'
+    font.flavor = flavor
+    data = io.BytesIO()
+    font.save(data)
+    write(out, data.getvalue())
+    return {'family': FONT_FAMILY, 'format': flavor, 'weight': weight,
+            'style': 'italic' if italic else 'normal', 'path': out}
+
+
+def preload_weights(critical):
+    """Начертания, которые критический CSS шаблона задаёт FONT_PRELOAD_SELECTORS"""
+    weights = {}
+    for prelude, body in parse_css(critical):
+        if body is None or prelude.startswith('@'):
+            continue
+        selectors = {s.strip() for s in prelude.split(',')}
+        for selector in selectors.intersection(FONT_PRELOAD_SELECTORS):
+            # Селектор есть на первом экране; без своего font-weight — обычное начертание
+            found = FONT_WEIGHT_RE.findall(body)
+            weights.setdefault(selector, 400)
+            if found:
+                weights[selector] = CSS_WEIGHT_KEYWORDS.get(found[-1]) or int(found[-1])
+    return set(weights.values()) or {400}
+
+
+def font_covers(font, weights):
+    """Есть ли у шрифта (weight '700' или диапазон '100 900') одно из начертаний"""
+    low, _, high = font['weight'].partition(' ')
+    return any(float(low) <= weight <= float(high or low) for weight in weights)
+
+
+def font_face_css(font, url):
+    return (f"@font-face{{font-family:'{font['family']}';font-style:{font['style']};"
+            f"font-weight:{font['weight']};font-display:swap;"
+            f"src:url({url}) format('{font['format']}');unicode-range:{FONT_UNICODE_RANGE}}}")
+
+
+# --- Сборка -----------------------------------------------------------------
+
+def write(path, content):
+    # То же содержимое не перезаписываем: время изменения не сдвинется, и collectstatic файл пропустит
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    if path.is_file() and path.read_bytes() == content:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+
+def build_assets(log=print):
+    """Собирает всё в build_dir() и пишет assets.json; возвращает манифест"""
+    src, out = source_dir(), build_dir()
+    prefix = out.relative_to(src).as_posix()
+    manifest = {'files': {}, 'critical': {}, 'fonts': [], 'preload': {}}
+
+    fonts = []
+    font_sources = sorted(p for p in (src / FONT_SOURCE_DIR).glob('*') if p.suffix in FONT_SOURCE_SUFFIXES)
+    if font_sources and font_subset is None:
+        log('Шрифты не собраны: нужен пакет fonttools (pip install fonttools brotli)')
+    elif font_sources:
+        # Урезание занимает секунды на файл: неизменённый исходник берём из прошлой сборки
+        built = {font.get('source'): font for font in read_json(out / MANIFEST_NAME).get('fonts', [])}
+        for path in font_sources:
+            if path.suffix == '.woff2' and brotli is None:
+                log(f'  {path.name} пропущен: для WOFF2 нужен пакет brotli')
+                continue
+            digest = hashlib.sha1(path.read_bytes()).hexdigest()
+            font = built.get(path.name)
+            if font is None or font.get('source_hash') != digest or not (src / font['file']).is_file():
+                font = subset_font(path, out / 'fonts')
+                font['file'] = f"{prefix}/fonts/{font.pop('path').name}"
+                font['source'], font['source_hash'] = path.name, digest
+                log(f'  {path.name} → {font["file"]}')
+            fonts.append(font)
+    manifest['fonts'] = fonts
+
+    for kind, names in MINIFY.items():
+        minify = minify_css if kind == 'css' else minify_js
+        for name in names:
+            text = (src / name).read_text(encoding='utf-8')
+            if kind == 'css' and fonts:
+                # Путь относительно build/css/: манифест статики заменит его на имя с хешем
+                faces = ''.join(font_face_css(f, '../fonts/' + Path(f['file']).name) for f in fonts)
+                text = faces + text
+            target = f'{prefix}/{kind}/{Path(name).stem}.min.{kind}'
+            minified = minify(text)
+            write(src / target, minified)
+            manifest['files'][name] = target
+            log(f'  {name}: {len(text.encode())} → {len(minified.encode())} байт')
+
+    css = (src / MINIFY['css'][0]).read_text(encoding='utf-8')
+    for template in PAGE_TEMPLATES:
+        target = f'{prefix}/critical/{Path(template).stem}.css'
+        critical = critical_css(css, markup_tokens(above_the_fold(template)))
+        write(src / target, critical)
+        manifest['critical'][template] = target
+        weights = preload_weights(critical)
+        manifest['preload'][template] = [
+            font['file'] for font in fonts if font['style'] == 'normal' and font_covers(font, weights)
+        ]
+        log(f'  {template}: критический CSS {len(critical.encode())} байт')
+
+    write(out / MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+    return manifest
+
+
+def read_json(path):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+_manifest_cache = {}
+
+
+def load_manifest():
+    """assets.json (перечитывается при изменении файла) или None, если сборки не было"""
+    path = build_dir() / MANIFEST_NAME
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _manifest_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        manifest = json.loads(path.read_text(encoding='utf-8'))
+        manifest['critical_css'] = {
+            template: (source_dir() / target).read_text(encoding='utf-8')
+            for template, target in manifest['critical'].items()
+        }
+        cached = _manifest_cache[path] = (mtime, manifest)
+    return cached[1]
@@ -0,0 +1,367 @@
+"""Замер публичных страниц и формы заявки в этом же процессе (manage.py bench).
+
+Сценарии гоняются через тестовый клиент Django по данным, которые
+засеваются заранее (seed). reCAPTCHA и Telegram заменены заглушками,
+в сеть ничего не уходит. На каждый запрос снимаются:
+  - время ответа (весь стек middleware);
+  - число SQL-запросов и их суммарное время (execute_wrapper);
+  - время отрисовки шаблонов (внешний Template.render, вложенные include не суммируются);
+  - размер ответа в байтах.
+Вариант «:cold» перед каждым запросом чистит кеши и процессные снимки.
+Для SQLite отдельно замеряется конкурентная запись в файл через бэкенд
+из настроек: профиль по умолчанию против настроенного (core.db).
+"""
+import itertools
+import math
+import platform
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+import django
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import OperationalError, connection, connections, transaction
+from django.db.utils import load_backend
+from django.template.base import Template
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from .cache import clear_local_snapshots
+from .models import ContactRequest, Page, SiteSettings
+from .services import normalize_phone
+
+PAGE_TYPES = ('skupka', 'remont', 'info')
+MENU_PAGES = 8
+LEAD_BATCH = 500
+# (имя, есть ли смысл в холодном варианте)
+SCENARIOS = (
+    ('home_page', True),
+    ('page_detail', True),
+    ('privacy_page', True),
+    ('submit_contact', False),
+    ('sitemap', True),
+    ('robots_txt', False),
+)
+# Метрики времени сравниваются с порогом в долях, но разница меньше
+# MIN_DELTA_MS считается шумом; запросы и байты — без допуска на шум
+TIME_METRICS = (('latency_ms', 'p50'), ('latency_ms', 'p95'), ('latency_ms', 'p99'),
+                ('sql_ms', 'p50'), ('template_ms', 'p50'))
+MIN_DELTA_MS = 0.5
+BYTES_TOLERANCE = 0.01
+
+WORDS = (
+    'ноутбук компьютер монитор видеокарта процессор ремонт скупка оценка выезд '
+    'гарантия диагностика замена экран клавиатура батарея корпус цена Томск'
+).split()
+
+
+# --- Данные -----------------------------------------------------------------
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def page_content(rng, sections):
+    parts = []
+    for n in range(sections):
+        parts.append(f'<h2>{sentence(rng, 4)}</h2>')
+        parts.extend(f'<p>{sentence(rng, 30)}</p>' for _ in range(3))
+        parts.append(f'<h3>{sentence(rng, 3)}</h3>')
+        parts.append('<ul>' + ''.join(f'<li>{sentence(rng, 6)}</li>' for _ in range(4)) + '</ul>')
+    return '\n'.join(parts)
+
+
+def seed(pages=50, leads=1000, sections=4, seed_value=0):
+    """Засевает текущую базу: настройки, главная, `pages` страниц, `leads` заявок.
+
+    Возвращает slug'и страниц для page_detail. Данные детерминированы
+    `seed_value`, поэтому размеры ответов сравнимы между запусками.
+    """
+    rng = random.Random(seed_value)
+    SiteSettings.objects.update_or_create(pk=1, defaults={
+        'recaptcha_site_key': 'bench', 'recaptcha_secret_key': 'bench',
+        'telegram_bot_token': 'bench', 'telegram_chat_id': '1',
+    })
+    Page.objects.update_or_create(slug='home', defaults={
+        'title': 'Скупка техники в Томске', 'page_type': 'home', 'show_in_menu': False,
+        'hero_title': 'Скупка техники в Томске', 'content': page_content(rng, sections),
+    })
+    slugs = []
+    for n in range(pages):
+        slug = f'bench-{n}'
+        Page.objects.update_or_create(slug=slug, defaults={
+            'title': sentence(rng, 3)[:-1], 'page_type': PAGE_TYPES[n % len(PAGE_TYPES)],
+            'hero_title': sentence(rng, 5), 'hero_subtitle': sentence(rng, 8),
+            'show_in_menu': n < MENU_PAGES, 'order': n, 'content': page_content(rng, sections),
+        })
+        slugs.append(slug)
+
+    batch = []
+    for n in range(leads):
+        lead = ContactRequest(name=f'Клиент {n}', phone=f'+7 900 {n:07d}', message=sentence(rng, 10),
+                              page_url=f'/{rng.choice(slugs)}/' if slugs else '/', is_processed=n % 3 == 0)
+        # bulk_create минует save(): поля для поиска дублей заполняем сами
+        lead.phone_normalized = normalize_phone(lead.phone)
+        lead.content_hash = lead.compute_content_hash()
+        batch.append(lead)
+        if len(batch) == LEAD_BATCH:
+            ContactRequest.objects.bulk_create(batch)
+            batch = []
+    ContactRequest.objects.bulk_create(batch)
+    clear_local_snapshots()
+    return slugs
+
+
+# --- Замер ------------------------------------------------------------------
+
+class TemplateTimer:
+    """Суммирует время внешних вызовов Template.render (include внутри не считаются)"""
+
+    def __init__(self):
+        self.total = 0.0
+        self.local = threading.local()
+
+    @contextmanager
+    def installed(self):
+        original = Template.render
+        timer = self
+
+        def render(template, context):
+            depth = getattr(timer.local, 'depth', 0)
+            timer.local.depth = depth + 1
+            start = time.perf_counter()
+            try:
+                return original(template, context)
+            finally:
+                timer.local.depth = depth
+                if depth == 0:
+                    timer.total += time.perf_counter() - start
+
+        with patch.object(Template, 'render', render):
+            yield self
+
+
+def reset_caches():
+    cache.clear()
+    caches['template_fragments'].clear()
+    caches['ratelimit'].clear()
+    clear_local_snapshots()
+
+
+def make_requests(client, slugs):
+    """{сценарий: функция(номер запроса) -> ответ}"""
+    def page_detail(n):
+        return client.get(f'/{slugs[n % len(slugs)]}/')
+
+    def submit_contact(n):
+        # Свой IP и телефон на каждую заявку: лимиты и поиск дублей не срабатывают
+        slug = slugs[n % len(slugs)] if slugs else ''
+        return client.post('/submit-contact/', {
+            'name': f'Замер {n}', 'phone': f'+7 901 {n:07d}', 'message': f'Ноутбук номер {n}',
+            'privacy_agreement': 'on', 'page_slug': slug, 'page_url': f'/{slug}/' if slug else '/',
+            'g-recaptcha-response': 'bench', 'idempotency_key': f'bench-{n}',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest', REMOTE_ADDR=f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}')
+
+    return {
+        'home_page': lambda n: client.get('/'),
+        'page_detail': page_detail,
+        'privacy_page': lambda n: client.get('/privacy/'),
+        'submit_contact': submit_contact,
+        'sitemap': lambda n: client.get('/sitemap.xml'),
+        'robots_txt': lambda n: client.get('/robots.txt'),
+    }
+
+
+def measure(request, n, timer):
+    """Метрики одного запроса"""
+    sql = {'queries': 0, 'time': 0.0}
+
+    def wrapper(execute, query, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(query, params, many, context)
+        finally:
+            sql['queries'] += 1
+            sql['time'] += time.perf_counter() - start
+
+    timer.total = 0.0
+    with connection.execute_wrapper(wrapper):
+        start = time.perf_counter()
+        response = request(n)
+        latency = time.perf_counter() - start
+    return {
+        'status': response.status_code,
+        'latency_ms': latency * 1000,
+        'queries': sql['queries'],
+        'sql_ms': sql['time'] * 1000,
+        'template_ms': timer.total * 1000,
+        'bytes': len(response.content),
+    }
+
+
+def percentile(values, p):
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(samples):
+    def spread(name, points=(50, 95, 99)):
+        values = [s[name] for s in samples]
+        summary = {f'p{p}': round(percentile(values, p), 3) for p in points}
+        summary['mean'] = round(sum(values) / len(values), 3)
+        return summary
+
+    statuses = {}
+    for s in samples:
+        statuses[str(s['status'])] = statuses.get(str(s['status']), 0) + 1
+    return {
+        'requests': len(samples),
+        'status': statuses,
+        'latency_ms': spread('latency_ms'),
+        'queries': {'mean': round(sum(s['queries'] for s in samples) / len(samples), 2),
+                    'max': max(s['queries'] for s in samples)},
+        'sql_ms': spread('sql_ms', (50, 95)),
+        'template_ms': spread('template_ms', (50, 95)),
+        'bytes': {'mean': round(sum(s['bytes'] for s in samples) / len(samples)),
+                  'max': max(s['bytes'] for s in samples)},
+    }
+
+
+def run_bench(slugs, iterations=100, warmup=5, scenarios=None):
+    """Гоняет сценарии по засеянным данным; возвращает {сценарий: сводка}"""
+    client = Client()
+    requests = make_requests(client, slugs)
+    timer = TemplateTimer()
+    results = {}
+    with timer.installed(), \
+            patch('core.views.verify_recaptcha', return_value=(True, 0.9)), \
+            patch('core.services.send_telegram_message', return_value=True):
+        for name, has_cold in SCENARIOS:
+            if scenarios and name not in scenarios:
+                continue
+            variants = [(name, False)] + ([(f'{name}:cold', True)] if has_cold else [])
+            for label, cold in variants:
+                reset_caches()
+                counter = itertools.count()
+                # Тёплый page_detail должен застать в кеше все страницы, по которым ходит
+                for _ in range(warmup + (len(slugs) if name == 'page_detail' else 0)):
+                    requests[name](next(counter))
+                samples = []
+                for _ in range(iterations):
+                    if cold:
+                        reset_caches()
+                    samples.append(measure(requests[name], next(counter), timer))
+                results[label] = summarize(samples)
+    return results
+
+
+# --- Конкурентная запись в SQLite ------------------------------------------
+
+SQLITE_WRITERS = 4
+SQLITE_READERS = 4
+
+
+def sqlite_contention(path, transaction_mode, pragmas, duration=1.0,
+                      writers=SQLITE_WRITERS, readers=SQLITE_READERS):
+    """Смешанная нагрузка на файл SQLite `path` через бэкенд из настроек.
+
+    У каждого потока своё соединение (PRAGMA — по connection_created).
+    Писатели в transaction.atomic() читают и вставляют, как заявка с поиском
+    дублей; читатели выбирают последние строки. Возвращает число операций
+    и ошибок «database is locked».
+    """
+    config = connections.settings['default']
+    backend = load_backend(config['ENGINE'])
+    settings_dict = {**config, 'NAME': str(path),
+                     'OPTIONS': {**config['OPTIONS'], 'transaction_mode': transaction_mode}}
+    counters = {'reads': 0, 'writes': 0, 'locked': 0}
+    lock = threading.Lock()
+
+    def worker(alias, writer, stop_at):
+        conn = connections[alias] = backend.DatabaseWrapper(settings_dict, alias)
+        try:
+            while time.monotonic() < stop_at:
+                try:
+                    if writer:
+                        with transaction.atomic(using=alias), conn.cursor() as cursor:
+                            cursor.execute('SELECT COUNT(*) FROM bench_lead')
+                            cursor.execute('INSERT INTO bench_lead (phone, created) VALUES (%s, %s)',
+                                           ['79990000000', time.time()])
+                    else:
+                        with conn.cursor() as cursor:
+                            cursor.execute('SELECT id, phone FROM bench_lead ORDER BY id DESC LIMIT 20')
+                            cursor.fetchall()
+                except OperationalError as e:
+                    if 'locked' not in str(e) and 'busy' not in str(e):
+                        raise
+                    with lock:
+                        counters['locked'] += 1
+                    continue
+                with lock:
+                    counters['writes' if writer else 'reads'] += 1
+        finally:
+            conn.close()
+            del connections[alias]
+
+    with override_settings(SQLITE_PRAGMAS=pragmas):
+        setup = backend.DatabaseWrapper(settings_dict, 'bench-sqlite')
+        with setup.cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS bench_lead (id INTEGER PRIMARY KEY, phone TEXT, created REAL)')
+        setup.close()
+        stop_at = time.monotonic() + duration
+        threads = [threading.Thread(target=worker, args=(f'bench-sqlite-{n}', n < writers, stop_at))
+                   for n in range(writers + readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return {**counters, 'seconds': duration, 'writes_per_s': round(counters['writes'] / duration, 1),
+            'reads_per_s': round(counters['reads'] / duration, 1)}
+
+
+def run_sqlite_contention(directory, duration=1.0):
+    """Та же нагрузка без профиля (BEGIN DEFERRED, PRAGMA по умолчанию) и с профилем из настроек"""
+    mode = connections.settings['default']['OPTIONS'].get('transaction_mode') or 'DEFERRED'
+    return {
+        'default': sqlite_contention(Path(directory) / 'default.sqlite3', 'DEFERRED', {}, duration),
+        'tuned': sqlite_contention(Path(directory) / 'tuned.sqlite3', mode,
+                                   getattr(settings, 'SQLITE_PRAGMAS', {}), duration),
+    }
+
+
+# --- Сравнение с эталоном ---------------------------------------------------
+
+def compare(results, baseline, threshold=0.25):
+    """Регрессии относительно эталона: [{'scenario', 'metric', 'baseline', 'current', 'change'}]"""
+    regressions = []
+
+    def flag(scenario, metric, old, new):
+        change = f'{(new - old) / old:+.0%}' if old else 'new'
+        regressions.append({'scenario': scenario, 'metric': metric, 'baseline': old,
+                            'current': new, 'change': change})
+
+    for scenario, current in results.items():
+        old = baseline.get(scenario)
+        if old is None:
+            continue
+        for group, point in TIME_METRICS:
+            a, b = old[group][point], current[group][point]
+            if b - a > MIN_DELTA_MS and b > a * (1 + threshold):
+                flag(scenario, f'{group}.{point}', a, b)
+        if current['queries']['mean'] > old['queries']['mean']:
+            flag(scenario, 'queries.mean', old['queries']['mean'], current['queries']['mean'])
+        if current['bytes']['mean'] > old['bytes']['mean'] * (1 + BYTES_TOLERANCE):
+            flag(scenario, 'bytes.mean', old['bytes']['mean'], current['bytes']['mean'])
+    return regressions
+
+
+def report_meta(**options):
+    return {**options, 'database': connection.vendor, 'python': platform.python_version(),
+            'django': django.get_version(), 'created_at': timezone.now().isoformat(timespec='seconds')}
@@ -0,0 +1,198 @@
+"""Версии контента и снимки данных, общие для всех воркеров.
+
+Версия — метка в общем кеше (CACHES['default']), которая меняется при
+каждом сохранении данных. Процесс держит у себя снимок и сверяет версию
+не чаще раза в CONTENT_VERSION_CHECK_INTERVAL секунд, поэтому изменения
+из админки доходят до всех воркеров Passenger за ограниченное время.
+"""
+import hashlib
+import re
+import threading
+import time
+import uuid
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from .assets import MANIFEST_NAME as ASSETS_MANIFEST_NAME, build_dir
+
+VERSION_KEY = 'core:version:{}'
+
+_snapshots = []
+
+
+def get_version(name):
+    """Возвращает текущую версию пространства имён `name`"""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Помечает данные пространства имён `name` как изменённые"""
+    version = time.time_ns()
+    cache.set(VERSION_KEY.format(name), version, None)
+    return version
+
+
+class VersionedSnapshot:
+    """Процессный снимок данных, перезагружаемый при смене версии.
+
+    `loader` вызывается только когда версии в общем кеше и у снимка
+    расходятся; между проверками чтение не делает ни одного запроса.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        # (значение, версия, время последней проверки) — одним кортежем,
+        # чтобы параллельные потоки не видели частично обновлённое состояние
+        self._state = None
+        _snapshots.append(self)
+
+    def get(self):
+        state = self._state
+        now = time.monotonic()
+        interval = getattr(settings, 'CONTENT_VERSION_CHECK_INTERVAL', 5)
+        if state is not None and now - state[2] < interval:
+            return state[0]
+
+        version = get_version(self.name)
+        if state is not None and state[1] == version:
+            self._state = (state[0], version, now)
+            return state[0]
+
+        with self._lock:
+            state = self._state
+            if state is not None and state[1] == version:
+                return state[0]
+            value = self.loader()
+            self._state = (value, version, now)
+            return value
+
+    def invalidate(self):
+        """Сбрасывает снимок во всех процессах"""
+        bump_version(self.name)
+        self._state = None
+
+
+def sync_snapshots(versions):
+    """Сбрасывает процессные снимки, отставшие от переданных версий"""
+    for snapshot in _snapshots:
+        state = snapshot._state
+        if state is not None and snapshot.name in versions and state[1] != versions[snapshot.name]:
+            snapshot._state = None
+
+
+def clear_local_snapshots():
+    """Забывает все процессные снимки (например, между тестами)"""
+    for snapshot in _snapshots:
+        snapshot._state = None
+
+
+_build_fingerprint = None
+
+
+def compute_build_fingerprint():
+    """Отпечаток шаблонов и манифестов статики (staticfiles.json, assets.json)"""
+    digest = hashlib.sha1()
+    for directory in (Path(d) for d in settings.TEMPLATES[0]['DIRS']):
+        for path in sorted(directory.rglob('*.html')):
+            digest.update(str(path.relative_to(directory)).encode('utf-8'))
+            digest.update(path.read_bytes())
+    for manifest in (Path(settings.STATIC_ROOT) / 'staticfiles.json', build_dir() / ASSETS_MANIFEST_NAME):
+        if manifest.exists():
+            digest.update(manifest.read_bytes())
+    return digest.hexdigest()
+
+
+def build_fingerprint():
+    """Отпечаток сборки для ключей кеша страниц и ETag.
+
+    После деплоя с новой вёрсткой, именами статики или критическим CSS
+    старые копии страниц перестают совпадать. Считается раз на процесс
+    (деплой перезапускает приложение), при DEBUG — на каждый вызов.
+    """
+    global _build_fingerprint
+    if _build_fingerprint is None or settings.DEBUG:
+        _build_fingerprint = compute_build_fingerprint()
+    return _build_fingerprint
+
+
+# Полностраничный кеш. Ключ зависит от версий контента и отпечатка сборки, поэтому
+# сохранение страницы или настроек в админке, как и деплой, делает все
+# закешированные копии недоступными.
+PAGE_CACHE_VERSIONS = ('pages', 'site_settings')
+
+# Поля формы, значение которых у каждого посетителя своё: в кеше хранится
+# заглушка, при отдаче подставляется свежее значение
+PER_REQUEST_INPUTS = {
+    'csrfmiddlewaretoken': get_token,
+    'idempotency_key': lambda request: uuid.uuid4().hex,
+}
+PER_REQUEST_INPUT_RE = re.compile(r'name="({})" value="[^"]*"'.format('|'.join(PER_REQUEST_INPUTS)))
+
+
+def input_placeholder(name):
+    return f'__{name.upper()}__'
+
+
+def mask_per_request_inputs(content, value=None):
+    """Заменяет значения одноразовых полей формы заглушками (или строкой `value`)"""
+    return PER_REQUEST_INPUT_RE.sub(
+        lambda m: f'name="{m[1]}" value="{input_placeholder(m[1]) if value is None else value}"',
+        content,
+    )
+
+
+def fill_per_request_inputs(content, request):
+    for name, factory in PER_REQUEST_INPUTS.items():
+        placeholder = input_placeholder(name)
+        if placeholder in content:
+            content = content.replace(placeholder, factory(request))
+    return content
+
+
+def page_cache_key(request, versions):
+    stamp = ':'.join(str(versions[name]) for name in PAGE_CACHE_VERSIONS)
+    raw = f'{stamp}:{build_fingerprint()}:{request.scheme}:{request.get_host()}:{request.path}'
+    return 'core:page:' + hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def cache_page_response(view):
+    """Кеширует HTML страницы целиком.
+
+    В закешированной копии CSRF-токен и ключ идемпотентности формы заменены
+    заглушками, при отдаче каждому посетителю подставляются свои значения.
+    Тёплое попадание не трогает ни ORM, ни шаблонизатор.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        versions = {name: get_version(name) for name in PAGE_CACHE_VERSIONS}
+        key = page_cache_key(request, versions)
+        cached = cache.get(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(fill_per_request_inputs(content, request), content_type=content_type)
+
+        # Рендерим из снимков той же версии, что и в ключе
+        sync_snapshots(versions)
+        response = view(request, *args, **kwargs)
+        if request.method == 'GET' and response.status_code == 200 and not response.streaming:
+            content = mask_per_request_inputs(response.content.decode(response.charset))
+            cache.set(key, (content, response['Content-Type']),
+                      getattr(settings, 'PAGE_CACHE_TIMEOUT', 86400))
+        return response
+
+    return wrapper
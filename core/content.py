@@ -0,0 +1,183 @@
+"""Обработка HTML из CKEditor при сохранении страницы.
+
+Шаблон выводит готовый Page.content_html, поэтому всё, что здесь
+делается, выполняется один раз на сохранение, а не на каждый запрос:
+  - картинкам добавляются loading="lazy", decoding="async", width и height,
+    а при готовых уменьшенных копиях — srcset и <picture> с WebP;
+  - заголовкам h2/h3 — якоря, из них собирается оглавление;
+  - пустые абзацы и обёртки без атрибутов (<p>&nbsp;</p>, <strong></strong>)
+    удаляются; <i class="icon"></i> и другие элементы с атрибутами остаются.
+"""
+from html import unescape
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.utils.html import escape
+from django.utils.text import slugify
+from PIL import Image
+
+TOC_LEVELS = ('h2', 'h3')
+# Элементы, которые удаляются, если у них нет атрибутов, а внутри нет ничего,
+# кроме пробелов и <br>: пустой <span class="..."> или <i class="..."> — это иконка
+REMOVABLE_WHEN_EMPTY = {'p', 'span', 'strong', 'b', 'em', 'i', 'u', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+BLANK_ENTITIES = {'&nbsp;', '&#160;', '&#xa0;'}
+
+
+def media_name(src):
+    """Имя файла в хранилище медиа для src картинки или None для внешних адресов"""
+    parts = urlsplit(src)
+    media_url = '/' + settings.MEDIA_URL.strip('/') + '/'
+    if parts.netloc or not parts.path.startswith(media_url):
+        return None
+    return unquote(parts.path[len(media_url):])
+
+
+def media_path(src):
+    """Путь к файлу в MEDIA_ROOT для src картинки или None для внешних адресов"""
+    name = media_name(src)
+    if name is None:
+        return None
+    path = (Path(settings.MEDIA_ROOT) / name).resolve()
+    if Path(settings.MEDIA_ROOT).resolve() not in path.parents:
+        return None
+    return path
+
+
+def image_size(src):
+    """(ширина, высота) загруженной картинки; читается только заголовок файла"""
+    path = media_path(src)
+    if path is None or not path.is_file():
+        return None
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def render_tag(tag, attrs, self_closing=False):
+    rendered = ''.join(f' {name}' if value is None else f' {name}="{escape(value)}"' for name, value in attrs)
+    return f'<{tag}{rendered}{" /" if self_closing else ""}>'
+
+
+class ContentRenderer(HTMLParser):
+    def __init__(self, srcset=None):
+        # Сущности оставляем как есть, чтобы не перекодировать текст редактора
+        super().__init__(convert_charrefs=False)
+        # srcset(имя файла, формат) -> строка srcset; None — без адаптивных картинок
+        self.srcset = srcset
+        self.out = []
+        # (тег, индекс открывающего токена в out, атрибуты)
+        self.stack = []
+        self.toc = []
+        self.used_ids = set()
+
+    def handle_starttag(self, tag, attrs):
+        self.emit_start(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self.emit_start(tag, attrs, self_closing=True)
+
+    def emit_start(self, tag, attrs, self_closing):
+        if tag == 'img':
+            self.out.append(self.render_image(self.image_attrs(attrs), self_closing))
+            return
+        self.out.append(self.get_starttag_text())
+        if tag not in VOID_TAGS and not self_closing:
+            self.stack.append((tag, len(self.out) - 1, attrs))
+
+    def handle_endtag(self, tag):
+        if not any(open_tag == tag for open_tag, _, _ in self.stack):
+            self.out.append(f'</{tag}>')
+            return
+        while self.stack:
+            open_tag, index, attrs = self.stack.pop()
+            if open_tag == tag:
+                break
+        inner = self.out[index + 1:]
+        if tag in REMOVABLE_WHEN_EMPTY and not attrs and all(self.is_blank(token) for token in inner):
+            del self.out[index:]
+            return
+        if tag in TOC_LEVELS:
+            self.add_heading(tag, index, attrs, inner)
+        self.out.append(f'</{tag}>')
+
+    def handle_data(self, data):
+        self.out.append(data)
+
+    def handle_entityref(self, name):
+        self.out.append(f'&{name};')
+
+    def handle_charref(self, name):
+        self.out.append(f'&#{name};')
+
+    def handle_comment(self, data):
+        # Комментарии (в том числе из Word) в публичный HTML не попадают
+        pass
+
+    def handle_decl(self, decl):
+        self.out.append(f'<!{decl}>')
+
+    @staticmethod
+    def is_blank(token):
+        return not token.strip() or token.lower() in BLANK_ENTITIES or token.lower().startswith('<br')
+
+    def image_attrs(self, attrs):
+        names = {name for name, _ in attrs}
+        attrs = list(attrs)
+        if 'loading' not in names:
+            attrs.append(('loading', 'lazy'))
+        if 'decoding' not in names:
+            attrs.append(('decoding', 'async'))
+        if not {'width', 'height'} & names:
+            size = image_size(dict(attrs).get('src') or '')
+            if size:
+                attrs += [('width', str(size[0])), ('height', str(size[1]))]
+        return attrs
+
+    def render_image(self, attrs, self_closing):
+        """<img> с JPEG-копиями в srcset, обёрнутый в <picture> с WebP-копиями"""
+        source = media_name(dict(attrs).get('src') or '')
+        if self.srcset is None or source is None or any(name == 'srcset' for name, _ in attrs):
+            return render_tag('img', attrs, self_closing)
+        sizes = settings.IMAGE_CONTENT_SIZES
+        jpeg, webp = self.srcset(source, 'jpeg'), self.srcset(source, 'webp')
+        if jpeg:
+            attrs = attrs + [('srcset', jpeg), ('sizes', sizes)]
+        img = render_tag('img', attrs, self_closing)
+        if not webp:
+            return img
+        webp_source = render_tag('source', [('type', 'image/webp'), ('srcset', webp), ('sizes', sizes)])
+        return f'<picture>{webp_source}{img}</picture>'
+
+    def add_heading(self, tag, index, attrs, inner):
+        """Якорь заголовка (свой id из редактора сохраняется) и пункт оглавления"""
+        title = ' '.join(unescape(''.join(t for t in inner if not t.startswith('<'))).split())
+        anchor = dict(attrs).get('id')
+        if not anchor:
+            anchor = self.unique_id(slugify(title, allow_unicode=True) or 'section')
+            self.out[index] = render_tag(tag, list(attrs) + [('id', anchor)])
+        self.used_ids.add(anchor)
+        self.toc.append({'id': anchor, 'title': title, 'level': int(tag[1])})
+
+    def unique_id(self, base):
+        anchor, n = base, 2
+        while anchor in self.used_ids:
+            anchor, n = f'{base}-{n}', n + 1
+        return anchor
+
+
+def render_content(html, srcset=None):
+    """(обработанный HTML, оглавление [{'id', 'title', 'level'}]) для текста страницы.
+
+    `srcset(имя файла, формат)` возвращает srcset копий картинки (ImageVariant.srcset).
+    """
+    if not html or not html.strip():
+        return '', []
+    renderer = ContentRenderer(srcset)
+    renderer.feed(html)
+    renderer.close()
+    return ''.join(renderer.out).strip(), renderer.toc
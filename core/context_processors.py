@@ -1,20 +1,19 @@
+from django.utils.functional import SimpleLazyObject
+
 from .models import SiteSettings, Page
 
 
 def site_settings(request):
-    """Добавляет настройки сайта и меню во все шаблоны"""
-    settings = SiteSettings.get_settings()
-    menu_pages = Page.objects.filter(
-        is_published=True,
-        show_in_menu=True
-    ).exclude(slug='home').order_by('order', 'title')
+    """Добавляет настройки сайта и меню во все шаблоны.
 
-    canonical_url = request.build_absolute_uri(request.path)
+    Значения ленивые: ответ, который их не использует, ничего не вычисляет.
+    """
+    settings = SimpleLazyObject(SiteSettings.get_settings)
 
     return {
         'site_settings': settings,
-        'menu_pages': menu_pages,
-        'recaptcha_site_key': settings.recaptcha_site_key,
-        'seo_canonical_url': canonical_url,
-        'seo_site_url': request.build_absolute_uri('/'),
+        'menu_pages': SimpleLazyObject(Page.get_menu),
+        'recaptcha_site_key': SimpleLazyObject(lambda: settings.recaptcha_site_key),
+        'seo_canonical_url': SimpleLazyObject(lambda: request.build_absolute_uri(request.path)),
+        'seo_site_url': SimpleLazyObject(lambda: request.build_absolute_uri('/')),
     }
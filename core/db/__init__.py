@@ -0,0 +1,23 @@
+"""Профиль SQLite для работы под несколькими процессами Passenger.
+
+ENGINE 'core.db' — стандартный бэкенд sqlite3 с поддержкой
+OPTIONS['transaction_mode'] ('DEFERRED' / 'IMMEDIATE' / 'EXCLUSIVE'), как в
+Django 5.1. PRAGMA из settings.SQLITE_PRAGMAS применяются к каждому новому
+соединению по сигналу connection_created (см. core.signals).
+"""
+
+# Порядок важен: busy_timeout раньше journal_mode, чтобы смена режима ждала блокировку
+PRAGMA_ORDER = ('busy_timeout', 'journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'temp_store')
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    """Выполняет PRAGMA из словаря `pragmas` на курсоре SQLite"""
+    names = [name for name in PRAGMA_ORDER if name in pragmas]
+    names += [name for name in pragmas if name not in PRAGMA_ORDER]
+    for name in names:
+        value = pragmas[name]
+        if value is None or value == '':
+            continue
+        if not str(value).lstrip('-').isalnum():
+            raise ValueError(f'Недопустимое значение PRAGMA {name}: {value!r}')
+        cursor.execute(f'PRAGMA {name} = {value}')
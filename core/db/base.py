@@ -0,0 +1,26 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(SQLiteDatabaseWrapper):
+    """sqlite3 с настраиваемым режимом BEGIN для транзакций на запись.
+
+    BEGIN IMMEDIATE берёт блокировку записи в начале транзакции: конкурирующий
+    писатель ждёт busy_timeout, а не получает «database is locked» при попытке
+    поднять блокировку чтения до записи.
+    """
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        mode = (kwargs.pop('transaction_mode', None) or 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"DATABASES['OPTIONS']['transaction_mode'] должен быть одним из {', '.join(TRANSACTION_MODES)}"
+            )
+        self.transaction_mode = mode
+        return kwargs
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
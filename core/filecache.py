@@ -0,0 +1,63 @@
+"""Файловый кеш с атомарными add() и incr() между процессами.
+
+Стандартный FileBasedCache делает incr() как get() + set(): два воркера
+Passenger теряют одно из увеличений, а set() ещё и сбрасывает срок жизни
+ключа на TIMEOUT по умолчанию. Здесь add() и incr() выполняются под
+блокировкой файла в каталоге кеша, incr() сохраняет исходный срок жизни.
+"""
+import os
+import pickle
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache as DjangoFileBasedCache
+from django.core.files import locks
+from django.core.files.move import file_move_safe
+
+LOCK_NAME = 'counters.lock'
+
+
+class FileBasedCache(DjangoFileBasedCache):
+
+    @contextmanager
+    def _counter_lock(self):
+        self._createdir()
+        with open(os.path.join(self._dir, LOCK_NAME), 'ab') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(lock)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._counter_lock():
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        fname = self._key_to_file(key, version)
+        with self._counter_lock():
+            try:
+                with open(fname, 'rb') as f:
+                    if self._is_expired(f):
+                        raise ValueError(f"Key '{key}' not found")
+                    f.seek(0)
+                    expiry = pickle.load(f)
+                    value = pickle.loads(zlib.decompress(f.read())) + delta
+            except FileNotFoundError:
+                raise ValueError(f"Key '{key}' not found")
+            # Новое значение пишется во временный файл и подменяет старый: читатель
+            # не увидит недописанный файл; срок жизни остаётся прежним
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+            renamed = False
+            try:
+                with open(fd, 'wb') as f:
+                    f.write(pickle.dumps(expiry, self.pickle_protocol))
+                    f.write(zlib.compress(pickle.dumps(value, self.pickle_protocol)))
+                file_move_safe(tmp_path, fname, allow_overwrite=True)
+                renamed = True
+            finally:
+                if not renamed:
+                    os.remove(tmp_path)
+        return value
@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from .models import ContactRequest
 
@@ -13,6 +15,11 @@ class ContactForm(forms.ModelForm):
             'autocomplete': 'off',
         })
     )
+    idempotency_key = forms.CharField(
+        required=False,
+        max_length=64,
+        widget=forms.HiddenInput(),
+    )
     privacy_agreement = forms.BooleanField(
         required=True,
         widget=forms.CheckboxInput(attrs={
@@ -54,6 +61,9 @@ class ContactForm(forms.ModelForm):
         self.page = kwargs.pop('page', None)
         self.page_url = kwargs.pop('page_url', '')
         super().__init__(*args, **kwargs)
+        if not self.is_bound:
+            # Повторная отправка той же формы не создаст вторую заявку
+            self.initial.setdefault('idempotency_key', uuid.uuid4().hex)
     
     def clean(self):
         cleaned_data = super().clean()
@@ -70,6 +80,7 @@ class ContactForm(forms.ModelForm):
         instance = super().save(commit=False)
         instance.page = self.page
         instance.page_url = self.page_url
+        instance.idempotency_key = self.cleaned_data.get('idempotency_key') or None
         if commit:
             instance.save()
         return instance
@@ -0,0 +1,207 @@
+"""Уменьшенные копии загруженных картинок (WebP и JPEG) для srcset.
+
+Когда в админке загружают og_image или картинку через CKEditor, копии
+ширин IMAGE_VARIANT_WIDTHS собираются в пуле потоков после коммита, запрос
+их не ждёт. Готовые копии лежат в media/variants/ и записаны в ImageVariant;
+тег {% srcset %} и обработка текста страниц берут адреса оттуда
+(ImageVariant.for_source).
+Пропущенное (перезапуск процесса, старые файлы) дособерёт
+`manage.py build_image_variants`.
+"""
+import io
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from PIL import ExifTags, Image, ImageOps
+
+from .content import media_name
+from .models import ImageVariant, Page
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'variants'
+# формат ImageVariant: (формат Pillow, расширение файла)
+FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff'}
+# Поворот из EXIF, при котором ширина и высота меняются местами
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+def is_source_image(name):
+    """Можно ли собирать копии для файла `name` (сами копии не в счёт)"""
+    path = PurePosixPath(name)
+    return path.suffix.lower() in IMAGE_EXTENSIONS and path.parts[:1] != (VARIANTS_DIR,)
+
+
+def variant_name(source, width, fmt):
+    # Расширение исходника остаётся в имени: photo.png и photo.jpg не пересекутся
+    return f'{VARIANTS_DIR}/{source}-{width}w.{FORMATS[fmt][1]}'
+
+
+def source_name(image):
+    """Имя исходного файла для FieldFile или адреса картинки в медиа"""
+    if not image:
+        return None
+    if isinstance(image, str):
+        return media_name(image)
+    return image.name
+
+
+def variant_url(source, width, fmt='jpeg'):
+    """Адрес самой широкой копии не шире `width` или None"""
+    fitting = [url for f, w, _, url in ImageVariant.for_source(source) if f == fmt and w <= width]
+    return fitting[-1] if fitting else None
+
+
+def oriented_size(image):
+    """Размер картинки с учётом поворота из EXIF (без декодирования)"""
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    return image.size[::-1] if orientation in TRANSPOSED_ORIENTATIONS else image.size
+
+
+def prepare(image, largest):
+    """Декодирует картинку не крупнее нужного и приводит к RGB/RGBA"""
+    scale = largest / oriented_size(image)[0]
+    # Для JPEG декодер сразу уменьшает в 2/4/8 раз: меньше памяти и времени
+    image.draft('RGB', (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    return image.convert('RGBA' if has_alpha else 'RGB')
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    quality = settings.IMAGE_VARIANT_QUALITY
+    if fmt == 'jpeg':
+        if image.mode == 'RGBA':
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def build_variants(source, force=False):
+    """Собирает недостающие копии файла `source`; возвращает число новых.
+
+    Копии шире оригинала не делаются. После сборки страницы, которые
+    используют картинку, пересохраняются, чтобы в их HTML попал srcset.
+    """
+    if not is_source_image(source):
+        return 0
+    existing = set() if force else set(
+        ImageVariant.objects.filter(source=source).values_list('format', 'width'))
+    built = 0
+    try:
+        with default_storage.open(source) as f, Image.open(f) as original:
+            original_width = oriented_size(original)[0]
+            targets = [(fmt, width) for width in sorted(settings.IMAGE_VARIANT_WIDTHS, reverse=True)
+                       if width < original_width for fmt in FORMATS if (fmt, width) not in existing]
+            if not targets:
+                return 0
+            image = prepare(original, targets[0][1])
+            for width in dict.fromkeys(width for _, width in targets):
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+                for fmt in (fmt for fmt, w in targets if w == width):
+                    save_variant(source, fmt, resized, encode(resized, fmt))
+                    built += 1
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning(f'Копии картинки {source} не собраны: {e}')
+    if built:
+        cache.delete(ImageVariant.cache_key(source))
+        refresh_pages(source)
+    return built
+
+
+def save_variant(source, fmt, image, data):
+    name = variant_name(source, image.width, fmt)
+    # Имя копии постоянное: пересборка заменяет файл, а не плодит name_abc123.webp
+    default_storage.delete(name)
+    name = default_storage.save(name, ContentFile(data))
+    ImageVariant.objects.update_or_create(
+        source=source, format=fmt, width=image.width,
+        defaults={'name': name, 'height': image.height, 'size': len(data)},
+    )
+
+
+def refresh_pages(source):
+    """Пересохраняет страницы с этой картинкой: новый content_html и версия 'pages'"""
+    url = default_storage.url(source)
+    for page in Page.objects.filter(Q(og_image=source) | Q(content__contains=url)):
+        page.save(update_fields=['content', 'updated_at'])
+
+
+_executor = None
+# Защищает _executor, _pending и _in_flight: два последних меняют колбэки из потоков пула
+_executor_lock = threading.Lock()
+_pending = set()
+# Файлы, копии которых уже собираются: повторная постановка их пропускает
+_in_flight = set()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                                           thread_name_prefix='image-variants')
+        return _executor
+
+
+def build_in_worker(source):
+    try:
+        return build_variants(source)
+    except Exception:
+        logger.exception(f'Ошибка сборки копий картинки {source}')
+    finally:
+        # У каждого потока пула своё соединение с БД
+        connection.close()
+
+
+def submit(source):
+    if settings.IMAGE_VARIANT_WORKERS <= 0:
+        build_variants(source)
+        return
+    with _executor_lock:
+        if source in _in_flight:
+            return
+        _in_flight.add(source)
+    future = get_executor().submit(build_in_worker, source)
+    with _executor_lock:
+        _pending.add(future)
+
+    def done(f):
+        with _executor_lock:
+            _pending.discard(f)
+            _in_flight.discard(source)
+
+    # Вызывается из потока пула (или сразу, если задача уже готова), поэтому не под блокировкой
+    future.add_done_callback(done)
+
+
+def schedule_variants(source):
+    """Ставит сборку копий в пул после коммита текущей транзакции"""
+    if source and is_source_image(source):
+        transaction.on_commit(lambda: submit(source))
+
+
+def wait_for_variants(timeout=None):
+    """Ждёт задачи пула, поставленные к этому моменту (команды, тесты)"""
+    with _executor_lock:
+        pending = list(_pending)
+    wait(pending, timeout=timeout)
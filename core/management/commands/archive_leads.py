@@ -0,0 +1,62 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.archive import archive_leads, archive_root, default_compression, search_archive
+from core.management.commands.export_leads import parse_date
+from core.models import ContactRequest
+
+
+class Command(BaseCommand):
+    help = 'Переносит старые заявки в сжатый архив по месяцам или ищет по архиву (--search)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.LEADS_RETENTION_DAYS,
+                            help='Архивировать заявки старше стольких дней')
+        parser.add_argument('--archive-dir', default=str(archive_root()),
+                            help='Каталог архива (по умолчанию LEADS_ARCHIVE_DIR)')
+        parser.add_argument('--compression', choices=['gzip', 'zstd'], default=default_compression())
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Сколько заявок удалять за одну транзакцию')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Пауза между пачками, секунд: даёт записать новым заявкам')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не переносить')
+        parser.add_argument('--search', metavar='ТЕКСТ',
+                            help='Не архивировать, а вывести заявки из архива (JSON по строке)')
+        parser.add_argument('--since', help='Для --search: с даты включительно, ГГГГ-ММ-ДД')
+        parser.add_argument('--until', help='Для --search: по дату включительно, ГГГГ-ММ-ДД')
+
+    def handle(self, *args, **options):
+        if options['search'] is not None:
+            return self.search(options)
+
+        if options['days'] < 1:
+            raise CommandError('--days должен быть больше нуля')
+        if options['dry_run']:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+            count = ContactRequest.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'К переносу в архив: {count}')
+            return
+
+        total, files = archive_leads(
+            options['days'],
+            root=options['archive_dir'],
+            compression=options['compression'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+        )
+        for path in files:
+            self.stdout.write(f'  {path}')
+        self.stdout.write(f'Перенесено в архив: {total}')
+
+    def search(self, options):
+        since = options['since'] and parse_date(options['since'])
+        until = options['until'] and parse_date(options['until'])
+        found = 0
+        for record in search_archive(options['search'], options['archive_dir'], since, until):
+            self.stdout.write(json.dumps(record, ensure_ascii=False))
+            found += 1
+        self.stderr.write(f'Найдено в архиве: {found}')
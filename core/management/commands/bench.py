@@ -0,0 +1,125 @@
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from core.bench import (SCENARIOS, SQLITE_READERS, SQLITE_WRITERS, compare, report_meta, run_bench,
+                        run_sqlite_contention, seed)
+
+
+@contextmanager
+def isolated_environment(tmp):
+    """Отдельная база и кеш на время замера: рабочие данные не трогаются.
+
+    SQLite-база создаётся файлом (как в работе, с теми же PRAGMA), файловые
+    кеши — в том же временном каталоге; прочие бэкенды кеша заменяются
+    памятью процесса, чтобы cache.clear() не задел общий кеш.
+    """
+    caches = dict(settings.CACHES)
+    for alias in ('default', 'ratelimit'):
+        if caches[alias]['BACKEND'].endswith('FileBasedCache'):
+            caches[alias] = {**caches[alias], 'LOCATION': str(Path(tmp) / f'cache-{alias}')}
+        else:
+            caches[alias] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'bench-{alias}'}
+    overrides = {'CACHES': caches}
+    # Без collectstatic манифеста нет, и {% static %} упал бы на первой странице
+    if getattr(staticfiles_storage, 'read_manifest', None) and staticfiles_storage.read_manifest() is None:
+        overrides['STORAGES'] = {**settings.STORAGES, 'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = str(Path(tmp) / 'bench.sqlite3')
+    setup_test_environment()
+    # Миграции тоже пишут в кеш (версии контента), поэтому подмена — раньше создания базы
+    with override_settings(**overrides):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = old_test_name
+            teardown_test_environment()
+
+
+class Command(BaseCommand):
+    help = ('Замеряет главную, страницы, политику, отправку заявки, sitemap и robots.txt '
+            'на засеянных данных (отдельная временная база) и выводит JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=50, help='Сколько страниц засеять')
+        parser.add_argument('--leads', type=int, default=1000, help='Сколько заявок засеять')
+        parser.add_argument('--iterations', type=int, default=100, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=5, help='Запросов на прогрев (не считаются)')
+        parser.add_argument('--scenario', action='append', choices=[name for name, _ in SCENARIOS],
+                            help='Только этот сценарий (можно несколько раз)')
+        parser.add_argument('--output', help='Сохранить отчёт в файл (например, как эталон)')
+        parser.add_argument('--compare', metavar='BASELINE', help='Сравнить с сохранённым отчётом')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Допустимый рост времени в долях (0.25 = 25%%)')
+        parser.add_argument('--sqlite-seconds', type=float, default=1.0,
+                            help='Длительность замера конкурентной записи в SQLite на профиль (0 — не замерять)')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['pages'] < 1:
+            raise CommandError('--iterations и --pages должны быть больше нуля')
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text(encoding='utf-8'))['scenarios']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f'Не удалось прочитать эталон {options["compare"]}: {e}')
+
+        with tempfile.TemporaryDirectory() as tmp, isolated_environment(tmp):
+            slugs = seed(pages=options['pages'], leads=options['leads'])
+            results = run_bench(slugs, iterations=options['iterations'], warmup=options['warmup'],
+                                scenarios=options['scenario'])
+            sqlite = None
+            if connection.vendor == 'sqlite' and options['sqlite_seconds'] > 0:
+                sqlite = run_sqlite_contention(tmp, options['sqlite_seconds'])
+
+        report = {
+            'meta': report_meta(pages=options['pages'], leads=options['leads'],
+                                iterations=options['iterations'], warmup=options['warmup']),
+            'scenarios': results,
+        }
+        if sqlite:
+            report['sqlite'] = sqlite
+        regressions = None
+        if baseline is not None:
+            regressions = report['regressions'] = compare(results, baseline, options['threshold'])
+
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(text + '\n', encoding='utf-8')
+        self.stdout.write(text)
+        if options['verbosity'] >= 1:
+            self.print_summary(results, regressions, sqlite)
+        if regressions:
+            raise CommandError(f'Регрессий относительно {options["compare"]}: {len(regressions)}')
+
+    def print_summary(self, results, regressions, sqlite=None):
+        """Короткая таблица в stderr, чтобы stdout оставался чистым JSON"""
+        self.stderr.write(f'{"сценарий":<22}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL":>7}{"шаблоны":>9}{"байт":>9}')
+        for name, r in results.items():
+            latency = r['latency_ms']
+            self.stderr.write(
+                f'{name:<22}{latency["p50"]:>9.2f}{latency["p95"]:>9.2f}{latency["p99"]:>9.2f}'
+                f'{r["queries"]["mean"]:>7.1f}{r["template_ms"]["p50"]:>9.2f}{r["bytes"]["mean"]:>9}'
+            )
+        if sqlite:
+            self.stderr.write(f'SQLite, {SQLITE_WRITERS} писателя и {SQLITE_READERS} читателя, операций в секунду:')
+            for label, name in (('по умолчанию', 'default'), ('профиль core.db', 'tuned')):
+                r = sqlite[name]
+                self.stderr.write(f'  {label:<18}записей {r["writes_per_s"]:>9.1f}  чтений {r["reads_per_s"]:>9.1f}'
+                                  f'  «database is locked»: {r["locked"]}')
+        for r in regressions or ():
+            self.stderr.write(self.style.ERROR(
+                f'  {r["scenario"]} {r["metric"]}: {r["baseline"]} → {r["current"]} ({r["change"]})'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.assets import build_assets, build_dir
+
+
+class Command(BaseCommand):
+    help = 'Минифицирует CSS/JS, собирает критический CSS шаблонов и урезанные шрифты в static/build/'
+
+    def handle(self, *args, **options):
+        build_assets(log=self.stdout.write)
+        self.stdout.write(f'Сборка статики: {build_dir()}')
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.images import VARIANTS_DIR, build_variants, is_source_image
+
+
+def media_images(root):
+    """Имена картинок в MEDIA_ROOT (без каталога копий) в порядке обхода"""
+    root = Path(root)
+    for path in sorted(root.rglob('*')):
+        name = path.relative_to(root).as_posix()
+        if path.is_file() and is_source_image(name):
+            yield name
+
+
+def build_in_thread(name, force):
+    try:
+        return build_variants(name, force=force)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Собирает уменьшенные копии (WebP и JPEG) для уже загруженных картинок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.IMAGE_VARIANT_WORKERS, 1),
+                            help='Сколько картинок обрабатывать параллельно')
+        parser.add_argument('--force', action='store_true', help='Пересобрать и уже готовые копии')
+        parser.add_argument('--dry-run', action='store_true', help='Только перечислить картинки')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers должен быть больше нуля')
+        names = list(media_images(settings.MEDIA_ROOT))
+        if options['dry_run']:
+            for name in names:
+                self.stdout.write(f'  {name}')
+            self.stdout.write(f'Картинок: {len(names)} (копии кладутся в {VARIANTS_DIR}/)')
+            return
+
+        total = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(build_in_thread, names, [options['force']] * len(names))
+            for name, built in zip(names, results):
+                if built:
+                    self.stdout.write(f'  {name}: {built}')
+                total += built
+        self.stdout.write(f'Картинок: {len(names)}, новых копий: {total}')
@@ -0,0 +1,20 @@
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectStaticCommand
+
+from core.assets import FONT_SOURCE_DIR, build_assets
+
+
+class Command(CollectStaticCommand):
+    """collectstatic, который сначала собирает static/build/ (см. build_assets)"""
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--skip-assets', action='store_true',
+                            help='Не пересобирать минифицированные файлы и критический CSS')
+
+    def handle(self, **options):
+        # Исходники шрифтов нужны только сборке: на сайт идут урезанные копии из build/
+        options['ignore_patterns'] = [*(options['ignore_patterns'] or []), f'{FONT_SOURCE_DIR}/*']
+        if not options['skip_assets']:
+            verbose = options['verbosity'] >= 1
+            build_assets(log=self.stdout.write if verbose else lambda message: None)
+        return super().handle(**options)
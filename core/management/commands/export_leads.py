@@ -0,0 +1,53 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import FORMATS, filter_leads, stream_export
+from core.models import ContactRequest
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Дата должна быть в формате ГГГГ-ММ-ДД: {value}')
+
+
+class Command(BaseCommand):
+    help = 'Выгружает заявки в CSV или XLSX потоком (память не растёт с числом заявок)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию stdout)')
+        parser.add_argument('--since', help='С даты включительно, ГГГГ-ММ-ДД')
+        parser.add_argument('--until', help='По дату включительно, ГГГГ-ММ-ДД')
+        parser.add_argument('--page', help='Slug страницы, с которой пришла заявка')
+        status = parser.add_mutually_exclusive_group()
+        status.add_argument('--processed', dest='processed', action='store_const', const=True,
+                            help='Только обработанные')
+        status.add_argument('--unprocessed', dest='processed', action='store_const', const=False,
+                            help='Только необработанные')
+
+    def handle(self, *args, **options):
+        queryset = filter_leads(
+            ContactRequest.objects.all(),
+            since=options['since'] and parse_date(options['since']),
+            until=options['until'] and parse_date(options['until']),
+            page=options['page'],
+            processed=options['processed'],
+        )
+        fmt = options['format']
+        chunks = stream_export(queryset, fmt)
+
+        if options['output']:
+            mode, encoding = ('w', 'utf-8') if fmt == 'csv' else ('wb', None)
+            with open(options['output'], mode, encoding=encoding, newline='' if fmt == 'csv' else None) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        elif fmt == 'csv':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Max
+from django.test import Client
+
+from core.cache import compute_build_fingerprint, mask_per_request_inputs
+from core.models import Page, SiteSettings
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него пишем только .gz
+    brotli = None
+
+MANIFEST_NAME = '.export-manifest.json'
+
+
+class Command(BaseCommand):
+    help = 'Выгружает публичные страницы в статические файлы для фронт-сервера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.BASE_DIR / 'public'),
+                            help='Каталог выгрузки (по умолчанию ./public)')
+        parser.add_argument('--host', help='Домен сайта (по умолчанию из django.contrib.sites)')
+        parser.add_argument('--scheme', default='https', choices=['http', 'https'])
+        parser.add_argument('--force', action='store_true',
+                            help='Перерисовать все страницы, даже неизменённые')
+
+    def handle(self, *args, **options):
+        output = Path(options['output'])
+        output.mkdir(parents=True, exist_ok=True)
+        host = options['host'] or Site.objects.get_current().domain
+        client = Client(HTTP_HOST=host, secure=options['scheme'] == 'https')
+
+        manifest_path = output / MANIFEST_NAME
+        old_manifest = {}
+        if manifest_path.exists() and not options['force']:
+            old_manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+
+        new_manifest = {}
+        written = skipped = 0
+        for url, filename, fingerprint in self.get_targets(host):
+            new_manifest[url] = {'file': filename, 'fingerprint': fingerprint}
+            target = output / filename
+            if old_manifest.get(url, {}).get('fingerprint') == fingerprint and target.exists():
+                skipped += 1
+                continue
+
+            response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+            content = response.content
+            if filename.endswith('.html'):
+                # В статике нет сессии: CSRF-cookie форма получит через GET submit-contact/,
+                # ключ идемпотентности сгенерирует main.js
+                content = mask_per_request_inputs(content.decode('utf-8'), value='').encode('utf-8')
+            write_variants(target, content)
+            written += 1
+            self.stdout.write(f'  ↓ {url} → {filename}')
+
+        removed = 0
+        for url, entry in old_manifest.items():
+            if url not in new_manifest:
+                for suffix in ('', '.gz', '.br'):
+                    stale = output / (entry['file'] + suffix)
+                    if stale.exists():
+                        stale.unlink()
+                removed += 1
+
+        manifest_path.write_text(json.dumps(new_manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: записано {written}, без изменений {skipped}, удалено {removed}'
+        ))
+
+    def get_targets(self, host):
+        """(URL, файл, отпечаток) для каждой выгружаемой страницы"""
+        site = SiteSettings.get_settings()
+        build = compute_build_fingerprint()
+        common = fingerprint(build, site.version, repr(Page.get_menu()))
+
+        pages = Page.objects.filter(is_published=True)
+        stats = pages.aggregate(last=Max('updated_at'), total=Count('pk'))
+        all_pages = fingerprint(stats['last'], stats['total'])
+
+        yield '/', 'index.html', fingerprint(common, all_pages)
+        yield '/privacy/', 'privacy/index.html', common
+        for slug, updated_at in pages.exclude(slug='home').values_list('slug', 'updated_at'):
+            yield f'/{slug}/', f'{slug}/index.html', fingerprint(common, updated_at)
+        yield '/sitemap.xml', 'sitemap.xml', fingerprint(host, all_pages)
+        yield '/robots.txt', 'robots.txt', fingerprint(host)
+
+
+def fingerprint(*parts):
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+
+def write_variants(target, content):
+    """Пишет файл и его сжатые копии (.gz, .br) для отдачи фронт-сервером"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    target.write_bytes(content)
+    Path(f'{target}.gz').write_bytes(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        Path(f'{target}.br').write_bytes(brotli.compress(content))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.search import PAGE_FTS_TABLE, rebuild_page_index
+
+
+class Command(BaseCommand):
+    help = 'Заново строит индекс поиска по страницам (после правок стеммера или разбора HTML)'
+
+    def handle(self, *args, **options):
+        indexed = rebuild_page_index()
+        if indexed is None:
+            raise CommandError(f'Таблицы {PAGE_FTS_TABLE} нет: база не SQLite или SQLite собран без FTS5')
+        self.stdout.write(f'Страниц в индексе: {indexed}')
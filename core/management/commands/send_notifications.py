@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.services import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = 'Отправляет уведомления о заявках из очереди (запускать по cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Сколько уведомлений брать за один проход')
+        parser.add_argument('--max-attempts', type=int, default=8,
+                            help='После стольких неудачных попыток уведомление помечается недоставленным')
+        parser.add_argument('--loop', action='store_true',
+                            help='Не завершаться, а проверять очередь каждые --interval секунд')
+        parser.add_argument('--interval', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        total_sent = total_retried = total_dead = 0
+        while True:
+            sent, retried, dead = deliver_outbox(
+                batch_size=options['batch_size'],
+                max_attempts=options['max_attempts'],
+            )
+            total_sent += sent
+            total_retried += retried
+            total_dead += dead
+            if sent + retried + dead:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(
+            f'Отправлено: {total_sent}, отложено: {total_retried}, не доставлено: {total_dead}'
+        )
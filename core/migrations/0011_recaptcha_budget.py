@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_sitesettings_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sitesettings',
+            name='recaptcha_fail_open',
+            field=models.BooleanField(default=True, help_text='Если Google не отвечает: включено — заявка принимается, выключено — отклоняется', verbose_name='Принимать заявки при недоступности reCAPTCHA'),
+        ),
+        migrations.AddField(
+            model_name='sitesettings',
+            name='recaptcha_timeout',
+            field=models.FloatField(default=3.0, help_text='Сколько максимум ждать ответа Google на одну заявку', verbose_name='Лимит времени на проверку reCAPTCHA (сек)'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recaptcha_budget'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sitesettings',
+            name='rate_limit_per_ip',
+            field=models.PositiveIntegerField(default=5, help_text='0 — без ограничения', verbose_name='Заявок с одного IP за окно'),
+        ),
+        migrations.AddField(
+            model_name='sitesettings',
+            name='rate_limit_per_phone',
+            field=models.PositiveIntegerField(default=3, help_text='0 — без ограничения', verbose_name='Заявок на один телефон за окно'),
+        ),
+        migrations.AddField(
+            model_name='sitesettings',
+            name='rate_limit_window',
+            field=models.PositiveIntegerField(default=600, help_text='Период, за который считаются заявки с одного IP / телефона', verbose_name='Окно лимита заявок (сек)'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:07
+
+import hashlib
+
+from django.db import migrations, models
+
+
+# Копии нормализации телефона и хеша заявки на момент миграции:
+# последующие правки core.services и core.models её поведение не меняют
+def normalize_phone(phone):
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def content_hash(obj):
+    parts = (obj.name, obj.email, obj.message, obj.device_info)
+    raw = '\x1f'.join(' '.join(str(p).split()).lower() for p in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def fill_dedup_fields(apps, schema_editor):
+    ContactRequest = apps.get_model('core', 'ContactRequest')
+    for obj in ContactRequest.objects.only('pk', 'name', 'phone', 'email', 'message', 'device_info').iterator():
+        obj.phone_normalized = normalize_phone(obj.phone)
+        obj.content_hash = content_hash(obj)
+        obj.save(update_fields=['phone_normalized', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_contact_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contactrequest',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=40, verbose_name='Хеш содержимого'),
+        ),
+        migrations.AddField(
+            model_name='contactrequest',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Ключ идемпотентности'),
+        ),
+        migrations.AddField(
+            model_name='contactrequest',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=20, verbose_name='Телефон (цифры)'),
+        ),
+        migrations.AddIndex(
+            model_name='contactrequest',
+            index=models.Index(fields=['phone_normalized', 'content_hash', 'created_at'], name='core_contact_dedup_idx'),
+        ),
+        migrations.RunPython(fill_dedup_fields, migrations.RunPython.noop),
+    ]
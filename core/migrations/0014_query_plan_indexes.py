@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_contact_dedup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contactrequest',
+            index=models.Index(fields=['created_at'], name='core_contact_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contactrequest',
+            index=models.Index(condition=models.Q(('is_processed', False)), fields=['created_at'], name='core_contact_unprocessed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['order', 'title'], name='core_page_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['page_type', 'order'], name='core_page_service_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('is_published', True), ('show_in_menu', True)), fields=['order', 'title', 'slug', 'menu_title', 'page_type'], name='core_page_menu_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['updated_at'], name='core_page_published_idx'),
+        ),
+    ]
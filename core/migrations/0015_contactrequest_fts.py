@@ -0,0 +1,65 @@
+# Полнотекстовый индекс заявок для поиска в админке (только SQLite с FTS5)
+
+from django.db import OperationalError, migrations
+
+# ё → е: токенизатор unicode61 снимает диакритику только с латиницы
+FOLD = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+
+INSERT_ROW = (
+    'INSERT INTO core_contactrequest_fts (rowid, name, phone, email, message, device_info) '
+    "VALUES (new.id, {}, new.phone || ' ' || new.phone_normalized, new.email, {}, {});"
+).format(FOLD.format('new.name'), FOLD.format('new.message'), FOLD.format('new.device_info'))
+
+FORWARD_SQL = [
+    "CREATE VIRTUAL TABLE core_contactrequest_fts USING fts5("
+    "name, phone, email, message, device_info, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    'CREATE TRIGGER core_contactrequest_fts_ai AFTER INSERT ON core_contactrequest BEGIN '
+    + INSERT_ROW + ' END',
+    'CREATE TRIGGER core_contactrequest_fts_ad AFTER DELETE ON core_contactrequest BEGIN '
+    'DELETE FROM core_contactrequest_fts WHERE rowid = old.id; END',
+    'CREATE TRIGGER core_contactrequest_fts_au AFTER UPDATE OF '
+    'name, phone, phone_normalized, email, message, device_info ON core_contactrequest BEGIN '
+    'DELETE FROM core_contactrequest_fts WHERE rowid = old.id; ' + INSERT_ROW + ' END',
+    'INSERT INTO core_contactrequest_fts (rowid, name, phone, email, message, device_info) '
+    "SELECT id, {}, phone || ' ' || phone_normalized, email, {}, {} FROM core_contactrequest".format(
+        FOLD.format('name'), FOLD.format('message'), FOLD.format('device_info')),
+]
+
+REVERSE_SQL = [
+    'DROP TRIGGER IF EXISTS core_contactrequest_fts_ai',
+    'DROP TRIGGER IF EXISTS core_contactrequest_fts_ad',
+    'DROP TRIGGER IF EXISTS core_contactrequest_fts_au',
+    'DROP TABLE IF EXISTS core_contactrequest_fts',
+]
+
+
+def create_fts(apps, schema_editor):
+    # На других СУБД и без FTS5 админка ищет обычным icontains
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute('CREATE VIRTUAL TABLE temp.core_fts5_probe USING fts5(x)')
+        schema_editor.execute('DROP TABLE temp.core_fts5_probe')
+    except OperationalError:
+        return
+    for sql in FORWARD_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in REVERSE_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
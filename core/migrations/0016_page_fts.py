@@ -0,0 +1,37 @@
+# Поисковый индекс страниц для /search/ (только SQLite с FTS5)
+
+from django.db import OperationalError, migrations
+
+CREATE_SQL = (
+    'CREATE VIRTUAL TABLE core_page_fts USING fts5('
+    'title, hero, content, body UNINDEXED, '
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+
+def create_index(apps, schema_editor):
+    # На других СУБД и без FTS5 поиск работает по заголовкам через icontains.
+    # Строки индекса (нужен стеммер) заполняет core.signals.index_pages_after_migrate
+    # после migrate, а потом сигнал сохранения Page и manage.py rebuild_search_index
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_SQL)
+    except OperationalError:
+        return
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_page_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_contactrequest_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
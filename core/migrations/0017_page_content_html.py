@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+def copy_existing_content(apps, schema_editor):
+    # Замороженный шаг: content_html — исходный HTML, как шаблон выводил его
+    # до миграции. Обработку текущим core.content и сброс кеша страниц делает
+    # core.signals.render_pages_after_migrate, когда migrate уже закончен.
+    Page = apps.get_model('core', 'Page')
+    Page.objects.update(content_html=models.F('content'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_page_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, verbose_name='Обработанный контент'),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='toc',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Оглавление'),
+        ),
+        migrations.RunPython(copy_existing_content, migrations.RunPython.noop),
+    ]
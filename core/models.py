@@ -1,6 +1,16 @@
+import hashlib
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
 from django.db import models
+from django.utils import timezone
 from django_ckeditor_5.fields import CKEditor5Field
 
+from .cache import VersionedSnapshot
+from .content import render_content
+from .services import normalize_phone
+
 
 class SiteSettings(models.Model):
     """Настройки сайта (singleton)"""
@@ -57,6 +67,32 @@ class SiteSettings(models.Model):
         default=0.5,
         help_text='От 0.0 до 1.0. Рекомендуется 0.5. Чем выше - тем строже проверка'
     )
+    recaptcha_timeout = models.FloatField(
+        'Лимит времени на проверку reCAPTCHA (сек)',
+        default=3.0,
+        help_text='Сколько максимум ждать ответа Google на одну заявку'
+    )
+    recaptcha_fail_open = models.BooleanField(
+        'Принимать заявки при недоступности reCAPTCHA',
+        default=True,
+        help_text='Если Google не отвечает: включено — заявка принимается, выключено — отклоняется'
+    )
+
+    rate_limit_window = models.PositiveIntegerField(
+        'Окно лимита заявок (сек)',
+        default=600,
+        help_text='Период, за который считаются заявки с одного IP / телефона'
+    )
+    rate_limit_per_ip = models.PositiveIntegerField(
+        'Заявок с одного IP за окно',
+        default=5,
+        help_text='0 — без ограничения'
+    )
+    rate_limit_per_phone = models.PositiveIntegerField(
+        'Заявок на один телефон за окно',
+        default=3,
+        help_text='0 — без ограничения'
+    )
 
     yandex_metrika = models.TextField(
         'Код счётчика Яндекс.Метрики',
@@ -70,6 +106,8 @@ class SiteSettings(models.Model):
         help_text='Значение content из тега <meta name="yandex-verification" content="..."> (только значение, без кавычек)'
     )
 
+    updated_at = models.DateTimeField('Обновлены', auto_now=True)
+
     class Meta:
         verbose_name = 'Настройки сайта'
         verbose_name_plural = 'Настройки сайта'
@@ -80,11 +118,47 @@ class SiteSettings(models.Model):
     def save(self, *args, **kwargs):
         self.pk = 1
         super().save(*args, **kwargs)
+        settings_snapshot.invalidate()
     
     @classmethod
     def get_settings(cls):
+        """Неизменяемый снимок настроек (без запросов к БД на горячем пути)"""
+        return settings_snapshot.get()
+
+    @classmethod
+    def load_snapshot(cls):
         settings, _ = cls.objects.get_or_create(pk=1)
-        return settings
+        return SiteSettingsSnapshot(settings)
+
+
+class SiteSettingsSnapshot:
+    """Снимок SiteSettings только для чтения, общий для всего процесса"""
+    __slots__ = tuple(f.attname for f in SiteSettings._meta.concrete_fields) + ('version',)
+
+    def __init__(self, instance):
+        digest = hashlib.sha1()
+        for name in self.__slots__[:-1]:
+            value = getattr(instance, name)
+            object.__setattr__(self, name, value)
+            digest.update(repr(value).encode('utf-8'))
+        # Версия зависит только от содержимого — одинакова во всех воркерах
+        object.__setattr__(self, 'version', digest.hexdigest()[:12])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('SiteSettingsSnapshot доступен только для чтения')
+
+    def __delattr__(self, name):
+        raise AttributeError('SiteSettingsSnapshot доступен только для чтения')
+
+    def __str__(self):
+        return 'Настройки сайта'
+
+    @property
+    def pk(self):
+        return self.id
+
+
+settings_snapshot = VersionedSnapshot('site_settings', SiteSettings.load_snapshot)
 
 
 class Page(models.Model):
@@ -105,6 +179,9 @@ class Page(models.Model):
     hero_subtitle = models.CharField('Подзаголовок в hero-секции', max_length=500, blank=True)
     
     content = CKEditor5Field('Основной контент', config_name='extends', blank=True)
+    # Заполняются в save() из content (см. core/content.py), шаблоны выводят их как есть
+    content_html = models.TextField('Обработанный контент', blank=True, editable=False)
+    toc = models.JSONField('Оглавление', default=list, blank=True, editable=False)
     
     advantages_title = models.CharField('Заголовок блока преимуществ', max_length=200, blank=True)
     advantage_1_title = models.CharField('Преимущество 1 - заголовок', max_length=100, blank=True)
@@ -138,10 +215,34 @@ class Page(models.Model):
         verbose_name = 'Страница'
         verbose_name_plural = 'Страницы'
         ordering = ['order', 'title']
+        # Django сравнивает булевы поля как `WHERE "is_published"`, без `= 1`,
+        # поэтому SQLite не ищет по ним в составном индексе. Условие
+        # публикации вынесено в WHERE частичных индексов — по EXPLAIN QUERY PLAN
+        # запросы с ним идут через SEARCH/SCAN индекса, а не таблицы.
+        indexes = [
+            # Админка, фильтр «Страница» у заявок, sitemap
+            models.Index(fields=['order', 'title'], name='core_page_order_idx'),
+            # Услуги на главной: page_type IN (...) ORDER BY order
+            models.Index(fields=['page_type', 'order'], name='core_page_service_idx',
+                         condition=models.Q(is_published=True)),
+            # Меню: покрывающий индекс для values_list в Page.load_menu
+            models.Index(fields=['order', 'title', 'slug', 'menu_title', 'page_type'], name='core_page_menu_idx',
+                         condition=models.Q(is_published=True, show_in_menu=True)),
+            # ETag/Last-Modified и export_static: MAX(updated_at) без чтения строк
+            models.Index(fields=['updated_at'], name='core_page_published_idx',
+                         condition=models.Q(is_published=True)),
+        ]
     
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        self.content_html, self.toc = render_content(self.content, srcset=ImageVariant.srcset)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'content' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'content_html', 'toc'}
+        super().save(*args, **kwargs)
+    
     def get_absolute_url(self):
         if self.slug == 'home':
             return '/'
@@ -162,6 +263,36 @@ class Page(models.Model):
                 advantages.append({'title': title, 'text': text})
         return advantages
 
+    @classmethod
+    def get_menu(cls):
+        """Пункты меню (кортеж MenuItem), пересобираются только при изменении страниц"""
+        return menu_snapshot.get()
+
+    @classmethod
+    def load_menu(cls):
+        rows = cls.objects.filter(
+            is_published=True,
+            show_in_menu=True
+        ).exclude(slug='home').order_by('order', 'title').values_list(
+            'slug', 'title', 'menu_title', 'page_type'
+        )
+        menu = Menu(
+            MenuItem(f'/{slug}/', menu_title or title, page_type, slug)
+            for slug, title, menu_title, page_type in rows
+        )
+        menu.version = hashlib.sha1(repr(tuple(menu)).encode('utf-8')).hexdigest()[:12]
+        return menu
+
+
+MenuItem = namedtuple('MenuItem', ['url', 'title', 'page_type', 'slug'])
+
+
+class Menu(tuple):
+    """Кортеж MenuItem; version зависит только от содержимого меню"""
+    version = ''
+
+menu_snapshot = VersionedSnapshot('pages', Page.load_menu)
+
 
 class ContactRequest(models.Model):
     """Заявка с формы обратной связи"""
@@ -179,12 +310,126 @@ class ContactRequest(models.Model):
     is_processed = models.BooleanField('Обработана', default=False)
     admin_notes = models.TextField('Заметки администратора', blank=True)
     
+    idempotency_key = models.CharField('Ключ идемпотентности', max_length=64, null=True, blank=True,
+                                       unique=True, editable=False)
+    phone_normalized = models.CharField('Телефон (цифры)', max_length=20, blank=True, editable=False)
+    content_hash = models.CharField('Хеш содержимого', max_length=40, blank=True, editable=False)
+    
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     
     class Meta:
         verbose_name = 'Заявка'
         verbose_name_plural = 'Заявки'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['phone_normalized', 'content_hash', 'created_at'], name='core_contact_dedup_idx'),
+            # Сортировка и date_hierarchy в админке
+            models.Index(fields=['created_at'], name='core_contact_created_idx'),
+            # Фильтр «Необработанные» (is_processed сравнивается без `= 0`, см. Page.Meta)
+            models.Index(fields=['created_at'], name='core_contact_unprocessed_idx',
+                         condition=models.Q(is_processed=False)),
+        ]
     
     def __str__(self):
         return f'Заявка от {self.name} ({self.phone})'
+    
+    def save(self, *args, **kwargs):
+        self.phone_normalized = normalize_phone(self.phone)
+        self.content_hash = self.compute_content_hash()
+        super().save(*args, **kwargs)
+    
+    def compute_content_hash(self):
+        """Хеш текста заявки: одинаковые повторные отправки дают одинаковый хеш"""
+        parts = (self.name, self.email, self.message, self.device_info)
+        raw = '\x1f'.join(' '.join(str(p).split()).lower() for p in parts)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class NotificationOutbox(models.Model):
+    """Исходящее уведомление о заявке (outbox).
+
+    Запись создаётся в одной транзакции с заявкой, а отправляет её
+    команда `manage.py send_notifications` — ответ пользователю не ждёт Telegram.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUSES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_DEAD, 'Не доставлено'),
+    ]
+    CHANNELS = [
+        ('telegram', 'Telegram'),
+    ]
+
+    contact_request = models.ForeignKey(ContactRequest, on_delete=models.SET_NULL, null=True, blank=True,
+                                        verbose_name='Заявка', related_name='notifications')
+    channel = models.CharField('Канал', max_length=20, choices=CHANNELS, default='telegram')
+    message = models.TextField('Текст сообщения')
+    status = models.CharField('Статус', max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка', default=timezone.now)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+
+    created_at = models.DateTimeField('Создано', auto_now_add=True)
+    sent_at = models.DateTimeField('Отправлено', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Уведомление'
+        verbose_name_plural = 'Очередь уведомлений'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='core_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_channel_display()}: {self.get_status_display()} (#{self.pk})'
+
+
+class ImageVariant(models.Model):
+    """Уменьшенная копия загруженной картинки (см. core/images.py)"""
+    FORMATS = [
+        ('webp', 'WebP'),
+        ('jpeg', 'JPEG'),
+    ]
+
+    source = models.CharField('Исходный файл', max_length=255)
+    name = models.CharField('Файл копии', max_length=255)
+    format = models.CharField('Формат', max_length=4, choices=FORMATS)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    size = models.PositiveIntegerField('Размер, байт')
+    created_at = models.DateTimeField('Создано', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Копия картинки'
+        verbose_name_plural = 'Копии картинок'
+        ordering = ['source', 'format', 'width']
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'format', 'width'], name='core_imagevariant_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.source} → {self.width}w {self.format}'
+
+    @staticmethod
+    def cache_key(source):
+        return 'core:image-variants:' + hashlib.md5(source.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def for_source(cls, source):
+        """[(формат, ширина, высота, url)] готовых копий по возрастанию ширины"""
+        key = cls.cache_key(source)
+        variants = cache.get(key)
+        if variants is None:
+            rows = (cls.objects.filter(source=source)
+                    .order_by('width').values_list('format', 'width', 'height', 'name'))
+            variants = [(fmt, width, height, default_storage.url(name)) for fmt, width, height, name in rows]
+            cache.set(key, variants, None)
+        return variants
+
+    @classmethod
+    def srcset(cls, source, fmt):
+        """Значение srcset из копий формата `fmt` или пустая строка"""
+        return ', '.join(f'{url} {width}w' for f, width, _, url in cls.for_source(source) if f == fmt)
@@ -0,0 +1,238 @@
+"""Полнотекстовый поиск на SQLite FTS5.
+
+Таблицы FTS создаются миграциями. Индекс заявок поддерживают триггеры,
+индекс страниц — сигнал сохранения Page (нужен стеммер на Python); целиком
+он строится после migrate и командой manage.py rebuild_search_index. Если
+FTS5 в сборке SQLite нет, таблицы не создаются и вызывающий код
+откатывается на обычный поиск Django.
+"""
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Page
+from .services import normalize_phone
+from .stemmer import stem
+
+CONTACT_FTS_TABLE = 'core_contactrequest_fts'
+PAGE_FTS_TABLE = 'core_page_fts'
+# Веса bm25 по столбцам core_page_fts: заголовок, hero-блок, текст, body (не индексируется)
+PAGE_FTS_WEIGHTS = (10.0, 5.0, 1.0, 0.0)
+SEARCH_RESULTS_LIMIT = 20
+SNIPPET_WORDS = 30
+
+TOKEN_RE = re.compile(r'\w+')
+PHONE_RE = re.compile(r'[\d\s()+-]+')
+
+_fts_tables = {}
+
+
+def fts_available(table):
+    """Есть ли в базе FTS-таблица `table` (проверяется раз на процесс)"""
+    key = (connection.alias, connection.settings_dict['NAME'], table)
+    if key not in _fts_tables:
+        _fts_tables[key] = (
+            connection.vendor == 'sqlite'
+            and table in connection.introspection.table_names(include_views=False)
+        )
+    return _fts_tables[key]
+
+
+def fold(text):
+    """Нормализация, одинаковая для индекса и запроса: ё → е, нижний регистр"""
+    return text.replace('ё', 'е').replace('Ё', 'Е').lower()
+
+
+def build_match_query(term):
+    """Строка MATCH: все слова обязательны, каждое ищется как префикс.
+
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе не работают
+    и не ломают запрос. Номер телефона из 10–11 цифр в любой записи
+    приводится к виду 7XXXXXXXXXX.
+    """
+    digits = normalize_phone(term)
+    if PHONE_RE.fullmatch(term.strip()) and len(digits) == 11:
+        return f'"{digits}"*'
+    tokens = []
+    for token in TOKEN_RE.findall(fold(term)):
+        if token.isdigit() and len(token) in (10, 11):
+            token = normalize_phone(token)
+        tokens.append(f'"{token}"*')
+    return ' '.join(tokens)
+
+
+def search_contact_requests(queryset, term):
+    """Отбирает заявки, подходящие под поисковую строку, по индексу FTS5"""
+    query = build_match_query(term)
+    if not query:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {CONTACT_FTS_TABLE} WHERE {CONTACT_FTS_TABLE} MATCH %s', (query,),
+    ))
+
+
+class TextExtractor(HTMLParser):
+    """Текст из HTML CKEditor: без тегов, скриптов и стилей, блоки разделены пробелом"""
+    SKIP_TAGS = ('script', 'style')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skip += 1
+        self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self.skip:
+            self.skip -= 1
+        self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    parser = TextExtractor()
+    parser.feed(html or '')
+    parser.close()
+    return ' '.join(''.join(parser.parts).split())
+
+
+def stem_text(text):
+    return ' '.join(stem(word) for word in TOKEN_RE.findall(fold(text)))
+
+
+def query_stems(term):
+    return list(dict.fromkeys(stem(word) for word in TOKEN_RE.findall(fold(term))))
+
+
+def page_index_row(page):
+    """Строка core_page_fts для страницы: основы слов по столбцам и чистый текст для сниппетов"""
+    body = html_to_text(page.content)
+    advantages = ' '.join(
+        getattr(page, f'advantage_{i}_{part}', '') for i in range(1, 6) for part in ('title', 'text')
+    )
+    return (
+        page.pk,
+        stem_text(f'{page.title} {page.menu_title} {page.meta_title}'),
+        stem_text(f'{page.hero_title} {page.hero_subtitle}'),
+        stem_text(f'{body} {page.advantages_title} {advantages} {page.meta_description}'),
+        body,
+    )
+
+
+def index_page(page):
+    """Перестраивает строку индекса одной страницы"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PAGE_FTS_TABLE} WHERE rowid = %s', (page.pk,))
+        cursor.execute(
+            f'INSERT INTO {PAGE_FTS_TABLE} (rowid, title, hero, content, body) VALUES (%s, %s, %s, %s, %s)',
+            page_index_row(page),
+        )
+
+
+def rebuild_page_index():
+    """Заново заполняет core_page_fts по всем страницам; None, если таблицы нет"""
+    # Таблицу могла только что создать миграция — проверка без кеша процесса
+    _fts_tables.clear()
+    if not fts_available(PAGE_FTS_TABLE):
+        return None
+    rows = [page_index_row(page) for page in Page.objects.iterator()]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PAGE_FTS_TABLE}')
+        cursor.executemany(
+            f'INSERT INTO {PAGE_FTS_TABLE} (rowid, title, hero, content, body) VALUES (%s, %s, %s, %s, %s)', rows,
+        )
+    return len(rows)
+
+
+def unindex_page(pk):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {PAGE_FTS_TABLE} WHERE rowid = %s', (pk,))
+
+
+def page_match_query(stems):
+    return ' '.join(f'"{s}"*' for s in stems)
+
+
+def filter_pages(queryset, term):
+    """Отбирает страницы (в том числе неопубликованные) по индексу — для админки"""
+    stems = query_stems(term)
+    if not stems:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {PAGE_FTS_TABLE} WHERE {PAGE_FTS_TABLE} MATCH %s', (page_match_query(stems),),
+    ))
+
+
+def make_snippet(body, stems):
+    """Фрагмент текста вокруг первого совпадения, найденные слова в <mark>.
+
+    Основа — всегда начало слова, поэтому совпадение проверяется префиксом
+    без повторного стемминга текста.
+    """
+    words = body.split()
+    if not words:
+        return ''
+
+    def is_hit(word):
+        return any(token.startswith(stems) for token in TOKEN_RE.findall(fold(word)))
+
+    first = next((i for i, word in enumerate(words) if is_hit(word)), 0)
+    start = max(0, first - SNIPPET_WORDS // 3)
+    end = min(len(words), start + SNIPPET_WORDS)
+    pieces = [f'<mark>{escape(word)}</mark>' if is_hit(word) else escape(word) for word in words[start:end]]
+    if start:
+        pieces.insert(0, '…')
+    if end < len(words):
+        pieces.append('…')
+    return mark_safe(' '.join(pieces))
+
+
+SearchResult = namedtuple('SearchResult', 'url title snippet')
+
+
+def search_pages(term, limit=SEARCH_RESULTS_LIMIT):
+    """Опубликованные страницы по запросу, лучшие первыми, со сниппетами.
+
+    Запрос читает только core_page_fts и короткие поля Page — исходный
+    HTML страниц не загружается.
+    """
+    stems = query_stems(term)
+    if not stems:
+        return []
+    fields = ('title', 'slug', 'hero_subtitle')
+
+    if not fts_available(PAGE_FTS_TABLE):
+        condition = Q()
+        for word in TOKEN_RE.findall(term):
+            condition &= Q(title__icontains=word) | Q(hero_title__icontains=word)
+        pages = Page.objects.filter(condition, is_published=True).only(*fields)[:limit]
+        return [SearchResult(page.get_absolute_url(), page.title, make_snippet(page.hero_subtitle, tuple(stems)))
+                for page in pages]
+
+    weights = ', '.join(str(weight) for weight in PAGE_FTS_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT {PAGE_FTS_TABLE}.rowid, {PAGE_FTS_TABLE}.body FROM {PAGE_FTS_TABLE} '
+            f'JOIN core_page ON core_page.id = {PAGE_FTS_TABLE}.rowid '
+            f'WHERE {PAGE_FTS_TABLE} MATCH %s AND core_page.is_published '
+            f'ORDER BY bm25({PAGE_FTS_TABLE}, {weights}) LIMIT %s',
+            (page_match_query(stems), limit),
+        )
+        rows = cursor.fetchall()
+    pages = Page.objects.only(*fields).in_bulk([pk for pk, _ in rows])
+    return [
+        SearchResult(pages[pk].get_absolute_url(), pages[pk].title, make_snippet(body, tuple(stems)))
+        for pk, body in rows if pk in pages
+    ]
@@ -1,13 +1,259 @@
-import urllib.request
-import urllib.parse
+import http.client
 import json
 import logging
+import threading
+import time
+import urllib.parse
+from datetime import timedelta
+
+from django.core.cache import cache, caches
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+RECAPTCHA_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+TELEGRAM_API_URL = 'https://api.telegram.org'
+
+# Одинаковые заявки с одного телефона в пределах окна (сек) схлопываются в одну
+CONTACT_DUPLICATE_WINDOW = 600
+
+# Таймауты внешних вызовов: установка соединения и получение ответа целиком
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 10
+# Тело ответа читается кусками, перед каждым проверяется остаток времени
+READ_CHUNK = 16 * 1024
+
+# reCAPTCHA: после стольких сбоев подряд перестаём ходить в Google на RESET секунд
+RECAPTCHA_BREAKER_FAILURES = 3
+RECAPTCHA_BREAKER_RESET = 60
+
+# Очередь уведомлений: первая повторная попытка через 30 с, дальше x2, не реже раза в час
+OUTBOX_RETRY_BASE_DELAY = 30
+OUTBOX_RETRY_MAX_DELAY = 3600
+# На сколько секунд воркер «арендует» запись на время отправки
+OUTBOX_LEASE_SECONDS = 300
+
+
+class HttpClientError(Exception):
+    """Ошибка исходящего HTTP-запроса"""
+
+
+class HttpClient:
+    """Исходящие HTTP-запросы с пулом keep-alive соединений на каждый хост.
+
+    Соединение с api.telegram.org или google.com переиспользуется между
+    вызовами (без нового TLS-рукопожатия), таймауты соединения и чтения
+    раздельные, размер ответа ограничен. По каждому хосту копится статистика
+    задержек — см. `stats()`.
+    """
+
+    def __init__(self, max_idle_per_host=4, max_response_bytes=256 * 1024):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_response_bytes = max_response_bytes
+        self._idle = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def post_form(self, url, data, **kwargs):
+        """POST application/x-www-form-urlencoded; возвращает (статус, тело)"""
+        body = urllib.parse.urlencode(data).encode('utf-8')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        return self.request('POST', url, body=body, headers=headers, **kwargs)
+
+    def request(self, method, url, body=None, headers=None,
+                connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_bytes=None, deadline=None):
+        """`deadline` — момент time.monotonic(), позже которого ждать нельзя"""
+        connect_limit = self._within(connect_timeout, deadline)
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        max_bytes = max_bytes or self.max_response_bytes
+
+        started = time.monotonic()
+        try:
+            conn, reused = self._acquire(key, connect_limit)
+            try:
+                status, data, keep = self._send(conn, method, path, body, headers,
+                                                self._within(read_timeout, deadline), max_bytes)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if not reused:
+                    raise
+                # Сервер закрыл простаивавшее соединение — повторяем на новом,
+                # в пределах того, что осталось от лимита времени
+                conn, _ = self._acquire(key, self._within(connect_timeout, deadline), fresh=True)
+                try:
+                    status, data, keep = self._send(conn, method, path, body, headers,
+                                                    self._within(read_timeout, deadline), max_bytes)
+                except Exception:
+                    conn.close()
+                    raise
+            except Exception:
+                conn.close()
+                raise
+        except Exception as e:
+            self._record(parts.hostname, started, error=True)
+            if isinstance(e, HttpClientError):
+                raise
+            raise HttpClientError(f'{method} {parts.hostname}: {e}') from e
+
+        if keep:
+            self._release(key, conn)
+        else:
+            conn.close()
+        self._record(parts.hostname, started)
+        return status, data
+
+    @staticmethod
+    def _within(timeout, deadline):
+        """`timeout`, урезанный до остатка времени до `deadline`"""
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HttpClientError('лимит времени исчерпан')
+        return min(timeout, remaining)
+
+    def _acquire(self, key, connect_timeout, fresh=False):
+        if not fresh:
+            with self._lock:
+                idle = self._idle.get(key)
+                if idle:
+                    return idle.pop(), True
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        conn = cls(host, port, timeout=connect_timeout)
+        conn.connect()
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, conn, method, path, body, headers, read_timeout, max_bytes):
+        """`read_timeout` ограничивает весь ответ, а не каждый recv: сервер,
+        отдающий тело по байту, не задержит воркер дольше лимита"""
+        stop_at = time.monotonic() + read_timeout
+        # При Connection: close getresponse() обнуляет conn.sock, а ответ читает тот же сокет
+        sock = conn.sock
+        sock.settimeout(read_timeout)
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        chunks, size = [], 0
+        while True:
+            remaining = stop_at - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError
+                sock.settimeout(remaining)
+                chunk = response.read1(READ_CHUNK)
+            except TimeoutError:
+                raise HttpClientError(f'ответ не получен за {read_timeout:.1f} с') from None
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HttpClientError(f'ответ больше {max_bytes} байт')
+            chunks.append(chunk)
+        # Ответ дочитан: соединение снова готово к запросу
+        response.close()
+        return response.status, b''.join(chunks), not response.will_close
+
+    def _record(self, host, started, error=False):
+        elapsed_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(host, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['calls'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        logger.debug(f'HTTP {host}: {elapsed_ms:.0f} мс{" (ошибка)" if error else ""}')
+
+    def stats(self):
+        """Снимок статистики по хостам: вызовы, ошибки, средняя и максимальная задержка"""
+        with self._lock:
+            return {
+                host: {**s, 'avg_ms': s['total_ms'] / s['calls'] if s['calls'] else 0.0}
+                for host, s in self._stats.items()
+            }
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+http_client = HttpClient()
+
+
+class CircuitBreaker:
+    """Автомат-предохранитель для внешнего сервиса.
+
+    Состояние хранится в общем кеше, поэтому все воркеры видят одно и то же:
+    после `failure_threshold` сбоев подряд вызовы не выполняются
+    `reset_timeout` секунд, затем один воркер пробует запрос (half-open) —
+    удача закрывает цепь, неудача размыкает её снова.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.key = f'core:breaker:{name}'
+        self.failures_key = f'{self.key}:failures'
+        self.opened_key = f'{self.key}:opened_at'
+        self.probe_key = f'{self.key}:probe'
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def allow(self):
+        opened_at = cache.get(self.opened_key)
+        if opened_at is None:
+            return True
+        if time.time() - opened_at < self.reset_timeout:
+            return False
+        # Пробный запрос пропускаем только одному воркеру
+        return cache.add(self.probe_key, 1, max(self.reset_timeout, 1))
+
+    def record_success(self):
+        cache.delete_many([self.failures_key, self.opened_key, self.probe_key])
+
+    def record_failure(self):
+        # Счётчик увеличивается атомарно: одновременные сбои в разных воркерах не теряются
+        cache.add(self.failures_key, 0, None)
+        try:
+            failures = cache.incr(self.failures_key)
+        except ValueError:
+            cache.add(self.failures_key, 1, None)
+            failures = 1
+        if failures >= self.failure_threshold:
+            # Цепь размыкается (или неудачная проба размыкает её снова) с этого момента
+            if cache.get(self.opened_key) is None:
+                logger.error(f'{self.key}: цепь разомкнута после {failures} сбоев')
+            cache.set(self.opened_key, time.time(), None)
+        cache.delete(self.probe_key)
+
+    def is_open(self):
+        return cache.get(self.opened_key) is not None
+
+
+recaptcha_breaker = CircuitBreaker('recaptcha', RECAPTCHA_BREAKER_FAILURES, RECAPTCHA_BREAKER_RESET)
+
+
+def recaptcha_unavailable(settings):
+    """Результат проверки, когда Google недоступен: по настройке fail-open/fail-closed"""
+    if settings.recaptcha_fail_open:
+        return True, 1.0
+    return False, 0.0
+
 
 def verify_recaptcha(token, remote_ip=None):
-    """Проверяет токен reCAPTCHA v3"""
+    """Проверяет токен reCAPTCHA v3 (не дольше settings.recaptcha_timeout секунд)"""
     from .models import SiteSettings
     
     settings = SiteSettings.get_settings()
@@ -19,8 +265,6 @@ def verify_recaptcha(token, remote_ip=None):
         logger.warning('reCAPTCHA токен отсутствует')
         return False, 0.0
     
-    url = 'https://www.google.com/recaptcha/api/siteverify'
-    
     data = {
         'secret': settings.recaptcha_secret_key,
         'response': token,
@@ -29,39 +273,111 @@ def verify_recaptcha(token, remote_ip=None):
     if remote_ip:
         data['remoteip'] = remote_ip
     
+    if not recaptcha_breaker.allow():
+        logger.warning('reCAPTCHA недоступна (цепь разомкнута), проверка пропущена')
+        return recaptcha_unavailable(settings)
+    
+    deadline = time.monotonic() + settings.recaptcha_timeout
+    try:
+        _, body = http_client.post_form(RECAPTCHA_VERIFY_URL, data, deadline=deadline)
+        result = json.loads(body.decode('utf-8'))
+    except Exception as e:
+        recaptcha_breaker.record_failure()
+        logger.error(f'Ошибка проверки reCAPTCHA: {e}')
+        return recaptcha_unavailable(settings)
+    
+    recaptcha_breaker.record_success()
     try:
-        encoded_data = urllib.parse.urlencode(data).encode('utf-8')
-        request = urllib.request.Request(url, data=encoded_data, method='POST')
-        request.add_header('Content-Type', 'application/x-www-form-urlencoded')
+        success = result.get('success', False)
+        score = result.get('score', 0.0)
         
-        with urllib.request.urlopen(request, timeout=10) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            
-            success = result.get('success', False)
-            score = result.get('score', 0.0)
-            
-            if success and score >= settings.recaptcha_min_score:
-                logger.info(f'reCAPTCHA passed: score={score}')
-                return True, score
-            else:
-                logger.warning(f'reCAPTCHA failed: success={success}, score={score}, errors={result.get("error-codes", [])}')
-                return False, score
+        if success and score >= settings.recaptcha_min_score:
+            logger.info(f'reCAPTCHA passed: score={score}')
+            return True, score
+        else:
+            logger.warning(f'reCAPTCHA failed: success={success}, score={score}, errors={result.get("error-codes", [])}')
+            return False, score
                 
     except Exception as e:
-        logger.error(f'Ошибка проверки reCAPTCHA: {e}')
-        return True, 1.0
+        logger.error(f'Ошибка разбора ответа reCAPTCHA: {e}')
+        return recaptcha_unavailable(settings)
 
 
-def send_telegram_notification(contact_request):
-    """Отправляет уведомление о новой заявке в Telegram"""
-    from .models import SiteSettings
-    
-    settings = SiteSettings.get_settings()
+def normalize_phone(phone):
+    """Приводит телефон к виду 7XXXXXXXXXX (только цифры)"""
+    digits = ''.join(ch for ch in phone if ch.isdigit())
+    if len(digits) == 11 and digits[0] == '8':
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def is_duplicate_contact(contact_request):
+    """Есть ли такая же заявка с того же телефона за последние CONTACT_DUPLICATE_WINDOW секунд.
+
+    Поиск идёт по индексу (phone_normalized, content_hash, created_at).
+    """
+    from .models import ContactRequest
     
-    if not settings.telegram_bot_token or not settings.telegram_chat_id:
-        logger.info('Telegram не настроен, уведомление не отправлено')
+    since = timezone.now() - timedelta(seconds=CONTACT_DUPLICATE_WINDOW)
+    return ContactRequest.objects.filter(
+        phone_normalized=normalize_phone(contact_request.phone),
+        content_hash=contact_request.compute_content_hash(),
+        created_at__gte=since,
+    ).exists()
+
+
+def rate_limit_exceeded(scope, identity, limit, window):
+    """Скользящее окно по двум соседним счётчикам в кеше 'ratelimit'.
+
+    Обращение засчитывается сразу, атомарно (add + incr), и только потом
+    сравнивается с `limit` за последние `window` секунд: два воркера не
+    пропустят лишнюю заявку. Отклонённое обращение счётчик не расходует.
+    """
+    if not limit or not identity:
         return False
+    counters = caches['ratelimit']
+    now = time.time()
+    current = int(now // window)
+    prefix = f'core:ratelimit:{scope}:{identity}:{window}:'
+    key = f'{prefix}{current}'
+    counters.add(key, 0, window * 2)
+    try:
+        current_count = counters.incr(key)
+    except ValueError:
+        # Счётчик истёк между add и incr
+        counters.add(key, 1, window * 2)
+        current_count = 1
+    previous_count = counters.get(f'{prefix}{current - 1}', 0)
+    # Доля предыдущего окна, ещё попадающая в последние `window` секунд
+    overlap = 1 - (now % window) / window
+    if previous_count * overlap + current_count <= limit:
+        return False
+    try:
+        counters.decr(key)
+    except ValueError:
+        pass
+    return True
+
+
+def contact_rate_limited(client_ip, phone):
+    """Проверяет лимиты заявок по IP и по телефону (настройки в админке)"""
+    from .models import SiteSettings
     
+    settings = SiteSettings.get_settings()
+    window = settings.rate_limit_window or 1
+    if rate_limit_exceeded('ip', client_ip, settings.rate_limit_per_ip, window):
+        logger.warning(f'Лимит заявок с IP {client_ip} превышен')
+        return True
+    if rate_limit_exceeded('phone', normalize_phone(phone), settings.rate_limit_per_phone, window):
+        logger.warning(f'Лимит заявок на телефон {phone} превышен')
+        return True
+    return False
+
+
+def build_telegram_message(contact_request):
+    """Формирует текст уведомления о заявке"""
     page_info = ''
     if contact_request.page:
         page_info = f"\n📄 Страница: {contact_request.page.title}"
@@ -81,17 +397,107 @@ def send_telegram_notification(contact_request):
     
     message += page_info
     message += f"\n\n🕐 {contact_request.created_at.strftime('%d.%m.%Y %H:%M')}"
+    return message
+
+
+def send_telegram_notification(contact_request):
+    """Отправляет уведомление о новой заявке в Telegram"""
+    from .models import SiteSettings
+    
+    settings = SiteSettings.get_settings()
+    
+    if not settings.telegram_bot_token or not settings.telegram_chat_id:
+        logger.info('Telegram не настроен, уведомление не отправлено')
+        return False
     
     return send_telegram_message(
         settings.telegram_bot_token,
         settings.telegram_chat_id,
-        message
+        build_telegram_message(contact_request)
     )
 
 
+def enqueue_telegram_notification(contact_request):
+    """Ставит уведомление о заявке в очередь (в текущей транзакции)"""
+    from .models import SiteSettings, NotificationOutbox
+    
+    settings = SiteSettings.get_settings()
+    
+    if not settings.telegram_bot_token or not settings.telegram_chat_id:
+        logger.info('Telegram не настроен, уведомление не поставлено в очередь')
+        return None
+    
+    return NotificationOutbox.objects.create(
+        contact_request=contact_request,
+        channel='telegram',
+        message=build_telegram_message(contact_request),
+    )
+
+
+def notification_backoff(attempts):
+    """Задержка перед следующей попыткой: экспонента с потолком"""
+    delay = OUTBOX_RETRY_BASE_DELAY * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, OUTBOX_RETRY_MAX_DELAY))
+
+
+def deliver_outbox(batch_size=20, max_attempts=8):
+    """Отправляет пачку созревших уведомлений из очереди.
+
+    Запись сначала «арендуется» условным UPDATE, поэтому несколько
+    параллельно запущенных воркеров не отправят одно сообщение дважды.
+    Возвращает (отправлено, отложено, не доставлено).
+    """
+    from .models import SiteSettings, NotificationOutbox
+    
+    now = timezone.now()
+    due = list(
+        NotificationOutbox.objects
+        .filter(status=NotificationOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+        .order_by('next_attempt_at')
+        .values_list('pk', 'next_attempt_at')[:batch_size]
+    )
+    sent = retried = dead = 0
+    settings = SiteSettings.get_settings()
+    
+    for pk, next_attempt_at in due:
+        claimed = NotificationOutbox.objects.filter(
+            pk=pk,
+            status=NotificationOutbox.STATUS_PENDING,
+            next_attempt_at=next_attempt_at,
+        ).update(next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        if not claimed:
+            continue
+        
+        item = NotificationOutbox.objects.get(pk=pk)
+        if not settings.telegram_bot_token or not settings.telegram_chat_id:
+            ok, error = False, 'Telegram не настроен'
+        else:
+            ok = send_telegram_message(settings.telegram_bot_token, settings.telegram_chat_id, item.message)
+            error = '' if ok else 'Telegram API не принял сообщение'
+        
+        item.attempts += 1
+        if ok:
+            item.status = NotificationOutbox.STATUS_SENT
+            item.sent_at = timezone.now()
+            item.last_error = ''
+            sent += 1
+        elif item.attempts >= max_attempts:
+            item.status = NotificationOutbox.STATUS_DEAD
+            item.last_error = error
+            logger.error(f'Уведомление #{item.pk} не доставлено после {item.attempts} попыток')
+            dead += 1
+        else:
+            item.next_attempt_at = timezone.now() + notification_backoff(item.attempts)
+            item.last_error = error
+            retried += 1
+        item.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    
+    return sent, retried, dead
+
+
 def send_telegram_message(bot_token, chat_id, message):
     """Отправляет сообщение в Telegram"""
-    url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
+    url = f'{TELEGRAM_API_URL}/bot{bot_token}/sendMessage'
     
     data = {
         'chat_id': chat_id,
@@ -101,18 +507,14 @@ def send_telegram_message(bot_token, chat_id, message):
     }
     
     try:
-        encoded_data = urllib.parse.urlencode(data).encode('utf-8')
-        request = urllib.request.Request(url, data=encoded_data, method='POST')
-        request.add_header('Content-Type', 'application/x-www-form-urlencoded')
-        
-        with urllib.request.urlopen(request, timeout=10) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            if result.get('ok'):
-                logger.info(f'Telegram уведомление отправлено в чат {chat_id}')
-                return True
-            else:
-                logger.error(f'Telegram API error: {result}')
-                return False
+        _, body = http_client.post_form(url, data)
+        result = json.loads(body.decode('utf-8'))
+        if result.get('ok'):
+            logger.info(f'Telegram уведомление отправлено в чат {chat_id}')
+            return True
+        else:
+            logger.error(f'Telegram API error: {result}')
+            return False
                 
     except Exception as e:
         logger.error(f'Ошибка отправки в Telegram: {e}')
@@ -0,0 +1,94 @@
+"""Сброс кешей при изменении контента, настройка соединений с БД"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_version
+from .content import render_content
+from .db import apply_sqlite_pragmas
+from .images import schedule_variants
+from .models import ContactRequest, ImageVariant, Page, SiteSettings, menu_snapshot, settings_snapshot
+from .search import PAGE_FTS_TABLE, fts_available, index_page, rebuild_page_index, unindex_page
+
+
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def page_changed(sender, **kwargs):
+    # Поднимает версию 'pages': меню и полностраничный кеш
+    menu_snapshot.invalidate()
+
+
+@receiver(post_save, sender=Page)
+def page_saved_to_index(sender, instance, **kwargs):
+    # Поисковый индекс обновляется в той же транзакции, что и страница
+    if fts_available(PAGE_FTS_TABLE):
+        index_page(instance)
+
+
+@receiver(post_save, sender=Page)
+def page_og_image_variants(sender, instance, **kwargs):
+    # Уже собранные копии пул пропустит, ожидания в запросе нет
+    if instance.og_image:
+        schedule_variants(instance.og_image.name)
+
+
+@receiver(post_delete, sender=Page)
+def page_deleted_from_index(sender, instance, **kwargs):
+    if fts_available(PAGE_FTS_TABLE):
+        unindex_page(instance.pk)
+
+
+@receiver(post_delete, sender=SiteSettings)
+def site_settings_deleted(sender, **kwargs):
+    # Сохранение сбрасывает снимок в SiteSettings.save()
+    settings_snapshot.invalidate()
+
+
+@receiver(post_save, sender=ContactRequest)
+@receiver(post_delete, sender=ContactRequest)
+def contact_request_changed(sender, **kwargs):
+    # Счётчики и даты в списке заявок админки
+    bump_version('contacts')
+
+
+# Миграции, данные после которых достраивает текущий код приложения:
+# таблица поиска страниц без строк и content_html с исходным HTML
+PAGE_FTS_MIGRATION = ('core', '0016_page_fts')
+CONTENT_HTML_MIGRATION = ('core', '0017_page_content_html')
+
+
+def migration_applied(sender, plan, key):
+    """Применил ли этот migrate миграцию `key` (вперёд)"""
+    return sender.name == 'core' and any(
+        (migration.app_label, migration.name) == key and not backwards for migration, backwards in plan or ()
+    )
+
+
+@receiver(post_migrate)
+def index_pages_after_migrate(sender, plan=None, **kwargs):
+    """После применения 0016 заполняет индекс поиска страниц"""
+    if migration_applied(sender, plan, PAGE_FTS_MIGRATION):
+        rebuild_page_index()
+
+
+@receiver(post_migrate)
+def render_pages_after_migrate(sender, plan=None, using=None, **kwargs):
+    """После применения 0017 обрабатывает страницы текущим кодом и сбрасывает кеш страниц"""
+    if not migration_applied(sender, plan, CONTENT_HTML_MIGRATION):
+        return
+    pages = Page.objects.using(using)
+    now = timezone.now()
+    for page in pages.only('pk', 'content').iterator():
+        content_html, toc = render_content(page.content, srcset=ImageVariant.srcset)
+        # updated_at меняется вместе с HTML: ETag и Last-Modified страниц тоже
+        pages.filter(pk=page.pk).update(content_html=content_html, toc=toc, updated_at=now)
+    menu_snapshot.invalidate()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_sqlite_pragmas(cursor, getattr(settings, 'SQLITE_PRAGMAS', {}))
@@ -0,0 +1,100 @@
+"""Стеммер русского языка (алгоритм Snowball/Портера) без внешних зависимостей.
+
+Используется поиском по сайту: слова в индексе и в запросе приводятся
+к основе, поэтому «ремонт ноутбуков» находит «ремонту ноутбука».
+"""
+import re
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+             'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий',
+        'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю',
+        'ия', 'ья', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+WORD_RE = re.compile(r'^[а-я]+$')
+
+
+def _strip(rv, endings, after_a=()):
+    """Отрезает самое длинное окончание; окончания из `after_a` — только после «а»/«я»"""
+    candidates = [(e, True) for e in after_a] + [(e, False) for e in endings]
+    candidates.sort(key=lambda item: len(item[0]), reverse=True)
+    for ending, needs_a in candidates:
+        if not rv.endswith(ending):
+            continue
+        base = rv[:-len(ending)]
+        if needs_a and not base.endswith(('а', 'я')):
+            continue
+        return base
+    return None
+
+
+def _region(word, start):
+    """Начало области после первой пары «гласная + согласная» начиная с `start`"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def stem(word):
+    """Основа русского слова; нерусские слова возвращаются как есть (в нижнем регистре)"""
+    word = word.lower().replace('ё', 'е')
+    if not WORD_RE.match(word):
+        return word
+    rv_start = next((i + 1 for i, ch in enumerate(word) if ch in VOWELS), None)
+    if rv_start is None:
+        return word
+    r2_start = _region(word, _region(word, 0) - 1)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    base = _strip(rv, PERFECTIVE_GERUND[1], PERFECTIVE_GERUND[0])
+    if base is None:
+        base = _strip(rv, REFLEXIVE)
+        if base is not None:
+            rv = base
+        base = _strip(rv, ADJECTIVE)
+        if base is not None:
+            participle = _strip(base, PARTICIPLE[1], PARTICIPLE[0])
+            if participle is not None:
+                base = participle
+        else:
+            base = _strip(rv, VERB[1], VERB[0])
+            if base is None:
+                base = _strip(rv, NOUN)
+    if base is not None:
+        rv = base
+
+    # Шаг 2
+    if rv.endswith('и'):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательное окончание — только в R2
+    for ending in DERIVATIONAL:
+        if rv.endswith(ending) and rv_start + len(rv) - len(ending) >= r2_start:
+            rv = rv[:-len(ending)]
+            break
+
+    # Шаг 4
+    if rv.endswith('нн'):
+        rv = rv[:-1]
+    else:
+        base = _strip(rv, SUPERLATIVE)
+        if base is not None:
+            rv = base[:-1] if base.endswith('нн') else base
+        elif rv.endswith('ь'):
+            rv = rv[:-1]
+
+    return prefix + rv
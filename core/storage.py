@@ -0,0 +1,114 @@
+"""Хранилища: загрузки CKEditor (CKEDITOR_5_FILE_STORAGE) и статика (STORAGES['staticfiles'])"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from whitenoise.compress import Compressor
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class VariantFileSystemStorage(FileSystemStorage):
+    """Обычное файловое хранилище медиа; после сохранения картинки
+    ставит в пул сборку её уменьшенных копий"""
+
+    def _save(self, name, content):
+        from .images import schedule_variants  # images импортирует модели, а хранилище грузится раньше
+
+        name = super()._save(name, content)
+        schedule_variants(name)
+        return name
+
+
+def compress_file(path, extensions):
+    """Пишет рядом с файлом .gz и .br (если установлен brotli); выполняется в процессе пула"""
+    return Compressor(extensions=extensions, quiet=True).compress(path)
+
+
+class IncrementalStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Статика WhiteNoise с хешами в именах и заранее сжатыми копиями.
+
+    Сжимаются только файлы, у которых нет готовых .gz/.br или хеш содержимого
+    разошёлся с прошлым манифестом: копии файла с хешем в имени не устаревают,
+    а исходное имя сверяется с записью в staticfiles.json. Копии, которые
+    WhiteNoise не записал (сжатие не окупилось), запоминаются в манифесте
+    вместе с хешем содержимого и тоже не пересобираются. Сжатие идёт в пуле
+    процессов (STATICFILES_COMPRESS_WORKERS), поэтому collectstatic без --clear
+    тратит время пропорционально изменениям, а не размеру каталога.
+    """
+
+    # Ключ staticfiles.json: {файл: {'source': имя с хешем содержимого, 'suffixes': ['.gz', ...]}}
+    SKIPPED_KEY = 'compression_skipped'
+
+    previous_files = {}
+    previous_skipped = {}
+    compression_skipped = {}
+
+    def post_process(self, *args, **kwargs):
+        # ManifestFilesMixin.post_process обнуляет hashed_files, прошлый манифест читаем до этого
+        self.previous_files = self.load_manifest()[0]
+        self.previous_skipped = json.loads(self.read_manifest() or '{}').get(self.SKIPPED_KEY, {})
+        self.compression_skipped = {}
+        yield from super().post_process(*args, **kwargs)
+
+    def save_manifest(self):
+        super().save_manifest()
+        if not self.compression_skipped:
+            return
+        payload = json.loads(self.read_manifest())
+        payload[self.SKIPPED_KEY] = self.compression_skipped
+        self.manifest_storage.delete(self.manifest_name)
+        self.manifest_storage._save(self.manifest_name, ContentFile(json.dumps(payload).encode()))
+
+    def compress_files(self, paths):
+        extensions = getattr(settings, 'WHITENOISE_SKIP_COMPRESS_EXTENSIONS', None)
+        compressor = self.create_compressor(extensions=extensions, quiet=True)
+        suffixes = ('.gz', '.br') if compressor.use_brotli else ('.gz',)
+        hashed = set(self.hashed_files.values())
+        changed = []
+        for path in sorted(paths):
+            if not compressor.should_compress(path):
+                continue
+            if self.needs_compression(path, suffixes, hashed):
+                changed.append(path)
+            elif self.skipped_suffixes(path):
+                self.compression_skipped[path] = self.previous_skipped[path]
+        full_paths = [self.path(path) for path in changed]
+        workers = settings.STATICFILES_COMPRESS_WORKERS or os.cpu_count() or 1
+        if workers > 1 and len(changed) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(changed))) as pool:
+                results = list(pool.map(compress_file, full_paths, repeat(extensions), chunksize=4))
+        else:
+            results = map(compress_file, full_paths, repeat(extensions))
+        for path, full_path, compressed in zip(changed, full_paths, results):
+            prefix_len = len(full_path) - len(path)
+            for compressed_path in compressed:
+                yield path, compressed_path[prefix_len:]
+            written = {compressed_path[len(full_path):] for compressed_path in compressed}
+            skipped = [suffix for suffix in suffixes if suffix not in written]
+            if skipped:
+                self.compression_skipped[path] = {'source': self.source_name(path), 'suffixes': skipped}
+        # Манифест уже записан до сжатия — дописываем в него пропущенные копии
+        self.save_manifest()
+
+    def source_name(self, path):
+        """Имя с хешем содержимого: для исходного имени — из манифеста, иначе само имя"""
+        return self.hashed_files.get(path, path)
+
+    def skipped_suffixes(self, path):
+        """Копии, которые для этого же содержимого в прошлый раз не окупились"""
+        entry = self.previous_skipped.get(path)
+        if entry and entry['source'] == self.source_name(path):
+            return entry['suffixes']
+        return []
+
+    def needs_compression(self, path, suffixes, hashed):
+        skipped = self.skipped_suffixes(path)
+        if not all(self.exists(path + suffix) for suffix in suffixes if suffix not in skipped):
+            return True
+        if path in hashed:
+            return False
+        return self.previous_files.get(path) != self.hashed_files.get(path)
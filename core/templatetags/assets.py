@@ -0,0 +1,61 @@
+"""Подключение собранной статики (core/assets.py, manage.py build_assets)"""
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join, mark_safe
+
+from core.assets import font_covers, font_face_css, load_manifest
+
+register = template.Library()
+
+GOOGLE_FONTS_URL = 'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800&display=swap'
+# Неблокирующая загрузка CSS: preload, после загрузки превращается в stylesheet
+ASYNC_STYLESHEET = (
+    '<link rel="preload" href="{0}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+    '<noscript><link rel="stylesheet" href="{0}"></noscript>'
+)
+
+
+@register.simple_tag
+def asset(path):
+    """URL статики: минифицированная сборка, если она есть, иначе исходный файл"""
+    manifest = load_manifest()
+    return static(manifest['files'].get(path, path) if manifest else path)
+
+
+@register.simple_tag(takes_context=True)
+def stylesheet(context, path):
+    """Критический CSS шаблона страницы в <style>, полный файл — без блокировки отрисовки.
+
+    Без сборки (или для шаблона без критического CSS) — обычный <link>.
+    """
+    manifest = load_manifest()
+    name = context.template.name if context.template else None
+    critical = manifest and manifest['critical_css'].get(name)
+    if not critical:
+        return format_html('<link rel="stylesheet" href="{}">', asset(path))
+    return format_html('<style>{1}</style>' + ASYNC_STYLESHEET, asset(path), mark_safe(critical))
+
+
+@register.simple_tag(takes_context=True)
+def font_links(context):
+    """Свои шрифты: @font-face и preload начертаний LCP-текста шаблона (без
+    сборки для шаблона — только обычного); без шрифтов — Google Fonts, не
+    блокируя отрисовку"""
+    manifest = load_manifest()
+    fonts = manifest['fonts'] if manifest else []
+    if not fonts:
+        return format_html(
+            '<link rel="preconnect" href="https://fonts.googleapis.com">'
+            '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>' + ASYNC_STYLESHEET,
+            GOOGLE_FONTS_URL,
+        )
+    name = context.template.name if context.template else None
+    files = manifest.get('preload', {}).get(name)
+    if files is None:
+        files = [font['file'] for font in fonts if font['style'] == 'normal' and font_covers(font, {400})]
+    formats = {font['file']: font['format'] for font in fonts}
+    preload = format_html_join('', '<link rel="preload" href="{}" as="font" type="font/{}" crossorigin>', (
+        (static(file), formats[file]) for file in files if file in formats
+    ))
+    faces = ''.join(font_face_css(font, static(font['file'])) for font in fonts)
+    return preload + format_html('<style>{}</style>', mark_safe(faces))
@@ -0,0 +1,32 @@
+"""Адаптивные картинки: srcset/sizes из уменьшенных копий (core/images.py)"""
+from django import template
+from django.utils.html import format_html
+
+from core.images import source_name, variant_url as find_variant_url
+from core.models import ImageVariant
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(image, sizes='100vw', format='jpeg'):
+    """Атрибуты srcset и sizes для <img> или <source>; пусто, пока копий нет.
+
+    `image` — FieldFile или адрес картинки из медиа:
+    <img src="{{ page.og_image.url }}"{% srcset page.og_image "(max-width: 800px) 100vw, 800px" %}>
+    """
+    source = source_name(image)
+    value = ImageVariant.srcset(source, format) if source else ''
+    if not value:
+        return ''
+    return format_html(' srcset="{}" sizes="{}"', value, sizes)
+
+
+@register.simple_tag
+def variant_url(image, width, format='jpeg'):
+    """Адрес копии не шире `width`, а если её нет — оригинала"""
+    source = source_name(image)
+    url = source and find_variant_url(source, int(width), format)
+    if url:
+        return url
+    return image if isinstance(image, str) else image.url
@@ -0,0 +1,27 @@
+"""Запуск тестов (TEST_RUNNER) без локальной сборки статики разработчика"""
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner, у которого ASSETS_BUILD_DIR — пустой временный каталог.
+
+    Иначе {% stylesheet %} и {% font_links %} читали бы static/build/assets.json,
+    и результат тестов зависел бы от того, запускались ли локально
+    collectstatic или build_assets. Тесты сборки задают свой каталог сами.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.assets_dir = tempfile.mkdtemp(prefix='assets-')
+        self.assets_override = override_settings(ASSETS_BUILD_DIR=Path(self.assets_dir))
+        self.assets_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.assets_override.disable()
+        shutil.rmtree(self.assets_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
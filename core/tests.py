@@ -1,16 +1,117 @@
 """Тесты для core приложения"""
+import csv
+import gzip
+import json
+import os
+import pickle
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from ftplib import error_perm, error_temp
+from xml.etree import ElementTree
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from pathlib import Path
 from unittest.mock import patch
 
-from django.test import TestCase, Client
+from django.apps import apps
+from django.conf import settings as django_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command, get_commands
+from django.db import connection, connections, models, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.db.utils import load_backend
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, SimpleTestCase, Client, RequestFactory, override_settings
+from django.template import Context, Template, engines
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
-from .models import SiteSettings, ContactRequest
+import deploy
 
+from .assets import critical_css, minify_css, minify_js
+from .bench import compare, run_bench, run_sqlite_contention, seed
+from .archive import ARCHIVE_FIELDS, archive_batch, archive_leads, delete_batch, iter_archive
+from .cache import clear_local_snapshots, get_version, input_placeholder
+from .content import render_content
+from .context_processors import site_settings
+from .exports import csv_safe, stream_export
+from .forms import ContactForm
+from .images import build_variants, schedule_variants, wait_for_variants
+from .models import SiteSettings, Page, MenuItem, ContactRequest, NotificationOutbox, ImageVariant
+from .search import build_match_query, search_contact_requests
+from .signals import (
+    CONTENT_HTML_MIGRATION, PAGE_FTS_MIGRATION, index_pages_after_migrate, render_pages_after_migrate,
+)
+from .stemmer import stem
+from .storage import VariantFileSystemStorage, compress_file
+from .services import (
+    RECAPTCHA_BREAKER_FAILURES, CircuitBreaker, HttpClient, HttpClientError, deliver_outbox,
+    enqueue_telegram_notification, normalize_phone, rate_limit_exceeded, recaptcha_breaker, send_telegram_message,
+    verify_recaptcha,
+)
 
-class ContactFormRecaptchaTest(TestCase):
+
+class CacheIsolationMixin:
+    """Чистый общий кеш и процессные снимки для каждого теста"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        caches['template_fragments'].clear()
+        caches['ratelimit'].clear()
+        clear_local_snapshots()
+
+
+# Шаблоны в тестах рендерятся без собранного манифеста статики
+SIMPLE_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+class SiteSettingsSnapshotTest(CacheIsolationMixin, TestCase):
+    """Кеширование снимка настроек сайта"""
+
+    def test_repeated_reads_do_not_query(self):
+        """Повторное чтение настроек не обращается к БД"""
+        SiteSettings.get_settings()
+        with self.assertNumQueries(0):
+            settings = SiteSettings.get_settings()
+            SiteSettings.get_settings()
+        self.assertEqual(settings.pk, 1)
+
+    def test_snapshot_is_read_only(self):
+        """Снимок нельзя изменить"""
+        settings = SiteSettings.get_settings()
+        with self.assertRaises(AttributeError):
+            settings.phone = '000'
+
+    def test_save_invalidates_snapshot(self):
+        """Сохранение в админке сбрасывает снимок"""
+        old = SiteSettings.get_settings()
+        obj = SiteSettings.objects.get(pk=1)
+        obj.phone = '8 (000) 000-00-00'
+        obj.save()
+        new = SiteSettings.get_settings()
+        self.assertEqual(new.phone, '8 (000) 000-00-00')
+        self.assertNotEqual(old.version, new.version)
+
+
+class ContactFormRecaptchaTest(CacheIsolationMixin, TestCase):
     """Проверка интеграции reCAPTCHA с формой обратной связи"""
 
     def setUp(self):
+        super().setUp()
         self.client = Client()
         self.url = reverse('core:submit_contact')
         self.valid_data = {
@@ -67,3 +168,1635 @@ class ContactFormRecaptchaTest(TestCase):
         self.assertTrue(data['success'])
         self.assertEqual(ContactRequest.objects.count(), 1)
         mock_verify.assert_called_once()
+
+
+class NotificationOutboxTest(CacheIsolationMixin, TestCase):
+    """Очередь уведомлений: заявка не ждёт Telegram"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.update_or_create(
+            pk=1, defaults={'telegram_bot_token': '1:token', 'telegram_chat_id': '-100'},
+        )
+        self.contact = ContactRequest.objects.create(name='Тест', phone='+7 999 123-45-67')
+
+    @patch('core.services.send_telegram_message')
+    @patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+    def test_submit_enqueues_without_sending(self, mock_verify, mock_send):
+        """Отправка формы пишет уведомление в очередь и не ходит в Telegram"""
+        response = self.client.post(reverse('core:submit_contact'), {
+            'name': 'Тест', 'phone': '+7 999 000-00-00', 'privacy_agreement': 'on',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        mock_send.assert_not_called()
+        item = NotificationOutbox.objects.get()
+        self.assertEqual(item.status, NotificationOutbox.STATUS_PENDING)
+        self.assertIn('+7 999 000-00-00', item.message)
+
+    @patch('core.services.send_telegram_message', return_value=True)
+    def test_worker_marks_sent(self, mock_send):
+        """Воркер отправляет созревшие уведомления"""
+        item = enqueue_telegram_notification(self.contact)
+        self.assertEqual(deliver_outbox(), (1, 0, 0))
+        item.refresh_from_db()
+        self.assertEqual(item.status, NotificationOutbox.STATUS_SENT)
+        mock_send.assert_called_once_with('1:token', '-100', item.message)
+
+    @patch('core.services.send_telegram_message', return_value=False)
+    def test_worker_backoff_and_dead_letter(self, mock_send):
+        """Неудачи откладывают отправку, а после лимита попыток — в «недоставленные»"""
+        item = enqueue_telegram_notification(self.contact)
+        self.assertEqual(deliver_outbox(max_attempts=2), (0, 1, 0))
+        item.refresh_from_db()
+        self.assertEqual(item.attempts, 1)
+        self.assertGreater(item.next_attempt_at, timezone.now())
+        # Пока задержка не истекла, запись не берётся
+        self.assertEqual(deliver_outbox(max_attempts=2), (0, 0, 0))
+
+        NotificationOutbox.objects.filter(pk=item.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_outbox(max_attempts=2), (0, 0, 1))
+        item.refresh_from_db()
+        self.assertEqual(item.status, NotificationOutbox.STATUS_DEAD)
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class PageCacheTest(CacheIsolationMixin, TestCase):
+    """Полностраничный кеш главной и страниц"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.get_settings()
+        self.page = Page.objects.create(title='Скупка ноутбуков', slug='skupka-noutbukov', page_type='skupka')
+
+    def test_warm_hit_skips_orm(self):
+        """Повторный запрос отдаётся из кеша без запросов к БД"""
+        url = self.page.get_absolute_url()
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.status_code, 200)
+        self.assertContains(second, 'Скупка ноутбуков')
+        self.assertNotContains(second, input_placeholder('csrfmiddlewaretoken'))
+        self.assertNotContains(second, input_placeholder('idempotency_key'))
+        token = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', second.content.decode())
+        self.assertIsNotNone(token)
+        self.assertNotIn(token.group(1), first.content.decode())
+
+    def test_page_save_invalidates(self):
+        """Изменение страницы в админке сбрасывает кеш"""
+        url = self.page.get_absolute_url()
+        self.client.get(url)
+        self.page.title = 'Скупка ПК'
+        self.page.save()
+        self.assertContains(self.client.get(url), 'Скупка ПК')
+
+    def test_settings_save_invalidates(self):
+        """Изменение настроек сайта сбрасывает кеш"""
+        self.client.get('/')
+        SiteSettings.objects.update_or_create(pk=1, defaults={'phone': '8 (111) 111-11-11'})
+        self.assertContains(self.client.get('/'), '8 (111) 111-11-11')
+
+    def test_new_build_invalidates(self):
+        """После деплоя (другой отпечаток сборки) страница рендерится заново"""
+        url = self.page.get_absolute_url()
+        with patch('core.cache.build_fingerprint', return_value='old'):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.client.get(url)
+        with patch('core.cache.build_fingerprint', return_value='new'), \
+                CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertTrue(queries.captured_queries)
+
+
+class MenuContextTest(CacheIsolationMixin, TestCase):
+    """Материализованное меню и ленивый контекст-процессор"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.create()
+        Page.objects.create(title='Ремонт ноутбуков', slug='remont', page_type='remont', menu_title='Ремонт')
+        Page.objects.create(title='Скрытая', slug='hidden', show_in_menu=False)
+        Page.objects.create(title='Главная', slug='home', page_type='home')
+
+    def test_menu_items(self):
+        """В меню только опубликованные страницы из меню, без главной"""
+        self.assertEqual(Page.get_menu(), (MenuItem('/remont/', 'Ремонт', 'remont', 'remont'),))
+        with self.assertNumQueries(0):
+            Page.get_menu()
+
+    def test_menu_rebuilt_on_page_change(self):
+        """Изменение страницы пересобирает меню"""
+        Page.get_menu()
+        Page.objects.filter(slug='hidden').get().delete()
+        Page.objects.create(title='Контакты', slug='kontakty', order=5)
+        self.assertEqual([item.url for item in Page.get_menu()], ['/remont/', '/kontakty/'])
+
+    def test_unused_context_is_free(self):
+        """Шаблон, не обращающийся к значениям, не делает запросов"""
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(0):
+            context = site_settings(request)
+        with self.assertNumQueries(2):
+            list(context['menu_pages'])
+            str(context['recaptcha_site_key'])
+
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class FragmentCacheTest(CacheIsolationMixin, TestCase):
+    """Кеш фрагментов шапки, подвала, JSON-LD и формы заявки"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.create(phone='8 (111) 111-11-11')
+        self.page = Page.objects.create(title='Ремонт ноутбуков', slug='remont', page_type='remont',
+                                        menu_title='Ремонт')
+
+    def test_cached_loader_is_always_on(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertEqual(type(loader).__module__, 'django.template.loaders.cached')
+
+    def test_contact_form_renders_only_per_request_fields(self):
+        """Токены и скрытые поля свои на каждый запрос, остальная форма — из кеша"""
+        request = RequestFactory().get('/remont/')
+        first = render_to_string('includes/contact_form.html', {
+            'form': ContactForm(page=self.page), 'page': self.page,
+        }, request)
+        form = ContactForm()
+        form.fields['name'].widget.attrs['placeholder'] = 'Не из кеша'
+        other = RequestFactory().get('/privacy/')
+        second = render_to_string('includes/contact_form.html', {'form': form, 'page': None}, other)
+
+        self.assertNotIn('Не из кеша', second)
+        self.assertIn('Ваше имя *', second)
+        self.assertIn('name="page_slug" value="remont"', first)
+        self.assertIn('name="page_url" value="/privacy/"', second)
+        key = re.compile(r'name="idempotency_key" value="([^"]+)"')
+        self.assertNotEqual(key.search(first)[1], key.search(second)[1])
+        self.assertIn('name="csrfmiddlewaretoken"', second)
+
+    def test_fragments_follow_settings_and_menu(self):
+        """Смена настроек или меню даёт новые фрагменты, старые не показываются"""
+        self.assertContains(self.client.get('/search/'), '>Ремонт</a>')
+        self.page.menu_title = 'Ремонт ПК'
+        self.page.save()
+        SiteSettings.objects.update_or_create(pk=1, defaults={'phone': '8 (222) 222-22-22'})
+        response = self.client.get('/search/')
+        self.assertContains(response, 'Ремонт ПК')
+        self.assertContains(response, '8 (222) 222-22-22')
+        self.assertNotContains(response, '8 (111) 111-11-11')
+        self.assertNotContains(response, '>Ремонт</a>')
+        # Активный пункт меню у каждого адреса свой
+        self.assertNotContains(response, 'header__link--active')
+        self.assertContains(self.client.get('/remont/'), 'header__link--active" itemprop="url">Ремонт ПК</a>')
+
+
+
+class AssetBuildTest(CacheIsolationMixin, TestCase):
+    """Минификация, критический CSS и подключение собранной статики"""
+
+    def test_minify_css(self):
+        css = '/* шапка */\n.a  >  .b ,\n.c {\n  width: calc(100% - 2px);\n  content: "a  ;  b";\n}\n'
+        self.assertEqual(minify_css(css), '.a>.b,.c{width:calc(100% - 2px);content:"a  ;  b"}')
+
+    def test_minify_js_keeps_strings_regex_and_templates(self):
+        js = (
+            "// комментарий\n"
+            "const url = 'http://x/*y*/'; /* блок */\n"
+            "const clean = value.replace(/\\/\\//g, '');\n"
+            "const html = `<b>\n  ${ count + 1 }</b>`;\n"
+            "let n = a + +b\n"
+            "return n\n"
+        )
+        self.assertEqual(minify_js(js), (
+            "const url='http://x/*y*/';const clean=value.replace(/\\/\\//g,'');"
+            "const html=`<b>\n  ${count+1}</b>`;let n=a+ +b\nreturn n\n"
+        ))
+
+    def test_minify_js_division_after_postfix_increment(self):
+        """«/» после a++ — деление: комментарий дальше не съедает перевод строки"""
+        js = 'var a=1;a++ / 2;\nvar b = "x" // c\n;var d=3/1;\nb-- / a // e\nd = 1\n'
+        self.assertEqual(minify_js(js), 'var a=1;a++/2;var b="x";var d=3/1;b--/a\nd=1\n')
+
+    def test_critical_css_keeps_only_first_screen_rules(self):
+        css = (
+            ':root{--c:red}.header{color:red}.footer{color:blue}.header:hover{color:green}'
+            '@media (max-width: 640px){.header__menu{display:none}.footer{display:none}}'
+            '@keyframes pulse{from{opacity:0}}nav .header{margin:0}'
+        )
+        tokens = {('', 'html'), ('', 'body'), ('', 'nav'), ('.', 'header'), ('.', 'header__menu')}
+        self.assertEqual(critical_css(css, tokens), (
+            ':root{--c:red}.header{color:red}'
+            '@media (max-width:640px){.header__menu{display:none}}nav .header{margin:0}'
+        ))
+
+    @override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+    def test_build_assets_and_render(self):
+        """После сборки страница встраивает критический CSS и берёт минифицированные файлы"""
+        self.assertEqual(get_commands()['collectstatic'], 'core')
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        for name in ('css/style.css', 'js/main.js', 'js/cookie-banner.js'):
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(Path(django_settings.BASE_DIR) / 'static' / name, root / name)
+        SiteSettings.get_settings()
+        with override_settings(STATICFILES_DIRS=[root], ASSETS_BUILD_DIR=root / 'build'):
+            before = self.client.get('/privacy/')
+            call_command('build_assets', stdout=StringIO())
+            cache.clear()
+            response = self.client.get('/privacy/')
+        self.assertContains(before, '<link rel="stylesheet" href="/static/css/style.css">', html=False)
+        self.assertContains(response, '<style>:root{')
+        self.assertContains(response, '.hero__title{')
+        self.assertContains(response, (
+            '<link rel="preload" href="/static/build/css/style.min.css" as="style" '
+            'onload="this.onload=null;this.rel=\'stylesheet\'">'
+        ), html=False)
+        self.assertContains(response, '<script src="/static/build/js/main.min.js">', html=False)
+        # Без собранных шрифтов Google Fonts тоже не блокирует отрисовку
+        self.assertNotContains(response, 'family=Inter:wght@400;500;600;700;800&amp;display=swap" rel="stylesheet"')
+        self.assertLess(len((root / 'build' / 'critical' / 'privacy.css').read_text()),
+                        len((root / 'build' / 'css' / 'style.min.css').read_text()) / 2)
+
+    @override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+    def test_bundled_font_is_self_hosted(self):
+        """Inter из репозитория урезается, подключается со своего домена и не пересобирается зря"""
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        static = Path(django_settings.BASE_DIR) / 'static'
+        fonts = ('fonts/src/Inter-Regular.woff2', 'fonts/src/Inter-Medium.woff2', 'fonts/src/Inter-ExtraBold.woff2')
+        for name in ('css/style.css', 'js/main.js', 'js/cookie-banner.js') + fonts:
+            (root / name).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy(static / name, root / name)
+        SiteSettings.get_settings()
+        with override_settings(STATICFILES_DIRS=[root], ASSETS_BUILD_DIR=root / 'build'):
+            call_command('build_assets', stdout=StringIO())
+            with patch('core.assets.subset_font') as subset:
+                call_command('build_assets', stdout=StringIO())
+            response = self.client.get('/privacy/')
+        subset.assert_not_called()
+        font = root / 'build' / 'fonts' / 'inter-regular.woff2'
+        self.assertLess(font.stat().st_size, (static / 'fonts/src/Inter-Regular.woff2').stat().st_size / 2)
+        # Предзагружаются основной текст и заголовок hero (800), остальное — по swap
+        self.assertContains(response, (
+            '<link rel="preload" href="/static/build/fonts/inter-extrabold.woff2" as="font" type="font/woff2" crossorigin>'
+            '<link rel="preload" href="/static/build/fonts/inter-regular.woff2" as="font" type="font/woff2" crossorigin>'
+            '<style>'
+        ), html=False)
+        self.assertNotContains(response, 'rel="preload" href="/static/build/fonts/inter-medium.woff2"')
+        self.assertNotContains(response, 'fonts.googleapis.com')
+        style = (root / 'build' / 'css' / 'style.min.css').read_text()
+        self.assertIn("font-weight:800;font-display:swap;src:url(../fonts/inter-extrabold.woff2)", style)
+
+
+class IncrementalStaticTest(SimpleTestCase):
+    """collectstatic без --clear сжимает только изменённые файлы"""
+
+    def setUp(self):
+        self.source = Path(tempfile.mkdtemp())
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.root)
+        (self.source / 'css').mkdir()
+        (self.source / 'js').mkdir()
+        (self.source / 'css' / 'site.css').write_text('body { color: red; }\n' * 50)
+        (self.source / 'js' / 'app.js').write_text('console.log("app");\n' * 50)
+        storages = {**django_settings.STORAGES,
+                    'staticfiles': {'BACKEND': 'core.storage.IncrementalStaticFilesStorage'}}
+        override = override_settings(
+            STORAGES=storages, STATICFILES_DIRS=[self.source], STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def collect(self):
+        """Имена сжатых файлов (сжатие в том же процессе, чтобы его можно было подсмотреть)"""
+        with override_settings(STATICFILES_COMPRESS_WORKERS=1), \
+                patch('core.storage.compress_file', wraps=compress_file) as compress:
+            call_command('collectstatic', '--noinput', '--skip-assets', verbosity=0)
+        return sorted(Path(call.args[0]).relative_to(self.root).as_posix() for call in compress.call_args_list)
+
+    def test_only_changed_files_are_compressed(self):
+        self.assertEqual(len(self.collect()), 4)
+        manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+        hashed_js = self.root / manifest['js/app.js']
+        self.assertEqual(gzip.decompress(Path(f'{hashed_js}.gz').read_bytes()), hashed_js.read_bytes())
+
+        self.assertEqual(self.collect(), [])
+
+        app = self.source / 'js' / 'app.js'
+        app.write_text('console.log("app v2");\n' * 50)
+        later = time.time() + 10
+        os.utime(app, (later, later))
+        compressed = self.collect()
+        manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+        self.assertEqual(compressed, sorted(['js/app.js', manifest['js/app.js']]))
+        self.assertIn(b'app v2', gzip.decompress((self.root / 'js' / 'app.js.gz').read_bytes()))
+
+    def test_incompressible_files_are_not_recompressed(self):
+        """Файл, сжатие которого не окупилось, запоминается в манифесте и повторно не сжимается"""
+        noise = self.source / 'js' / 'noise.dat'
+        noise.write_bytes(os.urandom(4096))
+        self.assertEqual(len(self.collect()), 6)
+        stored = json.loads((self.root / 'staticfiles.json').read_text())
+        hashed_noise = stored['paths']['js/noise.dat']
+        self.assertFalse((self.root / 'js' / 'noise.dat.gz').exists())
+        self.assertEqual(stored['compression_skipped']['js/noise.dat']['source'], hashed_noise)
+        self.assertIn('.gz', stored['compression_skipped'][hashed_noise]['suffixes'])
+
+        self.assertEqual(self.collect(), [])
+        self.assertIn('js/noise.dat', json.loads((self.root / 'staticfiles.json').read_text())['compression_skipped'])
+
+        noise.write_bytes(os.urandom(4096))
+        later = time.time() + 10
+        os.utime(noise, (later, later))
+        compressed = self.collect()
+        manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+        self.assertEqual(compressed, sorted(['js/noise.dat', manifest['js/noise.dat']]))
+
+    @override_settings(STATICFILES_COMPRESS_WORKERS=2)
+    def test_process_pool(self):
+        call_command('collectstatic', '--noinput', '--skip-assets', verbosity=0)
+        manifest = json.loads((self.root / 'staticfiles.json').read_text())['paths']
+        for name in ('css/site.css', manifest['css/site.css'], 'js/app.js', manifest['js/app.js']):
+            self.assertTrue((self.root / f'{name}.gz').is_file(), name)
+
+
+class StandInFTP:
+    """FTP в памяти поверх общего словаря файлов.
+
+    Имена из `broken` не загружаются; `cuts` — {имя: [сколько байт примет
+    очередной STOR этого файла перед обрывом соединения, ...]}.
+    """
+
+    def __init__(self, stored, broken=(), cuts=None):
+        self.stored, self.broken = stored, broken
+        self.cuts = cuts if cuts is not None else {}
+        self.rests = []
+
+    def storbinary(self, command, f, blocksize=8192, callback=None, rest=None):
+        name = command.split(' ', 1)[1]
+        if name in self.broken:
+            raise error_temp('451 обрыв')
+        self.rests.append((name, rest))
+        data = bytearray(self.stored.get(name, b'')[:rest or 0])
+        limit = self.cuts[name].pop(0) if self.cuts.get(name) else None
+        while block := f.read(blocksize):
+            data += block
+            if limit is not None and len(data) >= limit:
+                self.stored[name] = bytes(data[:limit])
+                raise error_temp('426 обрыв')
+            if callback:
+                callback(block)
+        self.stored[name] = bytes(data)
+
+    def retrbinary(self, command, callback):
+        name = command.split(' ', 1)[1]
+        if name not in self.stored:
+            raise error_perm('550 нет файла')
+        callback(self.stored[name])
+
+    def voidcmd(self, command):
+        pass
+
+    def size(self, name):
+        if name not in self.stored:
+            raise error_perm('550 нет файла')
+        return len(self.stored[name])
+
+    def rename(self, old, new):
+        self.stored[new] = self.stored.pop(old)
+
+    def mkd(self, name):
+        pass
+
+    def delete(self, name):
+        if self.stored.pop(name, None) is None:
+            raise error_perm('550 нет файла')
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DeployManifestTest(SimpleTestCase):
+    """deploy.py: сверка с манифестом на сервере и параллельная загрузка"""
+
+    def test_plan_upload(self):
+        local = {'manage.py': 'a', 'core/views.py': 'b2', 'core/new.py': 'c'}
+        remote = {'manage.py': 'a', 'core/views.py': 'b1', 'core/old.py': 'd', 'media/photo.jpg': 'e'}
+        changed, removed = deploy.plan_upload(local, remote, ['core', 'manage.py'])
+        self.assertEqual(changed, ['core/new.py', 'core/views.py'])
+        # media/ не входит в этот деплой, поэтому не удаляется
+        self.assertEqual(removed, ['core/old.py'])
+        self.assertEqual(deploy.remote_dirs(['static/css/a.css', 'static/b.js', 'x.py']),
+                         ['static', 'static/css'])
+
+    def test_upload_files_over_pool(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        files = {}
+        for i in range(10):
+            files[f'core/f{i}.py'] = root / f'f{i}.py'
+            files[f'core/f{i}.py'].write_text(str(i))
+        stored, connections = {}, []
+
+        def connect():
+            connections.append(StandInFTP(stored, broken={'core/f3.py'}))
+            return connections[-1]
+
+        with patch('builtins.print'):
+            done = deploy.upload_files(connect, files, sorted(files), workers=3)
+        self.assertEqual(done, set(files) - {'core/f3.py'})
+        self.assertEqual(stored['core/f7.py'], b'7')
+        # После ошибки поток открывает новое соединение
+        self.assertLessEqual(len(connections), 4)
+
+    @patch.dict(os.environ, {'DEPLOY_DELETE': '1'})
+    def test_delete_keeps_server_uploads(self):
+        """DEPLOY_DELETE не удаляет media/ без DEPLOY_DELETE_MEDIA: загрузки есть только на сервере"""
+        base = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, base)
+        (base / 'core').mkdir()
+        (base / 'core' / 'views.py').write_text('views')
+        stored = {
+            'core/old.py': b'old', 'media/uploads/photo.jpg': b'jpg',
+            deploy.MANIFEST_NAME: json.dumps({'files': {'core/old.py': 'x', 'media/uploads/photo.jpg': 'y'}}).encode(),
+        }
+        with patch('deploy.open_ftp', lambda *args: StandInFTP(stored)), patch('builtins.print'):
+            deploy.deploy_via_ftp(base, 'host', 'user', 'pass', '/')
+        self.assertNotIn('core/old.py', stored)
+        self.assertEqual(stored['media/uploads/photo.jpg'], b'jpg')
+        self.assertEqual(stored['core/views.py'], b'views')
+        manifest = json.loads(stored[deploy.MANIFEST_NAME])['files']
+        self.assertEqual(set(manifest), {'core/views.py', 'media/uploads/photo.jpg'})
+
+        with patch.dict(os.environ, {'DEPLOY_DELETE_MEDIA': '1'}), \
+                patch('deploy.open_ftp', lambda *args: StandInFTP(stored)), patch('builtins.print'):
+            deploy.deploy_via_ftp(base, 'host', 'user', 'pass', '/')
+        self.assertNotIn('media/uploads/photo.jpg', stored)
+
+    def archive_files(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        files = {}
+        for i in range(5):
+            files[f'media/f{i}.bin'] = root / f'f{i}.bin'
+            files[f'media/f{i}.bin'].write_bytes(os.urandom(20000))
+        return files
+
+    def test_archive_stream_is_repeatable(self):
+        """Продолжение загрузки опирается на то, что поток собирается байт в байт"""
+        files = self.archive_files()
+        # gzip -n вместо pigz: та же ветка с внешним компрессором
+        for command in (None, ['gzip', '-6', '-n']):
+            with deploy.archive_stream(files, command) as stream:
+                first = stream.read()
+            with deploy.archive_stream(files, command) as stream:
+                self.assertEqual(stream.read(), first)
+            with tarfile.open(fileobj=BytesIO(first), mode='r:gz') as tar:
+                self.assertEqual(tar.getnames(), sorted(files))
+                self.assertEqual(tar.extractfile('media/f2.bin').read(), files['media/f2.bin'].read_bytes())
+
+    @patch('deploy.BLOCK_SIZE', 4096)
+    def test_upload_archive_resumes_after_cut(self):
+        files = self.archive_files()
+        local = {rel: deploy.file_hash(path) for rel, path in files.items()}
+        stored, connections = {}, []
+        cuts = {deploy.ARCHIVE_PART_NAME: [30000, 70000]}
+
+        def connect():
+            connections.append(StandInFTP(stored, cuts=cuts))
+            return connections[-1]
+
+        stream_id = deploy.archive_id(files, local, None)
+        with patch('builtins.print'):
+            size = deploy.upload_archive(connect, files, stream_id)
+        with deploy.archive_stream(files, extra=deploy.archive_marker(stream_id)) as stream:
+            expected = stream.read()
+        self.assertEqual(stored, {deploy.ARCHIVE_NAME: expected})
+        self.assertEqual(size, len(expected))
+        rests = [rest for c in connections for name, rest in c.rests if name == deploy.ARCHIVE_PART_NAME]
+        self.assertEqual(rests, [None, 30000, 70000])
+
+    @patch.dict(os.environ, {'DEPLOY_DELTA': '1'})
+    def test_delta_waits_for_extraction(self):
+        """Файлы нераспакованного архива не считаются загруженными и уходят в следующий"""
+        base = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, base)
+        (base / 'core').mkdir()
+        (base / 'core' / 'a.py').write_text('a')
+        stored = {}
+
+        def deploy_archive():
+            with patch('deploy.open_ftp', lambda *args: StandInFTP(stored)), \
+                    patch('deploy.compressor_command', return_value=None), \
+                    patch('deploy.subprocess.run'), patch('builtins.print'):
+                deploy.deploy_via_archive(base, 'host', 'user', 'pass', '/')
+
+        def archive_names():
+            with tarfile.open(fileobj=BytesIO(stored[deploy.ARCHIVE_NAME]), mode='r:gz') as tar:
+                return sorted(tar.getnames())
+
+        def extract():
+            with tarfile.open(fileobj=BytesIO(stored.pop(deploy.ARCHIVE_NAME)), mode='r:gz') as tar:
+                for member in tar.getmembers():
+                    stored[member.name] = tar.extractfile(member).read()
+
+        def manifest():
+            return json.loads(stored[deploy.MANIFEST_NAME])
+
+        deploy_archive()
+        self.assertEqual(manifest()['files'], {})
+        self.assertEqual(set(manifest()['pending']['files']), {'core/a.py'})
+
+        # Архив не распакован: следующий включает и его файлы
+        (base / 'core' / 'b.py').write_text('b')
+        deploy_archive()
+        self.assertEqual(archive_names(), [deploy.ARCHIVE_MARKER_NAME, 'core/a.py', 'core/b.py'])
+        self.assertEqual(manifest()['files'], {})
+
+        extract()
+        deploy_archive()
+        self.assertEqual(set(manifest()['files']), {'core/a.py', 'core/b.py'})
+        self.assertNotIn('pending', manifest())
+        self.assertNotIn(deploy.ARCHIVE_NAME, stored)
+
+        (base / 'core' / 'b.py').write_text('b2')
+        deploy_archive()
+        self.assertEqual(archive_names(), [deploy.ARCHIVE_MARKER_NAME, 'core/b.py'])
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class ExportStaticTest(CacheIsolationMixin, TestCase):
+    """Выгрузка статической копии сайта"""
+
+    def setUp(self):
+        super().setUp()
+        self.output = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.output)
+        self.page = Page.objects.create(title='Скупка ноутбуков', slug='skupka-noutbukov', page_type='skupka')
+
+    def export(self):
+        out = StringIO()
+        call_command('export_static', output=str(self.output), host='testserver', stdout=out)
+        return out.getvalue()
+
+    def test_export_and_incremental_rebuild(self):
+        """Вторая выгрузка пропускает неизменённые страницы"""
+        self.export()
+        html = (self.output / 'skupka-noutbukov' / 'index.html').read_text(encoding='utf-8')
+        self.assertIn('Скупка ноутбуков', html)
+        self.assertIn('name="csrfmiddlewaretoken" value=""', html)
+        for name in ('index.html', 'privacy/index.html', 'robots.txt', 'sitemap.xml', 'index.html.gz'):
+            self.assertTrue((self.output / name).exists(), name)
+
+        self.assertIn('записано 0', self.export())
+
+        Page.objects.create(title='Ремонт', slug='remont', page_type='remont', show_in_menu=False)
+        out = self.export()
+        self.assertIn('/remont/', out)
+        self.assertNotIn('/skupka-noutbukov/', out)
+
+    def test_csrf_cookie_endpoint(self):
+        """GET submit-contact/ выдаёт CSRF-cookie для статических страниц"""
+        response = self.client.get(reverse('core:submit_contact'))
+        self.assertEqual(response.status_code, 204)
+        self.assertIn('csrftoken', response.cookies)
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class ConditionalGetTest(CacheIsolationMixin, TestCase):
+    """ETag / Last-Modified и ответы 304"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.get_settings()
+        self.page = Page.objects.create(title='Скупка ноутбуков', slug='skupka-noutbukov', page_type='skupka')
+        self.url = self.page.get_absolute_url()
+
+    def test_not_modified_by_etag(self):
+        """Совпавший If-None-Match даёт 304 без запросов к БД"""
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_not_modified_since(self):
+        """If-Modified-Since даёт 304, пока контент не менялся"""
+        last_modified = self.client.get('/sitemap.xml')['Last-Modified']
+        response = self.client.get('/sitemap.xml', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_settings(self):
+        """Изменение настроек меняет ETag страниц"""
+        etag = self.client.get(self.url)['ETag']
+        SiteSettings.objects.update_or_create(pk=1, defaults={'phone': '8 (111) 111-11-11'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_build(self):
+        """После деплоя новых шаблонов старый ETag не даёт 304"""
+        with patch('core.views.build_fingerprint', return_value='old'):
+            etag = self.client.get(self.url)['ETag']
+        with patch('core.views.build_fingerprint', return_value='new'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Локальная замена api.telegram.org / google.com для тестов HTTP-клиента"""
+    protocol_version = 'HTTP/1.1'
+    connections = 0
+    response_body = b'{"ok": true, "success": true, "score": 0.9}'
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.response_body)))
+        self.end_headers()
+        self.wfile.write(self.response_body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TrickleHandler(StandInHandler):
+    """Отдаёт тело по байту: каждый recv укладывается в таймаут, весь ответ — нет"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Length', '40')
+        self.end_headers()
+        try:
+            for _ in range(40):
+                self.wfile.write(b'x')
+                self.wfile.flush()
+                time.sleep(0.05)
+        except OSError:
+            pass
+
+
+class HttpClientTest(CacheIsolationMixin, TestCase):
+    """Пул keep-alive соединений для reCAPTCHA и Telegram"""
+
+    def setUp(self):
+        super().setUp()
+        StandInHandler.connections = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.client_http = HttpClient()
+        self.addCleanup(self.client_http.close)
+
+    def test_connection_reused(self):
+        """Повторные вызовы идут по одному TCP-соединению"""
+        for _ in range(3):
+            status, body = self.client_http.post_form(f'{self.base_url}/x', {'a': '1'})
+            self.assertEqual(status, 200)
+        self.assertEqual(StandInHandler.connections, 1)
+        stats = self.client_http.stats()['127.0.0.1']
+        self.assertEqual((stats['calls'], stats['errors']), (3, 0))
+
+    def test_response_size_limit(self):
+        """Слишком большой ответ отклоняется"""
+        with self.assertRaises(HttpClientError):
+            self.client_http.post_form(f'{self.base_url}/x', {}, max_bytes=10)
+
+    def test_retry_respects_deadline(self):
+        """Повтор после обрыва простаивавшего соединения не выходит за лимит времени"""
+        self.client_http.post_form(f'{self.base_url}/x', {})
+
+        def stale(*args):
+            time.sleep(0.05)
+            raise ConnectionResetError
+
+        with patch.object(self.client_http, '_send', side_effect=stale) as mocked, \
+                self.assertRaisesMessage(HttpClientError, 'лимит времени'):
+            self.client_http.post_form(f'{self.base_url}/x', {}, deadline=time.monotonic() + 0.03)
+        self.assertEqual(mocked.call_count, 1)
+        self.assertEqual(StandInHandler.connections, 1)
+
+    def test_read_timeout_covers_whole_response(self):
+        """Медленный по кускам ответ прерывается по лимиту на весь ответ, а не на один recv"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), TrickleHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        started = time.monotonic()
+        with self.assertRaisesMessage(HttpClientError, 'ответ не получен'):
+            self.client_http.post_form(f'http://127.0.0.1:{server.server_port}/x', {}, read_timeout=0.3)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_integrations_use_shared_client(self):
+        """reCAPTCHA и Telegram ходят через общий клиент"""
+        SiteSettings.objects.update_or_create(pk=1, defaults={'recaptcha_secret_key': 'secret'})
+        with patch('core.services.http_client', self.client_http), \
+                patch('core.services.RECAPTCHA_VERIFY_URL', f'{self.base_url}/siteverify'), \
+                patch('core.services.TELEGRAM_API_URL', self.base_url):
+            self.assertEqual(verify_recaptcha('token', '127.0.0.1'), (True, 0.9))
+            self.assertTrue(send_telegram_message('1:token', '-100', 'Тест'))
+        self.assertEqual(StandInHandler.connections, 1)
+
+
+class RecaptchaCircuitBreakerTest(CacheIsolationMixin, TestCase):
+    """Предохранитель и лимит времени для reCAPTCHA"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.update_or_create(pk=1, defaults={
+            'recaptcha_secret_key': 'secret', 'recaptcha_fail_open': False, 'recaptcha_timeout': 1.5,
+        })
+
+    @patch('core.services.http_client')
+    def test_breaker_opens_and_recovers(self, mock_client):
+        """После серии сбоев Google не вызывается, затем пробный запрос закрывает цепь"""
+        mock_client.post_form.side_effect = HttpClientError('timeout')
+        for _ in range(RECAPTCHA_BREAKER_FAILURES):
+            self.assertEqual(verify_recaptcha('token'), (False, 0.0))
+        self.assertTrue(recaptcha_breaker.is_open())
+
+        mock_client.post_form.reset_mock()
+        self.assertEqual(verify_recaptcha('token'), (False, 0.0))
+        mock_client.post_form.assert_not_called()
+
+        mock_client.post_form.side_effect = None
+        mock_client.post_form.return_value = (200, b'{"success": true, "score": 0.9}')
+        with patch.object(recaptcha_breaker, 'reset_timeout', 0):
+            self.assertEqual(verify_recaptcha('token'), (True, 0.9))
+        self.assertFalse(recaptcha_breaker.is_open())
+
+    def test_concurrent_failures_are_all_counted(self):
+        """Сбои из нескольких потоков не теряются при записи в кеш"""
+        breaker = CircuitBreaker('test', failure_threshold=1000, reset_timeout=60)
+
+        def worker():
+            for _ in range(20):
+                breaker.record_failure()
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get(breaker.failures_key), 100)
+        self.assertFalse(breaker.is_open())
+        breaker.record_success()
+        self.assertIsNone(cache.get(breaker.failures_key))
+
+    @patch('core.services.http_client')
+    def test_fail_open_and_budget(self, mock_client):
+        """Режим fail-open принимает заявку, вызов ограничен бюджетом из настроек"""
+        SiteSettings.objects.update_or_create(pk=1, defaults={'recaptcha_fail_open': True})
+        mock_client.post_form.side_effect = HttpClientError('timeout')
+        started = time.monotonic()
+        self.assertEqual(verify_recaptcha('token'), (True, 1.0))
+        deadline = mock_client.post_form.call_args.kwargs['deadline']
+        self.assertAlmostEqual(deadline - started, 1.5, delta=0.5)
+
+
+class ContactRateLimitTest(CacheIsolationMixin, TestCase):
+    """Лимит заявок по IP и телефону"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.objects.update_or_create(pk=1, defaults={
+            'rate_limit_per_ip': 2, 'rate_limit_per_phone': 1, 'rate_limit_window': 600,
+        })
+
+    def post(self, phone, ip='10.0.0.1'):
+        return self.client.post(reverse('core:submit_contact'), {
+            'name': 'Тест', 'phone': phone, 'privacy_agreement': 'on',
+        }, HTTP_X_REQUESTED_WITH='XMLHttpRequest', REMOTE_ADDR=ip)
+
+    @patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+    def test_ip_limit_rejects_before_recaptcha(self, mock_verify):
+        """Лишний запрос с того же IP отклоняется без reCAPTCHA и записи в БД"""
+        self.assertEqual(self.post('+7 999 000-00-01').status_code, 200)
+        self.assertEqual(self.post('+7 999 000-00-02').status_code, 200)
+        response = self.post('+7 999 000-00-03')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(mock_verify.call_count, 2)
+        self.assertEqual(ContactRequest.objects.count(), 2)
+
+    @patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+    def test_phone_limit_uses_normalized_number(self, mock_verify):
+        """Один номер в разной записи считается одним телефоном"""
+        self.assertEqual(self.post('8 (999) 000-00-01', ip='10.0.0.1').status_code, 200)
+        self.assertEqual(self.post('+79990000001', ip='10.0.0.2').status_code, 429)
+
+    @patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+    def test_replay_bypasses_limit(self, mock_verify):
+        """Повтор принятой заявки (тот же ключ) не упирается в лимит и не расходует его"""
+        data = {'name': 'Тест', 'phone': '+7 999 000-00-01', 'privacy_agreement': 'on', 'idempotency_key': 'a' * 32}
+        for _ in range(3):
+            response = self.client.post(reverse('core:submit_contact'), data,
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.json()['success'])
+        self.assertEqual(self.post('+7 999 000-00-02').status_code, 200)
+
+    @patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+    def test_limit_survives_shared_cache_eviction(self, mock_verify):
+        """Счётчики живут в своём кеше: чистка общего их не сбрасывает, отказы их не расходуют"""
+        self.post('+7 999 000-00-01')
+        self.post('+7 999 000-00-02')
+        cache.clear()
+        for _ in range(3):
+            self.assertEqual(self.post('+7 999 000-00-03').status_code, 429)
+        self.assertEqual(rate_limit_exceeded('ip', '10.0.0.9', 1, 600), False)
+        self.assertEqual(rate_limit_exceeded('ip', '10.0.0.9', 1, 600), True)
+        self.assertEqual(rate_limit_exceeded('ip', '10.0.0.9', 2, 600), False)
+
+    def test_file_cache_incr_is_atomic(self):
+        """incr() файлового кеша из нескольких потоков не теряет увеличений и не сбрасывает срок"""
+        counters = caches['ratelimit']
+        counters.add('core:test:counter', 0, 600)
+
+        def worker():
+            for _ in range(50):
+                counters.incr('core:test:counter')
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counters.get('core:test:counter'), 300)
+        with open(counters._key_to_file('core:test:counter'), 'rb') as f:
+            self.assertGreater(pickle.load(f), time.time() + 500)
+
+    def test_normalize_phone(self):
+        self.assertEqual(normalize_phone('8 (953) 921-15-72'), '79539211572')
+        self.assertEqual(normalize_phone('+7 953 921 15 72'), '79539211572')
+        self.assertEqual(normalize_phone('9539211572'), '79539211572')
+
+
+@patch('core.views.verify_recaptcha', return_value=(True, 0.9))
+class ContactIdempotencyTest(CacheIsolationMixin, TestCase):
+    """Повторные отправки формы не создают дублей"""
+
+    def setUp(self):
+        super().setUp()
+        self.data = {
+            'name': 'Тест', 'phone': '+7 999 123-45-67', 'message': 'iPhone 12',
+            'privacy_agreement': 'on', 'idempotency_key': 'a' * 32,
+        }
+
+    def post(self, data):
+        return self.client.post(reverse('core:submit_contact'), data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_retry_with_same_key_returns_stored_result(self, mock_verify):
+        """Повтор с тем же ключом не проверяет reCAPTCHA и не пишет в БД"""
+        first = self.post(self.data)
+        second = self.post({**self.data, 'message': 'другой текст'})
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(ContactRequest.objects.count(), 1)
+        mock_verify.assert_called_once()
+
+    def test_identical_content_collapses(self, mock_verify):
+        """Та же заявка с того же телефона (в другой записи) схлопывается"""
+        self.post(self.data)
+        response = self.post({**self.data, 'idempotency_key': 'b' * 32,
+                              'phone': '8 999 1234567', 'message': '  iphone   12 '})
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(ContactRequest.objects.count(), 1)
+
+        self.post({**self.data, 'idempotency_key': 'c' * 32, 'message': 'Samsung'})
+        self.assertEqual(ContactRequest.objects.count(), 2)
+
+    def test_form_issues_key(self, mock_verify):
+        """Форма выдаёт ключ идемпотентности при показе"""
+        self.assertEqual(len(ContactForm().initial['idempotency_key']), 32)
+
+
+class SQLiteConcurrencyTest(SimpleTestCase):
+    """Бэкенд core.db на файле: BEGIN IMMEDIATE, PRAGMA и смешанная нагрузка чтения/записи"""
+
+    def test_atomic_begins_immediate_with_pragmas(self):
+        """transaction.atomic() на настроенном бэкенде открывает BEGIN IMMEDIATE, PRAGMA действуют"""
+        with tempfile.TemporaryDirectory() as tmp:
+            config = connections.settings['default']
+            conn = connections['sqlite-profile'] = load_backend(config['ENGINE']).DatabaseWrapper(
+                {**config, 'NAME': str(Path(tmp) / 'db.sqlite3')}, 'sqlite-profile')
+            try:
+                with CaptureQueriesContext(conn) as captured, transaction.atomic(using='sqlite-profile'):
+                    with conn.cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode')
+                        journal_mode = cursor.fetchone()[0]
+                        cursor.execute('PRAGMA busy_timeout')
+                        busy_timeout = cursor.fetchone()[0]
+            finally:
+                conn.close()
+                del connections['sqlite-profile']
+        self.assertEqual(captured.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertEqual(journal_mode, django_settings.SQLITE_PRAGMAS['journal_mode'].lower())
+        self.assertEqual(busy_timeout, django_settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_tuned_profile_has_no_lock_errors(self):
+        """WAL + busy_timeout + BEGIN IMMEDIATE: ни одного «database is locked» (цифры — в manage.py bench)"""
+        with tempfile.TemporaryDirectory() as tmp:
+            result = run_sqlite_contention(tmp, duration=0.6)
+        before, after = result['default'], result['tuned']
+        summary = f'по умолчанию: {before}; профиль: {after}'
+        self.assertEqual(after['locked'], 0, summary)
+        self.assertGreater(after['writes'], 0, summary)
+        self.assertGreater(after['reads'], 0, summary)
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class QueryPlanTest(CacheIsolationMixin, TestCase):
+    """Горячие запросы сайта и админки не читают таблицы core целиком"""
+
+    FULL_SCAN_RE = re.compile(r'\bSCAN (core_\w+)$')
+    # Таблица из одной строки: полный просмотр дешевле любого индекса
+    SINGLETON_TABLES = {'core_sitesettings'}
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.get_settings()
+        Page.objects.create(title='Главная', slug='home', page_type='home')
+        self.page = Page.objects.create(title='Ремонт', slug='remont', page_type='remont', show_in_menu=True)
+        ContactRequest.objects.create(name='Иван', phone='+7 999 000-00-00', page=self.page)
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.admin_client = Client()
+        self.admin_client.force_login(admin)
+
+    def exercise(self):
+        client = Client()
+        for url in ('/', '/remont/', '/sitemap.xml', '/robots.txt', '/search/?q=ремонт'):
+            self.assertEqual(client.get(url).status_code, 200, url)
+        changelist = reverse('admin:core_contactrequest_changelist')
+        for url in (
+            reverse('admin:core_page_changelist'),
+            changelist,
+            changelist + '?is_processed__exact=0',
+            changelist + '?created_at__year=%d' % timezone.now().year,
+            changelist + '?q=иван',
+            reverse('admin:core_notificationoutbox_changelist'),
+        ):
+            self.assertEqual(self.admin_client.get(url).status_code, 200, url)
+        deliver_outbox()
+
+    def test_no_full_table_scans(self):
+        """EXPLAIN QUERY PLAN каждого SELECT по таблицам core использует индекс"""
+        with CaptureQueriesContext(connection) as captured:
+            self.exercise()
+        scans = []
+        with connection.cursor() as cursor:
+            for query in captured.captured_queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT') or 'core_' not in sql:
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                for row in cursor.fetchall():
+                    match = self.FULL_SCAN_RE.search(row[-1])
+                    if match and match[1] not in self.SINGLETON_TABLES:
+                        scans.append(f'{row[-1]}: {sql}')
+        self.assertEqual(scans, [], '\n'.join(scans))
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class ContactRequestAdminTest(CacheIsolationMixin, TestCase):
+    """Список заявок в админке: кеш счётчиков и дат, постраничный вывод по индексу"""
+
+    def setUp(self):
+        super().setUp()
+        page = Page.objects.create(title='Ремонт', slug='remont', page_type='remont')
+        now = timezone.now()
+        for i in range(7):
+            contact = ContactRequest.objects.create(name=f'Клиент {i}', phone=f'+7 999 000-00-0{i}', page=page)
+            # Две заявки с одинаковым временем проверяют границу по pk
+            ContactRequest.objects.filter(pk=contact.pk).update(created_at=now - timezone.timedelta(days=i // 2 * 40))
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        self.url = reverse('admin:core_contactrequest_changelist')
+
+    def listed_pks(self, response):
+        return [obj.pk for obj in response.context['cl'].result_list]
+
+    def test_warm_changelist_skips_count_and_dates(self):
+        """Повторный показ списка не считает COUNT(*) и не строит date_hierarchy заново"""
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        sql = ' '.join(q['sql'] for q in captured.captured_queries)
+        self.assertNotIn('COUNT(', sql)
+        self.assertNotIn('django_datetime_trunc', sql)
+        self.assertNotIn('MIN("core_contactrequest"."created_at")', sql)
+
+    def test_count_is_estimated_from_pk_range(self):
+        """Без фильтров число заявок — диапазон pk: новая заявка видна сразу, без COUNT(*)"""
+        self.assertEqual(self.client.get(self.url).context['cl'].result_count, 7)
+        ContactRequest.objects.create(name='Новый', phone='+7 999 111-11-11')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 8)
+        self.assertNotIn('COUNT(', ' '.join(q['sql'] for q in captured.captured_queries))
+
+    def test_filtered_count_outlives_new_contacts(self):
+        """Число по фильтру не пересчитывается после каждой новой заявки"""
+        params = {'is_processed__exact': '0'}
+        self.assertEqual(self.client.get(self.url, params).context['cl'].result_count, 7)
+        ContactRequest.objects.create(name='Новый', phone='+7 999 111-11-11')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url, params)
+        self.assertNotIn('COUNT(', ' '.join(q['sql'] for q in captured.captured_queries))
+        self.assertEqual(len(response.context['cl'].result_list), 8)
+
+    @patch('core.admin.ContactRequestAdmin.list_per_page', 2)
+    def test_seek_pages_match_offset_order(self):
+        """Страницы по границе индекса совпадают с обычной сортировкой"""
+        expected = list(ContactRequest.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        listed = []
+        for page_num in range(4):
+            listed += self.listed_pks(self.client.get(self.url, {'p': page_num + 1}))
+        self.assertEqual(listed, expected)
+
+    @patch('core.admin.ContactRequestAdmin.list_per_page', 2)
+    def test_next_page_link_seeks_from_last_row(self):
+        """Ссылка «следующая» несёт pk последней заявки; страница по ней читается без OFFSET"""
+        expected = list(ContactRequest.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        response = self.client.get(self.url)
+        listed = self.listed_pks(response)
+        for page_num in range(2, 5):
+            cl = response.context['cl']
+            link = cl.get_query_string({'p': page_num})
+            self.assertIn(f'after={listed[-1]}', link)
+            # Прочие ссылки курсор не несут
+            self.assertNotIn('after=', cl.get_query_string({'o': '1'}))
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(self.url + link)
+            self.assertNotIn('OFFSET', ' '.join(q['sql'] for q in captured.captured_queries))
+            listed += self.listed_pks(response)
+        self.assertEqual(listed, expected)
+
+    @patch('core.admin.ContactRequestAdmin.list_per_page', 2)
+    def test_seek_page_uses_index(self):
+        """Страница дальше первой выбирается поиском по индексу, без OFFSET по строкам"""
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(self.url, {'p': 3})
+        rows_sql = [q['sql'] for q in captured.captured_queries
+                    if q['sql'].startswith('SELECT "core_contactrequest"."id", "core_contactrequest"."name"')]
+        self.assertEqual(len(rows_sql), 1)
+        self.assertNotIn('OFFSET', rows_sql[0])
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + rows_sql[0])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('SEARCH core_contactrequest USING INDEX core_contact_created_idx', plan)
+
+
+class ContactRequestSearchTest(TestCase):
+    """Поиск заявок через FTS5"""
+
+    def setUp(self):
+        self.petr = ContactRequest.objects.create(name='Пётр Ёлкин', phone='8 (999) 123-45-67',
+                                                  device_info='iPhone 13, треснул экран')
+        self.anna = ContactRequest.objects.create(name='Анна', phone='+7 913 000-11-22', email='anna@example.com')
+
+    def search(self, term):
+        return list(search_contact_requests(ContactRequest.objects.all(), term))
+
+    def test_cyrillic_prefix_and_yo(self):
+        """Поиск по началу слова, без учёта регистра и буквы ё"""
+        self.assertEqual(self.search('петр елк'), [self.petr])
+        self.assertEqual(self.search('ТРЕСН'), [self.petr])
+        self.assertEqual(self.search('iphone анна'), [])
+
+    def test_phone_in_any_format(self):
+        """Телефон находится по полному номеру в любом виде и по группам цифр"""
+        self.assertEqual(self.search('+7 999 1234567'), [self.petr])
+        self.assertEqual(self.search('89991234567'), [self.petr])
+        self.assertEqual(self.search('9130001122'), [self.anna])
+        self.assertEqual(self.search('913'), [self.anna])
+
+    def test_index_follows_updates_and_deletes(self):
+        """Триггеры обновляют индекс при изменении и удалении заявки"""
+        self.anna.message = 'Продать ноутбук'
+        self.anna.save()
+        self.assertEqual(self.search('ноут'), [self.anna])
+        self.anna.delete()
+        self.assertEqual(self.search('ноут'), [])
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 во вводе не ломают запрос"""
+        self.assertEqual(build_match_query('NOT "петр" OR*'), '"not"* "петр"* "or"*')
+        self.assertEqual(self.search('"Пётр" -'), [self.petr])
+
+    def test_admin_search_uses_fts(self):
+        """Поиск в админке идёт через MATCH, а не LIKE"""
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as captured, \
+                override_settings(STORAGES=SIMPLE_STATIC_STORAGES):
+            response = self.client.get(reverse('admin:core_contactrequest_changelist'), {'q': 'анна'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.anna])
+        sql = ' '.join(q['sql'] for q in captured.captured_queries)
+        self.assertIn('MATCH', sql)
+        self.assertNotIn('LIKE', sql)
+
+
+class RussianStemmerTest(SimpleTestCase):
+    """Стеммер для поиска по сайту"""
+
+    def test_snowball_stems(self):
+        """Основы совпадают с эталонным Snowball"""
+        cases = {
+            'вазы': 'ваз', 'важнейшие': 'важн', 'валялись': 'валя', 'гуманность': 'гуман',
+            'ноутбуков': 'ноутбук', 'ремонту': 'ремонт', 'Ёлки': 'елк', 'iPhone': 'iphone',
+        }
+        self.assertEqual({word: stem(word) for word in cases}, cases)
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class SiteSearchTest(CacheIsolationMixin, TestCase):
+    """Поиск по страницам сайта"""
+
+    def setUp(self):
+        super().setUp()
+        SiteSettings.get_settings()
+        self.laptops = Page.objects.create(
+            title='Скупка ноутбуков', slug='noutbuki', page_type='skupka',
+            content='<p>Покупаем <b>ноутбуки</b> в любом состоянии.</p><script>var ремонт = 1;</script>',
+        )
+        self.repair = Page.objects.create(
+            title='Ремонт техники', slug='remont', page_type='remont',
+            content='<p>Чиним ноутбук, телефон &amp; планшет за один день.</p>',
+        )
+
+    def search(self, query):
+        return self.client.get(reverse('core:search'), {'q': query})
+
+    def test_index_is_filled_after_migrate_and_by_command(self):
+        """Пустой индекс заполняют шаг после migrate (0016) и rebuild_search_index"""
+        def wipe():
+            with connection.cursor() as cursor:
+                cursor.execute('DELETE FROM core_page_fts')
+            self.assertEqual(self.search('ноутбук').context['results'], [])
+
+        wipe()
+        migration = MigrationLoader(connection).get_migration(*PAGE_FTS_MIGRATION)
+        index_pages_after_migrate(apps.get_app_config('core'), plan=[(migration, False)])
+        self.assertEqual(len(self.search('ноутбук').context['results']), 2)
+        wipe()
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Страниц в индексе: 2', out.getvalue())
+        self.assertEqual(len(self.search('ноутбук').context['results']), 2)
+
+    def test_stemmed_match_ranked_by_title(self):
+        """Словоформы находят друг друга, совпадение в заголовке выше"""
+        results = self.search('ноутбук').context['results']
+        self.assertEqual([r.title for r in results], ['Скупка ноутбуков', 'Ремонт техники'])
+        self.assertIn('<mark>ноутбуки</mark>', results[0].snippet)
+        self.assertIn('<mark>ноутбук,</mark>', results[1].snippet)
+
+    def test_index_ignores_markup(self):
+        """Теги и скрипты не попадают в индекс, сущности раскодированы"""
+        self.assertEqual([r.title for r in self.search('ремонта').context['results']], ['Ремонт техники'])
+        self.assertEqual(self.search('var').context['results'], [])
+        self.assertIn('телефон &amp; <mark>планшет</mark>', str(self.search('планшеты').context['results'][0].snippet))
+
+    def test_index_follows_page_changes(self):
+        """Сохранение, снятие с публикации и удаление страницы сразу видны в поиске"""
+        self.repair.content = '<p>Меняем дисплеи</p>'
+        self.repair.save()
+        self.assertEqual([r.title for r in self.search('дисплей').context['results']], ['Ремонт техники'])
+        self.repair.is_published = False
+        self.repair.save()
+        self.assertEqual(self.search('дисплей').context['results'], [])
+        self.laptops.delete()
+        self.assertEqual(self.search('скупка').context['results'], [])
+
+    def test_query_does_not_load_page_html(self):
+        """Запрос поиска не читает исходный HTML страниц"""
+        with CaptureQueriesContext(connection) as captured:
+            response = self.search('ноутбук')
+        self.assertEqual(response.status_code, 200)
+        page_queries = [q['sql'] for q in captured.captured_queries if 'FROM "core_page"' in q['sql']]
+        self.assertTrue(page_queries)
+        self.assertFalse(any('"core_page"."content"' in sql for sql in page_queries))
+        self.assertContains(response, 'noindex')
+
+
+class LeadExportTest(TestCase):
+    """Потоковая выгрузка заявок"""
+
+    def setUp(self):
+        self.page = Page.objects.create(title='Ремонт', slug='remont', page_type='remont')
+        self.new = ContactRequest.objects.create(name='Иван', phone='+7 999 000-00-01', page=self.page,
+                                                 message='=HYPERLINK("x")')
+        self.done = ContactRequest.objects.create(name='Анна', phone='89130001122', is_processed=True)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def test_csv_command_with_filters(self):
+        """CSV для Excel: BOM, «;», фильтры, ячейки-формулы обезврежены"""
+        out = StringIO()
+        call_command('export_leads', '--unprocessed', '--page', 'remont',
+                     '--since', timezone.localdate().isoformat(), stdout=out)
+        content = out.getvalue()
+        self.assertTrue(content.startswith('\ufeff'))
+        rows = list(csv.reader(StringIO(content.lstrip('\ufeff')), delimiter=';'))
+        self.assertEqual(rows[0][:3], ['ID', 'Дата', 'Имя'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2], 'Иван')
+        # Телефон с «+» выгружается как есть, формула из текста заявки — с апострофом
+        self.assertEqual(rows[1][3], '+7 999 000-00-01')
+        self.assertEqual(rows[1][5], "'=HYPERLINK(\"x\")")
+        self.assertEqual(rows[1][7], 'Ремонт')
+
+    def test_csv_safe_exempts_only_phones(self):
+        self.assertEqual(csv_safe('+7 (913) 000-11-22'), '+7 (913) 000-11-22')
+        self.assertEqual(csv_safe('+79130001122'), '+79130001122')
+        self.assertEqual(csv_safe('+7 999 000-00-01+cmd|calc'), "'+7 999 000-00-01+cmd|calc")
+        self.assertEqual(csv_safe('+SUM(A1:A2)'), "'+SUM(A1:A2)")
+        self.assertEqual(csv_safe('-1+1'), "'-1+1")
+
+    def test_xlsx_command_writes_valid_workbook(self):
+        """XLSX — корректный zip с листом из inline-строк"""
+        path = Path(self.tmp) / 'leads.xlsx'
+        call_command('export_leads', '--format', 'xlsx', '--output', str(path))
+        with zipfile.ZipFile(path) as archive:
+            self.assertIsNone(archive.testzip())
+            sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        rows = sheet.findall('.//s:row', ns)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2].findall('s:c', ns)[2].findtext('.//s:t', namespaces=ns), 'Анна')
+        self.assertEqual(rows[1].find('s:c', ns).findtext('s:v', namespaces=ns), str(self.new.pk))
+
+    @override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+    def test_admin_action_streams_selection(self):
+        """Действие админки отдаёт только выбранные заявки потоком"""
+        admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:core_contactrequest_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.done.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        self.assertIn('Анна', content)
+        self.assertNotIn('Иван', content)
+
+    def test_memory_does_not_grow_with_rows(self):
+        """Пик памяти при выгрузке почти не зависит от числа строк"""
+        def peak(count):
+            ContactRequest.objects.all().delete()
+            ContactRequest.objects.bulk_create(
+                ContactRequest(name=f'Клиент {i}', phone='79990000000', message='х' * 200) for i in range(count)
+            )
+            tracemalloc.start()
+            size = sum(len(chunk) for chunk in stream_export(ContactRequest.objects.all(), 'xlsx', chunk_size=200))
+            result = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return result, size
+
+        small_peak, small_size = peak(1000)
+        large_peak, large_size = peak(5000)
+        self.assertGreater(large_size, small_size * 3)
+        self.assertLess(large_peak, small_peak * 1.5)
+
+
+class LeadArchiveTest(CacheIsolationMixin, TestCase):
+    """Перенос старых заявок в архив и поиск по нему"""
+
+    def setUp(self):
+        super().setUp()
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        page = Page.objects.create(title='Ремонт', slug='remont', page_type='remont')
+        now = timezone.now()
+        self.old = []
+        for i, days in enumerate((400, 400, 430, 500)):
+            contact = ContactRequest.objects.create(name=f'Пётр {i}', phone=f'+7 999 000-00-0{i}', page=page,
+                                                    message='Продаю ноутбук' if i == 0 else '')
+            ContactRequest.objects.filter(pk=contact.pk).update(created_at=now - timezone.timedelta(days=days))
+            self.old.append(contact)
+        self.old_months = {
+            f'{timezone.localtime(created_at):%Y-%m}'
+            for created_at in ContactRequest.objects.values_list('created_at', flat=True)
+        }
+        NotificationOutbox.objects.create(contact_request=self.old[0], message='x')
+        self.fresh = ContactRequest.objects.create(name='Анна', phone='+7 913 000-11-22')
+
+    def test_archives_in_batches_by_month(self):
+        """Старые заявки уходят в файлы месяцев пачками, свежие остаются"""
+        pauses = []
+        total, files = archive_leads(365, root=self.root, compression='gzip', batch_size=3,
+                                     pause=0.01, sleep=pauses.append)
+        self.assertEqual(total, 4)
+        self.assertEqual(len(pauses), 2)
+        self.assertEqual(list(ContactRequest.objects.all()), [self.fresh])
+        self.assertIsNone(NotificationOutbox.objects.get().contact_request_id)
+        self.assertEqual({path.name for path in files},
+                         {f'leads-{month}.jsonl.gz' for month in self.old_months})
+        records = list(iter_archive(self.root))
+        self.assertEqual(sorted(r['id'] for r in records), sorted(c.pk for c in self.old))
+        self.assertEqual(records[0]['page_slug'], 'remont')
+
+    def test_append_and_duplicates(self):
+        """Повторный прогон дописывает файл, дубль после сбоя читается один раз"""
+        archive_leads(450, root=self.root, compression='gzip')
+        rows = list(ContactRequest.objects.filter(pk=self.old[0].pk).values(*ARCHIVE_FIELDS))
+        archive_batch(rows, self.root, 'gzip')  # запись без удаления — как при сбое
+        archive_leads(365, root=self.root, compression='gzip')
+        ids = [r['id'] for r in iter_archive(self.root)]
+        self.assertEqual(sorted(ids), sorted(c.pk for c in self.old))
+
+    def test_month_keeps_its_compression(self):
+        """Начатый месяц дописывается в свой файл при другом сжатии по умолчанию"""
+        created_at = ContactRequest.objects.get(pk=self.old[3].pk).created_at
+        month = f'{timezone.localtime(created_at):%Y-%m}'
+        archive_leads(450, root=self.root, compression='gzip')
+        # Ещё одна заявка того же месяца, а по умолчанию теперь zstd
+        rows = list(ContactRequest.objects.filter(pk=self.old[0].pk).values(*ARCHIVE_FIELDS))
+        rows[0]['created_at'] = created_at
+        self.assertEqual(archive_batch(rows, self.root, 'zstd'),
+                         [self.root / 'leads' / month[:4] / f'leads-{month}.jsonl.gz'])
+        self.assertEqual(list(self.root.glob('leads/*/*.zst')), [])
+        self.assertIn(self.old[0].pk, [r['id'] for r in iter_archive(self.root)])
+
+    def test_started_zstd_month_without_zstandard(self):
+        """Месяц в .zst без пакета zstandard: ошибка до удаления, заявки остаются в базе"""
+        created_at = ContactRequest.objects.get(pk=self.old[3].pk).created_at
+        month = f'{timezone.localtime(created_at):%Y-%m}'
+        path = self.root / 'leads' / month[:4] / f'leads-{month}.jsonl.zst'
+        path.parent.mkdir(parents=True)
+        path.touch()
+        with patch('core.archive.zstandard', None), self.assertRaisesMessage(RuntimeError, 'zstandard'):
+            archive_leads(450, root=self.root, compression='gzip')
+        self.assertTrue(ContactRequest.objects.filter(pk=self.old[3].pk).exists())
+        self.assertEqual(path.stat().st_size, 0)
+
+    def test_delete_batch_covers_all_references(self):
+        """delete_batch повторяет on_delete всех ссылок на заявку — новая ссылка требует правки"""
+        references = {
+            (relation.related_model, relation.field.name, relation.on_delete)
+            for relation in ContactRequest._meta.related_objects
+        }
+        self.assertEqual(references, {(NotificationOutbox, 'contact_request', models.SET_NULL)})
+        delete_batch([self.old[0].pk])
+        outbox = NotificationOutbox.objects.get()
+        self.assertIsNone(outbox.contact_request_id)
+        self.assertFalse(ContactRequest.objects.filter(pk=self.old[0].pk).exists())
+
+    def test_search_command(self):
+        """--search находит заявки в архиве по словам и по телефону"""
+        call_command('archive_leads', '--days', '365', '--archive-dir', str(self.root),
+                     '--compression', 'gzip', '--pause', '0', stdout=StringIO())
+        self.assertEqual(list(search_contact_requests(ContactRequest.objects.all(), 'петр')), [])
+
+        def search(*args):
+            out = StringIO()
+            call_command('archive_leads', '--archive-dir', str(self.root), '--search', *args,
+                         stdout=out, stderr=StringIO())
+            return [json.loads(line)['id'] for line in out.getvalue().splitlines()]
+
+        self.assertEqual(search('петр НОУТ'), [self.old[0].pk])
+        self.assertEqual(search('8 999 000 00 03'), [self.old[3].pk])
+        self.assertEqual(search('петр', '--since', timezone.localdate().isoformat()), [])
+
+
+class RenderedContentTest(CacheIsolationMixin, TestCase):
+    """Обработка контента страницы при сохранении"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        (Path(self.media) / 'uploads').mkdir()
+        Image.new('RGB', (640, 480)).save(Path(self.media) / 'uploads' / 'photo.jpg')
+
+    def test_images_headings_and_empty_markup(self):
+        """Картинки получают lazy/async и размеры, заголовки — якоря, пустые теги удаляются"""
+        with override_settings(MEDIA_ROOT=self.media):
+            html, toc = render_content(
+                '<h2>Как мы работаем</h2><p>&nbsp;</p><p><strong> </strong><br></p>'
+                '<p><img src="/media/uploads/photo.jpg" alt="Фото"></p>'
+                '<h3>Шаг&nbsp;1</h3><h2>Как мы работаем</h2><h2 id="own">Свой якорь</h2>'
+                '<img src="https://example.com/x.png"><img src="/media/../settings.py">'
+            )
+        self.assertEqual(html, (
+            '<h2 id="как-мы-работаем">Как мы работаем</h2>'
+            '<p><img src="/media/uploads/photo.jpg" alt="Фото" loading="lazy" decoding="async" '
+            'width="640" height="480"></p>'
+            '<h3 id="шаг-1">Шаг&nbsp;1</h3><h2 id="как-мы-работаем-2">Как мы работаем</h2>'
+            '<h2 id="own">Свой якорь</h2>'
+            '<img src="https://example.com/x.png" loading="lazy" decoding="async">'
+            '<img src="/media/../settings.py" loading="lazy" decoding="async">'
+        ))
+        self.assertEqual([(item['id'], item['level']) for item in toc], [
+            ('как-мы-работаем', 2), ('шаг-1', 3), ('как-мы-работаем-2', 2), ('own', 2),
+        ])
+
+    def test_icon_markup_is_kept(self):
+        """Пустые элементы с атрибутами (иконки) остаются, пустые обёртки без них — нет"""
+        html, _ = render_content(
+            '<p><i class="fa fa-phone"></i> Звоните</p><p><span class="icon icon-check"></span></p>'
+            '<p><span> </span><i></i></p>'
+        )
+        self.assertEqual(html, '<p><i class="fa fa-phone"></i> Звоните</p><p><span class="icon icon-check"></span></p>')
+
+    def test_pages_are_rendered_after_migrate(self):
+        """После миграции 0017 страницы обрабатываются текущим кодом, версия 'pages' меняется"""
+        page = Page.objects.create(title='Инфо', slug='info', content='<h2>Цены</h2><p></p>')
+        # Так страницу оставляет замороженный шаг миграции
+        Page.objects.filter(pk=page.pk).update(content_html=page.content, toc=[])
+        version = get_version('pages')
+        migration = MigrationLoader(connection).get_migration(*CONTENT_HTML_MIGRATION)
+        render_pages_after_migrate(apps.get_app_config('auth'), plan=[(migration, False)], using='default')
+        render_pages_after_migrate(apps.get_app_config('core'), plan=[(migration, True)], using='default')
+        page.refresh_from_db()
+        self.assertEqual(page.content_html, '<h2>Цены</h2><p></p>')
+        render_pages_after_migrate(apps.get_app_config('core'), plan=[(migration, False)], using='default')
+        page.refresh_from_db()
+        self.assertEqual(page.content_html, '<h2 id="цены">Цены</h2>')
+        self.assertEqual(page.toc, [{'id': 'цены', 'title': 'Цены', 'level': 2}])
+        self.assertNotEqual(get_version('pages'), version)
+
+    @override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+    def test_page_view_emits_stored_html(self):
+        """Страница отдаёт сохранённый content_html и не загружает исходный HTML"""
+        SiteSettings.get_settings()
+        page = Page.objects.create(title='Ремонт', slug='remont', page_type='remont',
+                                   content='<h2>Цены</h2><p>Текст</p><h2>Сроки</h2><h3>Срочно</h3><p></p>')
+        self.assertEqual(len(page.toc), 3)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/remont/')
+        self.assertContains(response, '<h2 id="цены">Цены</h2>', html=False)
+        self.assertContains(response, 'class="content-toc"')
+        self.assertContains(response, '<a href="#сроки">Сроки</a>', html=False)
+        self.assertNotContains(response, '<p></p>')
+        self.assertFalse(any('"core_page"."content",' in q['sql'] for q in captured.captured_queries))
+
+    def test_update_fields_keeps_rendered_html_in_sync(self):
+        """save(update_fields=['content']) обновляет и обработанный HTML"""
+        page = Page.objects.create(title='Инфо', slug='info', content='<p>Старый</p>')
+        page.content = '<h2>Новый</h2>'
+        page.save(update_fields=['content'])
+        page.refresh_from_db()
+        self.assertEqual(page.content_html, '<h2 id="новый">Новый</h2>')
+        self.assertEqual(page.toc, [{'id': 'новый', 'title': 'Новый', 'level': 2}])
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=(480, 800, 1200, 2400), IMAGE_VARIANT_WORKERS=0)
+class ImageVariantTest(CacheIsolationMixin, TestCase):
+    """Уменьшенные копии картинок, srcset в тексте страниц и og:image"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        (Path(self.media) / 'uploads').mkdir()
+        Image.new('RGB', (2000, 1000), 'red').save(Path(self.media) / 'uploads' / 'photo.jpg')
+
+    def test_variants_are_built_once_and_not_upscaled(self):
+        """WebP и JPEG всех ширин меньше оригинала; повторная сборка ничего не делает"""
+        self.assertEqual(build_variants('uploads/photo.jpg'), 6)
+        variants = list(ImageVariant.objects.values_list('format', 'width', 'height'))
+        self.assertEqual(sorted(variants), [
+            ('jpeg', 480, 240), ('jpeg', 800, 400), ('jpeg', 1200, 600),
+            ('webp', 480, 240), ('webp', 800, 400), ('webp', 1200, 600),
+        ])
+        with Image.open(Path(self.media) / 'variants' / 'uploads' / 'photo.jpg-800w.webp') as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (800, 400)))
+        self.assertEqual(build_variants('uploads/photo.jpg'), 0)
+        self.assertEqual(build_variants('variants/uploads/photo.jpg-800w.webp'), 0)
+        with self.assertLogs('core.images', 'WARNING'):
+            self.assertEqual(build_variants('uploads/missing.jpg'), 0)
+
+    def test_exif_rotation_and_transparency(self):
+        """Поворот из EXIF применяется, прозрачный PNG в JPEG ложится на белый фон"""
+        image = Image.new('RGB', (1000, 600))
+        exif = image.getexif()
+        exif[0x0112] = 6
+        image.save(Path(self.media) / 'uploads' / 'rotated.jpg', exif=exif)
+        Image.new('RGBA', (1000, 600), (0, 0, 0, 0)).save(Path(self.media) / 'uploads' / 'logo.png')
+        build_variants('uploads/rotated.jpg')
+        build_variants('uploads/logo.png')
+        self.assertEqual(ImageVariant.objects.get(source='uploads/rotated.jpg', format='jpeg', width=480).height, 800)
+        with Image.open(Path(self.media) / 'variants' / 'uploads' / 'logo.png-480w.jpg') as jpeg:
+            self.assertEqual(jpeg.getpixel((10, 10)), (255, 255, 255))
+
+    def test_content_gets_picture_after_upload(self):
+        """Загрузка через CKEditor собирает копии, и текст страницы получает srcset"""
+        page = Page.objects.create(title='Фото', slug='foto', content='<p><img src="/media/uploads/new.jpg"></p>')
+        self.assertNotIn('srcset', page.content_html)
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 500)).save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            name = VariantFileSystemStorage().save('uploads/new.jpg', ContentFile(buffer.getvalue()))
+        self.assertEqual(name, 'uploads/new.jpg')
+        page.refresh_from_db()
+        self.assertEqual(page.content_html, (
+            '<p><picture><source type="image/webp" '
+            'srcset="/media/variants/uploads/new.jpg-480w.webp 480w, /media/variants/uploads/new.jpg-800w.webp 800w" '
+            'sizes="(max-width: 800px) 100vw, 800px">'
+            '<img src="/media/uploads/new.jpg" loading="lazy" decoding="async" width="1000" height="500" '
+            'srcset="/media/variants/uploads/new.jpg-480w.jpg 480w, /media/variants/uploads/new.jpg-800w.jpg 800w" '
+            'sizes="(max-width: 800px) 100vw, 800px"></picture></p>'
+        ))
+
+    @override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+    def test_og_image_points_to_variant(self):
+        """og:image отдаёт копию шириной до 1200px; тег srcset выводит атрибуты"""
+        SiteSettings.get_settings()
+        with self.captureOnCommitCallbacks(execute=True):
+            page = Page.objects.create(title='Скупка', slug='skupka', page_type='skupka',
+                                       og_image='uploads/photo.jpg')
+        response = self.client.get('/skupka/')
+        self.assertContains(response, '/media/variants/uploads/photo.jpg-1200w.jpg">', count=2)
+        rendered = Template('{% load responsive %}<img{% srcset page.og_image "50vw" "webp" %}>').render(
+            Context({'page': page}))
+        self.assertIn('480w, /media/variants/uploads/photo.jpg-800w.webp 800w', rendered)
+        self.assertTrue(rendered.endswith(' 1200w" sizes="50vw">'))
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=(320,), IMAGE_VARIANT_WORKERS=2)
+class ImageVariantPoolTest(CacheIsolationMixin, TransactionTestCase):
+    """Сборка копий в пуле потоков и команда build_image_variants"""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        for name in ('a.jpg', 'b.png'):
+            Image.new('RGB', (640, 480)).save(Path(self.media) / name)
+
+    def test_pool_builds_after_commit(self):
+        schedule_variants('a.jpg')
+        wait_for_variants(timeout=30)
+        self.assertEqual(ImageVariant.objects.filter(source='a.jpg').count(), 2)
+
+    def test_backfill_command(self):
+        out = StringIO()
+        call_command('build_image_variants', workers=1, stdout=out)
+        self.assertIn('Картинок: 2, новых копий: 4', out.getvalue())
+        call_command('build_image_variants', workers=1, stdout=out)
+        self.assertIn('Картинок: 2, новых копий: 0', out.getvalue())
+
+
+@override_settings(STORAGES=SIMPLE_STATIC_STORAGES)
+class BenchTest(CacheIsolationMixin, TestCase):
+    """manage.py bench: сценарии на засеянных данных и сравнение с эталоном"""
+
+    def test_run_bench(self):
+        slugs = seed(pages=3, leads=20)
+        leads = ContactRequest.objects.count()
+        results = run_bench(slugs, iterations=3, warmup=1)
+        self.assertEqual(set(results), {
+            'home_page', 'home_page:cold', 'page_detail', 'page_detail:cold', 'privacy_page',
+            'privacy_page:cold', 'submit_contact', 'sitemap', 'sitemap:cold', 'robots_txt',
+        })
+        for name, summary in results.items():
+            self.assertEqual(summary['status'], {'200': 3}, name)
+            self.assertGreater(summary['bytes']['mean'], 0, name)
+        # Тёплая главная отдаётся из полностраничного кеша без запросов к БД
+        self.assertEqual(results['home_page']['queries']['max'], 0)
+        self.assertGreater(results['home_page:cold']['queries']['mean'], 0)
+        self.assertGreater(results['home_page:cold']['template_ms']['p50'], 0)
+        # Заявки прошли через заглушку reCAPTCHA и сохранены
+        self.assertEqual(ContactRequest.objects.count(), leads + 4)
+
+    def test_compare_flags_regressions(self):
+        def summary(latency, queries, size):
+            spread = {'p50': latency, 'p95': latency, 'p99': latency, 'mean': latency}
+            return {'latency_ms': spread, 'sql_ms': dict(spread, p50=0.1), 'template_ms': dict(spread, p50=0.1),
+                    'queries': {'mean': queries, 'max': queries}, 'bytes': {'mean': size, 'max': size}}
+
+        baseline = {'home_page': summary(10.0, 2, 1000), 'robots_txt': summary(0.5, 0, 80)}
+        current = {'home_page': summary(14.0, 3, 1005), 'robots_txt': summary(0.9, 0, 80),
+                   'sitemap': summary(5.0, 1, 100)}
+        flagged = {(r['scenario'], r['metric']) for r in compare(current, baseline, threshold=0.25)}
+        # robots_txt вырос на 80%, но всего на 0.4 мс — это шум; sitemap нет в эталоне
+        self.assertEqual(flagged, {
+            ('home_page', 'latency_ms.p50'), ('home_page', 'latency_ms.p95'),
+            ('home_page', 'latency_ms.p99'), ('home_page', 'queries.mean'),
+        })
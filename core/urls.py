@@ -7,5 +7,6 @@ urlpatterns = [
     path('', views.home_page, name='home'),
     path('submit-contact/', views.submit_contact, name='submit_contact'),
     path('privacy/', views.privacy_page, name='privacy'),
+    path('search/', views.search_page, name='search'),
     path('<slug:slug>/', views.page_detail, name='page_detail'),
 ]
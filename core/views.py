@@ -1,12 +1,89 @@
+import hashlib
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.http import JsonResponse, HttpResponse
-from django.views.decorators.http import require_POST, require_GET
+from django.views.decorators.http import condition, require_GET, require_http_methods
 from django.views.decorators.cache import cache_control
+from django.middleware.csrf import get_token
+from django.conf import settings as django_settings
 from django.contrib import messages
+from django.contrib.sitemaps.views import sitemap
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
 from django.urls import reverse
-from .models import Page, SiteSettings
+from .cache import PAGE_CACHE_VERSIONS, build_fingerprint, cache_page_response, get_version, sync_snapshots
+from .models import Page, SiteSettings, ContactRequest
 from .forms import ContactForm
-from .services import send_telegram_notification, verify_recaptcha
+from .search import search_pages
+from .services import (
+    contact_rate_limited, enqueue_telegram_notification, is_duplicate_contact, verify_recaptcha,
+)
+
+
+def content_validators(request, slug=None):
+    """(ETag, Last-Modified) для страницы `slug` или для всего сайта (slug=None).
+
+    Считаются по updated_at без загрузки полей Page и кешируются на текущую
+    версию контента, так что повторная проверка обходится без запросов к БД.
+    В ETag входит и отпечаток сборки: после деплоя новых шаблонов браузер
+    получает страницу заново, а не 304.
+    """
+    memo = getattr(request, '_content_validators', None)
+    if memo is not None and memo[0] == slug:
+        return memo[1]
+
+    versions = {name: get_version(name) for name in PAGE_CACHE_VERSIONS}
+    stamp = ':'.join(str(versions[name]) for name in PAGE_CACHE_VERSIONS)
+    key = 'core:validators:' + hashlib.md5(f'{stamp}:{slug}'.encode('utf-8')).hexdigest()
+    state = cache.get(key)
+    if state is None:
+        sync_snapshots(versions)
+        state = _load_content_state(slug)
+        cache.set(key, state, getattr(django_settings, 'PAGE_CACHE_TIMEOUT', 86400))
+
+    fingerprint, last_modified = state
+    etag = None
+    if fingerprint is not None:
+        raw = f'{fingerprint}:{build_fingerprint()}:{request.scheme}:{request.get_host()}'
+        etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    validators = (etag, last_modified)
+    request._content_validators = (slug, validators)
+    return validators
+
+
+def _load_content_state(slug):
+    site = SiteSettings.get_settings()
+    if slug is None:
+        stats = Page.objects.filter(is_published=True).aggregate(last=Max('updated_at'), total=Count('pk'))
+        updated_at = stats['last']
+        marker = f'{updated_at}:{stats["total"]}'
+    else:
+        updated_at = Page.objects.filter(slug=slug, is_published=True).values_list(
+            'updated_at', flat=True
+        ).first()
+        if updated_at is None:
+            return None, None
+        marker = str(updated_at)
+    fingerprint = f'{slug}:{marker}:{site.version}:{Page.get_menu().version}'
+    last_modified = max(filter(None, [updated_at, site.updated_at]))
+    return fingerprint, last_modified
+
+
+def page_etag(request, slug=None):
+    return content_validators(request, slug)[0]
+
+
+def page_last_modified(request, slug=None):
+    return content_validators(request, slug)[1]
+
+
+def site_etag(request, **kwargs):
+    return content_validators(request)[0]
+
+
+def site_last_modified(request, **kwargs):
+    return content_validators(request)[1]
 
 
 def privacy_page(request):
@@ -28,9 +105,35 @@ def privacy_page(request):
     })
 
 
+@require_GET
+def search_page(request):
+    """Поиск по страницам сайта"""
+    class StaticPage:
+        def get_meta_title(self):
+            return 'Поиск по сайту'
+        meta_description = ''
+        meta_keywords = ''
+        og_image = None
+    query = ' '.join(request.GET.get('q', '').split())[:100]
+    site_url = request.build_absolute_uri('/')
+    seo_breadcrumbs = [
+        {'name': 'Главная', 'url': site_url},
+        {'name': 'Поиск', 'url': request.build_absolute_uri(reverse('core:search'))},
+    ]
+    return render(request, 'pages/search.html', {
+        'page': StaticPage(),
+        'seo_breadcrumbs': seo_breadcrumbs,
+        'query': query,
+        'results': search_pages(query) if query else [],
+    })
+
+
+@condition(etag_func=page_etag, last_modified_func=page_last_modified)
+@cache_page_response
 def home_page(request):
     """Главная страница"""
-    page = Page.objects.filter(slug='home', is_published=True).first()
+    # Исходный HTML редактора не нужен: шаблон выводит готовый content_html
+    page = Page.objects.defer('content').filter(slug='home', is_published=True).first()
     
     if not page:
         page = Page(
@@ -47,7 +150,7 @@ def home_page(request):
     service_pages = Page.objects.filter(
         is_published=True,
         page_type__in=['skupka', 'remont']
-    ).order_by('order')[:6]
+    ).only('title', 'slug', 'hero_subtitle').order_by('order')[:6]
     
     site_url = request.build_absolute_uri('/')
     seo_breadcrumbs = [{'name': 'Главная', 'url': site_url}]
@@ -60,9 +163,11 @@ def home_page(request):
     })
 
 
+@condition(etag_func=page_etag, last_modified_func=page_last_modified)
+@cache_page_response
 def page_detail(request, slug):
     """Детальная страница"""
-    page = get_object_or_404(Page, slug=slug, is_published=True)
+    page = get_object_or_404(Page.objects.defer('content'), slug=slug, is_published=True)
     form = ContactForm(page=page, page_url=request.path)
     site_url = request.build_absolute_uri('/')
     seo_breadcrumbs = [
@@ -76,13 +181,41 @@ def page_detail(request, slug):
     })
 
 
-@require_POST
+@condition(etag_func=site_etag, last_modified_func=site_last_modified)
+def sitemap_xml(request, sitemaps):
+    """sitemap.xml с ETag/Last-Modified по времени изменения страниц"""
+    return sitemap(request, sitemaps)
+
+
+@require_http_methods(['GET', 'POST'])
 def submit_contact(request):
     """Обработка формы обратной связи (AJAX)"""
     
+    if request.method == 'GET':
+        # Страницам из export_static нужен CSRF-cookie перед отправкой формы
+        get_token(request)
+        response = HttpResponse(status=204)
+        response['Cache-Control'] = 'no-store'
+        return response
+    
     recaptcha_token = request.POST.get('g-recaptcha-response', '')
     client_ip = get_client_ip(request)
     
+    # Повтор уже принятой формы (двойной клик, повтор после таймаута):
+    # отвечаем так же, как в первый раз, до лимита заявок и повторной проверки reCAPTCHA
+    idempotency_key = request.POST.get('idempotency_key', '')
+    if idempotency_key and ContactRequest.objects.filter(idempotency_key=idempotency_key).exists():
+        return contact_accepted(request)
+    
+    if contact_rate_limited(client_ip, request.POST.get('phone', '')):
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return JsonResponse({
+                'success': False,
+                'errors': {'__all__': ['Слишком много заявок. Попробуйте позже или позвоните нам.']}
+            }, status=429)
+        messages.error(request, 'Слишком много заявок. Попробуйте позже.')
+        return redirect(request.POST.get('page_url', '/'))
+    
     recaptcha_valid, recaptcha_score = verify_recaptcha(recaptcha_token, client_ip)
     
     if not recaptcha_valid:
@@ -104,17 +237,21 @@ def submit_contact(request):
     )
     
     if form.is_valid():
-        contact_request = form.save()
+        contact_request = form.save(commit=False)
+        if is_duplicate_contact(contact_request):
+            return contact_accepted(request)
         
-        send_telegram_notification(contact_request)
+        # Заявка и уведомление фиксируются вместе; в Telegram отправит воркер
+        try:
+            with transaction.atomic():
+                contact_request.save()
+                enqueue_telegram_notification(contact_request)
+        except IntegrityError:
+            # Параллельный повтор с тем же ключом идемпотентности успел раньше
+            if not ContactRequest.objects.filter(idempotency_key=contact_request.idempotency_key).exists():
+                raise
         
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({
-                'success': True,
-                'message': 'Спасибо! Ваша заявка отправлена. Мы свяжемся с вами в ближайшее время.'
-            })
-        messages.success(request, 'Спасибо! Ваша заявка отправлена. Мы свяжемся с вами в ближайшее время.')
-        return redirect(request.POST.get('page_url', '/'))
+        return contact_accepted(request)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -126,6 +263,17 @@ def submit_contact(request):
     return redirect(request.POST.get('page_url', '/'))
 
 
+def contact_accepted(request):
+    """Ответ об успешно принятой заявке"""
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'success': True,
+            'message': 'Спасибо! Ваша заявка отправлена. Мы свяжемся с вами в ближайшее время.'
+        })
+    messages.success(request, 'Спасибо! Ваша заявка отправлена. Мы свяжемся с вами в ближайшее время.')
+    return redirect(request.POST.get('page_url', '/'))
+
+
 def get_client_ip(request):
     """Получает IP адрес клиента"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
@@ -144,6 +292,7 @@ def robots_txt(request):
     content = (
         'User-agent: *\n'
         'Allow: /\n'
+        'Disallow: /search/\n'
         f'Sitemap: {sitemap_url}\n'
     )
     return HttpResponse(content, content_type='text/plain; charset=utf-8')
@@ -3,28 +3,72 @@
 """
 Скрипт деплоя на FTP.
 Режимы:
-  - Обычный: загрузка файлов по FTP
-  - Архив: DEPLOY_ARCHIVE=1 — собирает tar.gz, загружает один файл, распаковка на сервере
+  - Обычный: загрузка по FTP только новых и изменённых файлов
+  - Архив: DEPLOY_ARCHIVE=1 — tar.gz сразу уходит на FTP одним файлом, распаковка на сервере
+
+На сервере лежит .deploy-manifest.json с хешами загруженных файлов;
+сверка с ним определяет, что загружать. В обычном режиме файлы идут
+параллельно по нескольким соединениям, каталоги создаются по одному разу.
+Файлы архива записываются в манифест отдельно и считаются загруженными
+только после распаковки: её подтверждает метка .deploy-archive.json из архива.
+Архив не пишется на диск: tar сжимается pigz (на всех ядрах, если
+установлен) или gzip и по мере сжатия отправляется на сервер. Оборванная
+загрузка продолжается с места обрыва (REST), в том числе при новом запуске.
 
 Переменные: FTP_HOST, FTP_USER, FTP_PASS, FTP_REMOTE_DIR
+  DEPLOY_FTP_WORKERS — число параллельных соединений (по умолчанию 4)
+  DEPLOY_DELETE=1    — удалить с сервера файлы, которых больше нет локально (кроме media/)
+  DEPLOY_DELETE_MEDIA=1 — вместе с DEPLOY_DELETE удалять и файлы из media/
+  DEPLOY_FULL=1      — загрузить всё, не сверяясь с манифестом на сервере
+  DEPLOY_DELTA=1     — в архив только файлы, изменённые с прошлого деплоя
 """
+import gzip
+import hashlib
+import io
+import json
 import os
+import queue
+import shutil
 import sys
 import subprocess
 import tarfile
-import tempfile
-from pathlib import Path
-from ftplib import FTP
+import threading
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from ftplib import FTP, all_errors, error_perm
 
 # Каталоги и файлы, которые НЕ загружаем
 EXCLUDE = {
-    'venv', '__pycache__', '.git', 'node_modules',
+    'venv', '__pycache__', '.git', 'node_modules', 'archive',
     '.idea', '.vscode', '*.log',
 }
-EXCLUDE_FILES = {'.env', 'db.sqlite3', 'db.sqlite3-journal'}
+EXCLUDE_FILES = {'.env', 'db.sqlite3', 'db.sqlite3-journal', 'db.sqlite3-wal', 'db.sqlite3-shm'}
 
 # Файлы в корне, которые загружаем
 INCLUDE_FILES = {'manage.py', 'index.wsgi', 'requirements.txt', '.env.example'}
+# Каталоги, которые загружаем
+INCLUDE_DIRS = ['config', 'core', 'templates', 'static', 'staticfiles', 'media']
+# Загрузки из админки (CKEditor, og_image) есть только на сервере: из этих каталогов
+# DEPLOY_DELETE ничего не удаляет без отдельного DEPLOY_DELETE_MEDIA=1
+UPLOAD_DIRS = {'media'}
+
+# Манифест загруженных файлов на сервере: {"files": {путь: sha256}}
+MANIFEST_NAME = '.deploy-manifest.json'
+
+ARCHIVE_NAME = 'deploy.tar.gz'
+# Архив грузится под временным именем и переименовывается после загрузки;
+# рядом лежит идентификатор содержимого, по которому продолжают загрузку
+ARCHIVE_PART_NAME = ARCHIVE_NAME + '.part'
+ARCHIVE_STATE_NAME = ARCHIVE_NAME + '.json'
+# Кладётся в архив с его идентификатором: после распаковки файл оказывается
+# на сервере, и следующий запуск узнаёт, что архив распакован
+ARCHIVE_MARKER_NAME = '.deploy-archive.json'
+ARCHIVE_ATTEMPTS = 5
+BLOCK_SIZE = 256 * 1024
+
+
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
 
 
 def should_exclude(path: Path, base: Path) -> bool:
@@ -39,88 +83,66 @@ def should_exclude(path: Path, base: Path) -> bool:
     return False
 
 
-def ensure_remote_path(ftp: FTP, base: str, path: str) -> None:
-    """Создаёт вложенные каталоги по пути (cwd в каждый уровень)."""
-    ftp.cwd(base)
-    for part in path.rstrip('/').split('/'):
-        if not part:
-            continue
-        try:
-            ftp.cwd(part)
-        except Exception:
-            try:
-                ftp.mkd(part)
-            except Exception:
-                pass
-            ftp.cwd(part)
-    ftp.cwd(base)
+def collect_files(base: Path, dirs, files) -> dict:
+    """{путь относительно base в виде a/b.py: локальный Path} для загрузки."""
+    result = {}
+    for name in sorted(files):
+        f = base / name
+        if f.is_file():
+            result[name] = f
+    for dirname in dirs:
+        d = base / dirname
+        if d.is_dir():
+            for item in sorted(d.rglob('*')):
+                if item.is_file() and not should_exclude(item, base):
+                    result[item.relative_to(base).as_posix()] = item
+    return result
 
 
-def upload_dir(ftp: FTP, local: Path, remote: str, project_root: Path, remote_base: str):
-    """Рекурсивно загружает каталог."""
-    for item in sorted(local.iterdir()):
-        if should_exclude(item, project_root):
-            continue
-        rel = item.relative_to(local)
-        remote_path = f"{remote}/{rel}".replace('\\', '/')
-        if item.is_dir():
-            ensure_remote_path(ftp, remote_base, remote_path)
-            upload_dir(ftp, item, remote_path, project_root, remote_base)
-        else:
-            parent = '/'.join(remote_path.split('/')[:-1])
-            filename = remote_path.split('/')[-1]
-            if parent:
-                ensure_remote_path(ftp, remote_base, parent)
-            try:
-                ftp.cwd(remote_base)
-                for part in parent.split('/'):
-                    if part:
-                        ftp.cwd(part)
-                with open(item, 'rb') as f:
-                    ftp.storbinary(f'STOR {filename}', f)
-                print(f"  ↑ {remote_path}")
-            except Exception as e:
-                print(f"  ✗ {remote_path}: {e}")
-
-
-def create_archive(base: Path) -> Path:
-    """Создаёт tar.gz с проектом (без venv, .git, .env и т.д.)."""
-    archive_name = base / 'deploy.tar.gz'
-    if archive_name.exists():
-        archive_name.unlink()
-    dirs = ['config', 'core', 'templates', 'static', 'staticfiles', 'media']
-    files = ['manage.py', 'index.wsgi', 'requirements.txt', '.env.example']
-    with tarfile.open(archive_name, 'w:gz') as tar:
-        for name in files:
-            f = base / name
-            if f.exists():
-                tar.add(f, arcname=name)
-        for dirname in dirs:
-            d = base / dirname
-            if d.exists() and d.is_dir():
-                for item in d.rglob('*'):
-                    if should_exclude(item, base):
-                        continue
-                    if item.is_file():
-                        arcname = item.relative_to(base)
-                        tar.add(item, arcname=str(arcname))
-    return archive_name
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
-def deploy_via_archive(base: Path, host: str, user: str, password: str, remote_dir: str) -> None:
-    """Сбор статики → архив → загрузка на FTP."""
-    print("1. Сбор статики...")
-    subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput', '--clear'], check=True)
-    print("2. Создание архива deploy.tar.gz...")
-    archive = create_archive(base)
-    size_mb = archive.stat().st_size / (1024 * 1024)
-    print(f"   Размер: {size_mb:.1f} МБ")
-    print("3. Подключение к FTP...")
+def plan_upload(local: dict, remote: dict, scope) -> tuple:
+    """(пути для загрузки, пути только на сервере) по хешам {путь: sha256}.
+
+    `scope` — каталоги и корневые файлы этого деплоя: файлы вне них
+    (например, весь проект при DEPLOY_STATICFILES_ONLY=1) не удаляются.
+    """
+    changed = sorted(rel for rel, digest in local.items() if remote.get(rel) != digest)
+    removed = sorted(rel for rel in remote if rel not in local
+                     and any(rel == s or rel.startswith(s + '/') for s in scope))
+    return changed, removed
+
+
+def delete_scope(dirs, files) -> list:
+    """Каталоги и корневые файлы, из которых можно удалять то, чего нет локально."""
+    keep = set() if env_flag('DEPLOY_DELETE_MEDIA') else UPLOAD_DIRS
+    return [d for d in dirs if d not in keep] + sorted(files)
+
+
+def remote_dirs(paths) -> list:
+    """Все каталоги для путей, родители раньше детей."""
+    dirs = set()
+    for rel in paths:
+        dirs.update(p.as_posix() for p in PurePosixPath(rel).parents if p.as_posix() != '.')
+    return sorted(dirs, key=lambda d: (d.count('/'), d))
+
+
+def open_ftp(host: str, user: str, password: str, remote_dir: str) -> FTP:
+    """Соединение, уже перешедшее в remote_dir (каталог создаётся при необходимости)."""
     ftp = FTP(host, user, password)
     ftp.encoding = 'utf-8'
     try:
         ftp.cwd(remote_dir)
     except Exception:
+        # Создаём путь по частям
+        if remote_dir.startswith('/'):
+            ftp.cwd('/')
         for part in remote_dir.strip('/').split('/'):
             if part:
                 try:
@@ -128,17 +150,372 @@ def deploy_via_archive(base: Path, host: str, user: str, password: str, remote_d
                 except Exception:
                     pass
                 ftp.cwd(part)
-    print("4. Загрузка deploy.tar.gz...")
-    with open(archive, 'rb') as f:
-        ftp.storbinary('STOR deploy.tar.gz', f)
+    return ftp
+
+
+def read_remote_json(ftp: FTP, name: str) -> dict:
+    """JSON-файл с сервера; нет файла или он повреждён — пустой словарь."""
+    buffer = io.BytesIO()
+    try:
+        ftp.retrbinary(f'RETR {name}', buffer.write)
+    except error_perm:
+        return {}
+    try:
+        return json.loads(buffer.getvalue().decode('utf-8'))
+    except ValueError:
+        print(f"  ! {name} на сервере повреждён")
+        return {}
+
+
+def write_remote_json(ftp: FTP, name: str, data: dict) -> None:
+    content = json.dumps(data, ensure_ascii=False, sort_keys=True, indent=0).encode('utf-8')
+    ftp.storbinary(f'STOR {name}', io.BytesIO(content))
+
+
+def read_remote_manifest(ftp: FTP) -> dict:
+    """{'files': {путь: sha256}, 'pending': нераспакованный архив {'id', 'files'}}"""
+    return read_remote_json(ftp, MANIFEST_NAME)
+
+
+def write_remote_manifest(ftp: FTP, files: dict, pending=None) -> None:
+    data = {'files': files}
+    if pending:
+        data['pending'] = pending
+    write_remote_json(ftp, MANIFEST_NAME, data)
+
+
+def confirm_extracted(ftp: FTP, manifest: dict) -> tuple:
+    """(файлы на сервере, нераспакованный архив или None).
+
+    Файлы архива переходят в манифест только тогда, когда на сервере появилась
+    его метка ARCHIVE_MARKER_NAME, то есть архив действительно распакован.
+    """
+    files, pending = manifest.get('files', {}), manifest.get('pending')
+    if pending and read_remote_json(ftp, ARCHIVE_MARKER_NAME).get('id') == pending['id']:
+        files, pending = {**files, **pending['files']}, None
+        write_remote_manifest(ftp, files)
+        print("   Архив прошлого деплоя распакован: его файлы отмечены в манифесте")
+    return files, pending
+
+
+def make_dirs(ftp: FTP, dirs, existing) -> None:
+    """Создаёт каталоги по одному разу; известные по манифесту пропускаются."""
+    for d in dirs:
+        if d in existing:
+            continue
+        try:
+            ftp.mkd(d)
+        except error_perm:
+            pass  # уже есть
+
+
+def upload_files(connect, files: dict, paths, workers: int) -> set:
+    """Загружает пути из `files` по `workers` соединениям; возвращает загруженные."""
+    jobs = queue.Queue()
+    for rel in paths:
+        jobs.put(rel)
+    done = set()
+    lock = threading.Lock()
+
+    def worker():
+        ftp = None
+        while True:
+            try:
+                rel = jobs.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                ftp = ftp or connect()
+                with open(files[rel], 'rb') as f:
+                    ftp.storbinary(f'STOR {rel}', f)
+            except all_errors as e:
+                print(f"  ✗ {rel}: {e}")
+                # Соединение могло оборваться: следующий файл пойдёт по новому
+                if ftp is not None:
+                    ftp.close()
+                ftp = None
+                continue
+            print(f"  ↑ {rel}")
+            with lock:
+                done.add(rel)
+        if ftp is not None:
+            try:
+                ftp.quit()
+            except all_errors:
+                ftp.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(workers, len(paths))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return done
+
+
+def deploy_via_ftp(base: Path, host: str, user: str, password: str, remote_dir: str,
+                   staticfiles_only: bool = False) -> None:
+    """Загрузка по FTP только того, что изменилось с прошлого деплоя."""
+    dirs = ['staticfiles'] if staticfiles_only else INCLUDE_DIRS
+    root_files = set() if staticfiles_only else INCLUDE_FILES
+    workers = int(os.environ.get('DEPLOY_FTP_WORKERS', '4'))
+
+    print("2. Подсчёт хешей...")
+    files = collect_files(base, dirs, root_files)
+    local = {rel: file_hash(path) for rel, path in files.items()}
+
+    print("3. Подключение к FTP...")
+
+    def connect():
+        return open_ftp(host, user, password, remote_dir)
+
+    ftp = connect()
+    stored = read_remote_manifest(ftp)
+    remote, pending = confirm_extracted(ftp, stored)
+    changed, removed = plan_upload(local, remote, delete_scope(dirs, root_files))
+    existing_dirs = set(remote_dirs(remote))
+    if env_flag('DEPLOY_FULL'):
+        changed, existing_dirs = sorted(local), set()
+    print(f"   Файлов: {len(local)}, к загрузке: {len(changed)}, только на сервере: {len(removed)}")
+
+    print(f"4. Загрузка файлов ({workers} соединений)...")
+    make_dirs(ftp, remote_dirs(changed), existing_dirs)
+    # Пока идёт загрузка, управляющее соединение простаивало бы и отвалилось по таймауту
+    ftp.quit()
+    uploaded = upload_files(connect, files, changed, workers)
+    ftp = connect()
+    # Неудачные файлы сохраняют старый хеш и уйдут в следующий раз
+    manifest = dict(remote)
+    manifest.update((rel, local[rel]) for rel in uploaded)
+
+    if removed and env_flag('DEPLOY_DELETE'):
+        print("5. Удаление лишних файлов...")
+        for rel in removed:
+            try:
+                ftp.delete(rel)
+                print(f"  − {rel}")
+            except error_perm as e:
+                print(f"  ✗ {rel}: {e}")
+                continue
+            manifest.pop(rel, None)
+    elif removed:
+        print(f"5. На сервере остались {len(removed)} файлов, которых нет локально (удалить: DEPLOY_DELETE=1)")
+
+    failed = len(changed) - len(uploaded)
+    if pending and not failed and not staticfiles_only:
+        # Всё, что было в нераспакованном архиве, уже загружено напрямую:
+        # распаковка устаревшего архива откатила бы эти файлы
+        try:
+            ftp.delete(ARCHIVE_NAME)
+            print(f"   Удалён нераспакованный {ARCHIVE_NAME} прошлого деплоя (его файлы загружены сейчас)")
+        except error_perm:
+            pass
+        pending = None
+    elif pending:
+        print(f"   ! На сервере ждёт распаковки {ARCHIVE_NAME}: он старее загруженных сейчас файлов, не распаковывайте его")
+
+    if manifest != stored.get('files', {}) or pending != stored.get('pending'):
+        write_remote_manifest(ftp, manifest, pending)
+    ftp.quit()
+    if failed:
+        print(f"Готово с ошибками: не загружено {failed} файлов, запустите деплой ещё раз.")
+        sys.exit(1)
+    print("Готово.")
+
+
+def write_tar(fileobj, files: dict, extra=None) -> None:
+    """tar из `files` {путь в архиве: Path} и `extra` {путь: bytes}: при тех же данных байты те же."""
+    with tarfile.open(fileobj=fileobj, mode='w|') as tar:
+        for rel in sorted(files):
+            tar.add(files[rel], arcname=rel)
+        for rel, content in sorted((extra or {}).items()):
+            info = tarfile.TarInfo(rel)
+            info.size, info.mode = len(content), 0o644
+            tar.addfile(info, io.BytesIO(content))
+
+
+def archive_marker(stream_id: str) -> dict:
+    return {ARCHIVE_MARKER_NAME: json.dumps({'id': stream_id}).encode('utf-8')}
+
+
+def compressor_command():
+    """pigz (сжимает на всех ядрах) или None — тогда gzip в этом процессе.
+
+    -n убирает из заголовка имя и время: поток зависит только от содержимого,
+    иначе продолжить загрузку с места обрыва было бы нельзя.
+    """
+    pigz = shutil.which('pigz')
+    return [pigz, '-6', '-n'] if pigz else None
+
+
+class ArchiveError(Exception):
+    """Архив не собран или не совпал с частью на сервере: продолжать нельзя."""
+
+
+@contextmanager
+def archive_stream(files: dict, command=None, extra=None):
+    """Поток tar.gz для чтения; tar пишется в отдельном потоке, на диск ничего не попадает.
+
+    Если сборка не удалась, после чтения потока бросается ArchiveError.
+    """
+    if command:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        writer, reader = process.stdin, process.stdout
+    else:
+        process = None
+        read_fd, write_fd = os.pipe()
+        writer, reader = os.fdopen(write_fd, 'wb'), os.fdopen(read_fd, 'rb')
+    errors = []
+
+    def produce():
+        try:
+            if process:
+                write_tar(writer, files, extra)
+            else:
+                with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=6, mtime=0) as gz:
+                    write_tar(gz, files, extra)
+        except BrokenPipeError:
+            pass  # чтение прервано: загрузка оборвалась
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                writer.close()
+            except BrokenPipeError:
+                pass
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        yield reader
+        thread.join()
+        if process and process.wait() != 0:
+            errors.append(f'{command[0]} завершился с кодом {process.returncode}')
+        if errors:
+            raise ArchiveError(f'архив не собран: {errors[0]}')
+    finally:
+        reader.close()
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+        thread.join()
+
+
+def archive_id(files: dict, local: dict, command) -> str:
+    """Идентификатор байтов архива: содержимое и метаданные файлов (они есть в tar) и чем сжимали."""
+    entries = []
+    for rel in sorted(files):
+        stat = files[rel].stat()
+        entries.append([rel, local[rel], stat.st_mtime, stat.st_mode])
+    key = json.dumps([command[0] if command else 'gzip', entries])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def resume_offset(ftp: FTP, stream_id: str, resume: bool = True) -> int:
+    """С какого байта продолжать: недогруженная часть того же архива или 0."""
+    if resume and read_remote_json(ftp, ARCHIVE_STATE_NAME).get('id') == stream_id:
+        try:
+            ftp.voidcmd('TYPE I')
+            return ftp.size(ARCHIVE_PART_NAME) or 0
+        except error_perm:
+            return 0
+    write_remote_json(ftp, ARCHIVE_STATE_NAME, {'id': stream_id})
+    return 0
+
+
+def skip(stream, count: int) -> None:
+    while count:
+        chunk = stream.read(min(count, BLOCK_SIZE))
+        if not chunk:
+            raise ArchiveError('на сервере больше данных, чем в архиве')
+        count -= len(chunk)
+
+
+def upload_archive(connect, files: dict, stream_id: str, command=None, attempts: int = ARCHIVE_ATTEMPTS) -> int:
+    """Загружает архив с повторами, каждый раз продолжая с места обрыва; возвращает размер."""
+    resume = True
+    for attempt in range(1, attempts + 1):
+        ftp = None
+        try:
+            ftp = connect()
+            offset = resume_offset(ftp, stream_id, resume)
+            if offset:
+                print(f"   Продолжаем с {offset / (1024 * 1024):.1f} МБ")
+            sent = []
+            with archive_stream(files, command, archive_marker(stream_id)) as stream:
+                skip(stream, offset)
+                ftp.storbinary(f'STOR {ARCHIVE_PART_NAME}', stream, BLOCK_SIZE,
+                               lambda block: sent.append(len(block)), rest=offset or None)
+            # Нераспакованный прошлый архив можно заменить: новый собран относительно
+            # подтверждённого манифеста и содержит и его файлы
+            try:
+                ftp.delete(ARCHIVE_NAME)
+            except error_perm:
+                pass  # прошлый архив распакован и удалён
+            ftp.rename(ARCHIVE_PART_NAME, ARCHIVE_NAME)
+            ftp.delete(ARCHIVE_STATE_NAME)
+            ftp.quit()
+            return offset + sum(sent)
+        except (*all_errors, ArchiveError) as e:
+            print(f"  ✗ попытка {attempt}: {e}")
+            if ftp is not None:
+                ftp.close()
+            # Сервер отказал (например, не умеет REST) или часть на сервере испорчена:
+            # следующая попытка грузит архив с нуля
+            if isinstance(e, (error_perm, ArchiveError)):
+                resume = False
+    raise ArchiveError(f"архив не загружен за {attempts} попыток")
+
+
+def deploy_via_archive(base: Path, host: str, user: str, password: str, remote_dir: str) -> None:
+    """Сбор статики → tar.gz потоком на FTP (целиком или только изменения)."""
+    print("1. Сбор статики...")
+    subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput'], check=True)
+    print("2. Подсчёт хешей...")
+    files = collect_files(base, INCLUDE_DIRS, INCLUDE_FILES)
+    local = {rel: file_hash(path) for rel, path in files.items()}
+
+    def connect():
+        return open_ftp(host, user, password, remote_dir)
+
+    print("3. Подключение к FTP...")
+    ftp = connect()
+    remote, pending = confirm_extracted(ftp, read_remote_manifest(ftp))
+    if pending:
+        print(f"   Прошлый {ARCHIVE_NAME} ещё не распакован: новый архив заменит его и включит его файлы")
+    ftp.quit()
+    delta = env_flag('DEPLOY_DELTA')
+    if delta:
+        # Сверка с подтверждённым манифестом: файлы нераспакованного архива тоже попадут в новый
+        changed, removed = plan_upload(local, remote, delete_scope(INCLUDE_DIRS, INCLUDE_FILES))
+        files = {rel: files[rel] for rel in changed}
+        print(f"   Изменено файлов: {len(files)} из {len(local)}")
+        if not files:
+            print("Изменений нет, загружать нечего.")
+            return
+    command = compressor_command()
+    print(f"4. Загрузка {ARCHIVE_NAME} (сжатие: {'pigz' if command else 'gzip'})...")
+    stream_id = archive_id(files, local, command)
+    try:
+        size = upload_archive(connect, files, stream_id, command)
+    except ArchiveError as e:
+        print(f"Ошибка: {e}. При следующем запуске загрузка продолжится с места обрыва.")
+        sys.exit(1)
+    print(f"   Загружено {size / (1024 * 1024):.1f} МБ")
+
+    # Файлы архива ждут распаковки отдельно: в манифест они попадут, когда на сервере появится метка
+    ftp = connect()
+    write_remote_manifest(ftp, remote, {'id': stream_id, 'files': {rel: local[rel] for rel in files}})
     ftp.quit()
-    archive.unlink()
     print("Готово.")
     print()
     print("На сервере распакуйте архив:")
     print("  • SSH: cd /home/s1150101/tomsk-skupka-shop.ru && tar -xzf deploy.tar.gz && rm deploy.tar.gz")
-    print("  • Панель хостинга: Файловый менеджер → deploy.tar.gz → Распаковать")
+    print("  • Панель хостинга: Файловый менеджер → deploy.tar.gz → Распаковать, затем удалите архив")
     print("  • Затем: python manage.py migrate && python manage.py load_initial_data && python manage.py createsuperuser")
+    if delta and removed:
+        print(f"Файлы, которых больше нет локально (удалите на сервере вручную): {len(removed)}")
+        for rel in removed:
+            print(f"  − {rel}")
 
 
 def main():
@@ -154,67 +531,19 @@ def main():
         print("Задайте пароль: export FTP_PASS='ваш_пароль'")
         sys.exit(1)
 
-    if os.environ.get('DEPLOY_ARCHIVE', '').lower() in ('1', 'true', 'yes'):
+    if env_flag('DEPLOY_ARCHIVE'):
         deploy_via_archive(base, host, user, password, remote_dir)
         return
 
-    staticfiles_only = os.environ.get('DEPLOY_STATICFILES_ONLY', '').lower() in ('1', 'true', 'yes')
+    staticfiles_only = env_flag('DEPLOY_STATICFILES_ONLY')
 
     if not staticfiles_only:
         print("1. Сбор статики...")
-        subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput', '--clear'], check=True)
+        subprocess.run([sys.executable, 'manage.py', 'collectstatic', '--noinput'], check=True)
     else:
         print("1. Только staticfiles (DEPLOY_STATICFILES_ONLY=1)")
 
-    print("2. Подключение к FTP...")
-    ftp = FTP(host, user, password)
-    ftp.encoding = 'utf-8'
-
-    print("3. Переход в каталог...")
-    try:
-        ftp.cwd(remote_dir)
-    except Exception:
-        # Создаём путь по частям
-        for part in remote_dir.strip('/').split('/'):
-            if part:
-                try:
-                    ftp.mkd(part)
-                except Exception:
-                    pass
-                ftp.cwd(part)
-
-    print("4. Загрузка файлов...")
-    # Загружаем корневые файлы (пропуск при staticfiles_only)
-    if not staticfiles_only:
-        for name in INCLUDE_FILES:
-            f = base / name
-            if f.exists():
-                with open(f, 'rb') as fp:
-                    ftp.storbinary(f'STOR {name}', fp)
-                print(f"  ↑ {name}")
-
-    # Загружаем каталоги
-    dirs_to_upload = ['staticfiles'] if staticfiles_only else ['config', 'core', 'templates', 'static', 'staticfiles', 'media']
-    for dirname in dirs_to_upload:
-        d = base / dirname
-        if d.exists() and d.is_dir():
-            try:
-                ftp.mkd(dirname)
-            except Exception:
-                pass
-            try:
-                ftp.cwd(dirname)
-            except Exception:
-                pass
-            upload_dir(ftp, d, dirname, base, remote_dir)
-            ftp.cwd('/')
-            try:
-                ftp.cwd(remote_dir)
-            except Exception:
-                pass
-
-    ftp.quit()
-    print("Готово.")
+    deploy_via_ftp(base, host, user, password, remote_dir, staticfiles_only)
 
 
 if __name__ == '__main__':
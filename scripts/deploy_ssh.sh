@@ -26,7 +26,7 @@ echo
 # 1. Сбор статики локально
 if [ "${SKIP_STATIC}" != "1" ]; then
     echo "1. Сбор статики..."
-    python manage.py collectstatic --noinput --clear
+    python manage.py collectstatic --noinput
     echo "   Готово."
 else
     echo "1. Пропуск collectstatic (SKIP_STATIC=1)"
@@ -41,6 +41,8 @@ rsync $RSYNC_OPTS \
   --exclude 'venv' \
   --exclude '.git' \
   --exclude 'db.sqlite3' \
+  --exclude 'db.sqlite3-wal' \
+  --exclude 'db.sqlite3-shm' \
   --exclude '.env' \
   --exclude '__pycache__' \
   --exclude '*.pyc' \
@@ -49,10 +51,18 @@ rsync $RSYNC_OPTS \
   --exclude '.idea' \
   --exclude '.vscode' \
   --exclude 'node_modules' \
+  --exclude 'archive/' \
+  --exclude '.cache/' \
+  --exclude 'public/' \
   --filter 'protect .env' \
   --filter 'protect db.sqlite3' \
+  --filter 'protect db.sqlite3-wal' \
+  --filter 'protect db.sqlite3-shm' \
   --filter 'protect venv/' \
   --filter 'protect tmp/' \
+  --filter 'protect archive/' \
+  --filter 'protect .cache/' \
+  --filter 'protect public/' \
   "$PROJECT_ROOT/" \
   "$SSH_SERVER:~/$REMOTE_PATH/"
 
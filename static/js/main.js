@@ -137,13 +137,26 @@ async function submitContactForm(form) {
     submitBtn.style.opacity = '0.7';
     
     try {
+        const keyInput = form.querySelector('[name="idempotency_key"]');
+        if (keyInput && !keyInput.value) {
+            // Статическая копия страницы: ключ повтора генерируем сами
+            keyInput.value = window.crypto && crypto.randomUUID
+                ? crypto.randomUUID().replace(/-/g, '')
+                : Date.now().toString(16) + Math.random().toString(16).slice(2);
+        }
         const formData = new FormData(form);
+        const headers = {
+            'X-Requested-With': 'XMLHttpRequest'
+        };
+        if (!formData.get('csrfmiddlewaretoken')) {
+            // Статическая копия страницы: берём CSRF-cookie у сервера
+            formData.delete('csrfmiddlewaretoken');
+            headers['X-CSRFToken'] = await getCsrfCookie(form.action);
+        }
         const response = await fetch(form.action, {
             method: 'POST',
             body: formData,
-            headers: {
-                'X-Requested-With': 'XMLHttpRequest'
-            }
+            headers: headers
         });
         
         const data = await response.json();
@@ -190,6 +203,17 @@ async function submitContactForm(form) {
     }
 }
 
+async function getCsrfCookie(url) {
+    const read = () => {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : '';
+    };
+    if (!read()) {
+        await fetch(url, { credentials: 'same-origin' });
+    }
+    return read();
+}
+
 function showNotification(message, type = 'info') {
     const existingNotification = document.querySelector('.notification');
     if (existingNotification) {